@@ -1,3 +1,5 @@
+import sys
+
 from pybuilder.core import use_plugin, init
 
 use_plugin("python.core")
@@ -40,10 +42,20 @@ def set_properties(project):
     project.depends_on("yamlreader")
     project.depends_on("bottle")
     project.depends_on("boto>=2.38.0")
+    if sys.version_info < (2, 7):
+        # collections.OrderedDict is new in Python 2.7
+        project.depends_on("ordereddict")
 
     project.set_property("verbose", True)
     project.set_property('flake8_include_test_sources', True)
     project.set_property('flake8_break_build', True)
+    if sys.version_info < (3, 5):
+        # asgi_api uses async/await, its tests are skipped there.
+        project.set_property('flake8_exclude_patterns', '*/asgi_api/*')
+        project.get_property('coverage_exceptions').extend([
+            'aws_federation_proxy.asgi_api',
+            'aws_federation_proxy.asgi_api.asgi_api',
+            'aws_federation_proxy.asgi_api.async_proxy'])
 
     project.set_property('copy_resources_target', '$dir_dist')
     project.install_file('/var/www/afp-core/', 'wsgi/api.wsgi')
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time compiling and querying provider_by_cidr tables of many networks
+
+Run from the repository root:
+    PYTHONPATH=src/main/python python src/benchmark/python/cidr_provider_benchmark.py
+"""
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import argparse
+import random
+import socket
+import struct
+import timeit
+
+from aws_federation_proxy.provider.provider_by_cidr import NetworkTable, Provider
+
+
+def _ipv4(value):
+    return socket.inet_ntop(socket.AF_INET, struct.pack(str('!I'), value))
+
+
+def generate_networks(count, seed=0):
+    """Return count distinct IPv4 networks, about a quarter nested in others"""
+    rng = random.Random(seed)
+    networks = set()
+    while len(networks) < count:
+        length = rng.choice((16, 20, 22, 24, 24, 24, 26, 28, 32))
+        value = rng.getrandbits(32) >> (32 - length) << (32 - length)
+        networks.add('{0}/{1}'.format(_ipv4(value), length))
+    return [{'network': network, 'account': 'account{0}'.format(index % 50),
+             'role': 'role{0}'.format(index % 7)}
+            for index, network in enumerate(sorted(networks))]
+
+
+def generate_addresses(networks, count, seed=1):
+    """Return count addresses, half of them inside the configured networks"""
+    rng = random.Random(seed)
+    addresses = []
+    for _ in range(count // 2):
+        network, _, length = rng.choice(networks)['network'].partition('/')
+        first = struct.unpack(str('!I'), socket.inet_aton(network))[0]
+        addresses.append(_ipv4(first + rng.getrandbits(32 - int(length))
+                               if int(length) < 32 else first))
+    while len(addresses) < count:
+        addresses.append(_ipv4(rng.getrandbits(32)))
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--networks', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    networks = generate_networks(args.networks)
+    addresses = generate_addresses(networks, args.lookups)
+    entries = [(n['network'], (n['account'], n['role'])) for n in networks]
+
+    compile_time = min(timeit.repeat(lambda: NetworkTable(entries), number=1, repeat=3))
+    table = NetworkTable(entries)
+    lookup = table.lookup
+    lookup_time = min(timeit.repeat(lambda: [lookup(a) for a in addresses],
+                                    number=1, repeat=5))
+    config = {'networks': networks}
+    Provider(addresses[0], config)
+
+    def request():
+        for address in addresses:
+            try:
+                Provider(address, config).get_accounts_and_roles()
+            except Exception:
+                pass
+    request_time = min(timeit.repeat(request, number=1, repeat=3))
+
+    print('networks:                 {0}'.format(table.size))
+    print('compile table:            {0:.3f} s'.format(compile_time))
+    print('NetworkTable.lookup:      {0:.2f} us'.format(
+        lookup_time / len(addresses) * 1e6))
+    print('get_accounts_and_roles:   {0:.2f} us (incl. Provider())'.format(
+        request_time / len(addresses) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time importing aws_federation_proxy in a fresh interpreter, as a new worker does
+
+Run from the repository root:
+    PYTHONPATH=src/main/python python src/benchmark/python/import_time_benchmark.py
+
+The "eager" rows additionally import what aws_federation_proxy loaded at
+module level before boto, requests and yamlreader were imported on first use.
+"""
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import argparse
+import os
+import subprocess
+import sys
+
+EAGER_IMPORTS = ['boto.sts', 'boto.utils', 'requests', 'yamlreader']
+HEAVY_MODULES = ['boto', 'requests', 'yamlreader']
+
+# Prints the import time in seconds and the heavy modules that were loaded.
+TIMING_CODE = """
+import sys, time
+start = time.time()
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.time() - start
+print(elapsed, ','.join(sorted(set({heavy!r}) & set(sys.modules))))
+""".format(heavy=HEAVY_MODULES)
+
+
+def time_import(modules):
+    """Return (seconds, heavy modules loaded) for importing modules"""
+    output = subprocess.check_output(
+        [sys.executable, '-c', TIMING_CODE] + modules,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    elapsed, _, loaded = output.decode().strip().partition(' ')
+    return float(elapsed), loaded
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=15)
+    args = parser.parse_args()
+
+    cases = [
+        ('aws_federation_proxy', ['aws_federation_proxy']),
+        ('aws_federation_proxy (eager)', ['aws_federation_proxy'] + EAGER_IMPORTS),
+        ('wsgi_api', ['aws_federation_proxy.wsgi_api']),
+        ('wsgi_api (eager)', ['aws_federation_proxy.wsgi_api'] + EAGER_IMPORTS),
+    ]
+    for label, modules in cases:
+        results = [time_import(modules) for _ in range(args.repeat)]
+        print('{0:30} {1:7.1f} ms   loaded: {2}'.format(
+            label, median([elapsed for elapsed, _ in results]) * 1e3,
+            results[0][1] or '-'))
+
+
+if __name__ == '__main__':
+    main()
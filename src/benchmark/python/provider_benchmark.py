@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time get_accounts_and_roles of the group and IP providers on synthetic directories
+
+Run from the repository root:
+    PYTHONPATH=src/main/python python src/benchmark/python/provider_benchmark.py \\
+        --save-baseline provider_baseline.json
+    PYTHONPATH=src/main/python python src/benchmark/python/provider_benchmark.py \\
+        --baseline provider_baseline.json
+
+For each directory size in --sizes, a group database is generated in which
+users are in 1 to --max-user-groups groups, about one in --aws-ratio groups
+named like an AWS account/role. The cases are:
+
+    groups          ProviderByGroups with the group list of each user, with
+                    the group name memo of GroupMatcher warm and cold
+    old_loop        the same group lists matched with re.search() per group
+                    and rule, as ProviderByGroups did before GroupMatcher;
+                    its checksum must equal the one of the groups case
+    grp             grp_provider.Provider on the generated database, timing
+                    the GroupIndex build and the lookups separately
+    ip              provider_by_ip.Provider resolving one address per group
+                    with a fake resolver, cache warm; and cache cold for
+                    --users of these addresses, each lookup in a new thread
+
+Each timing is the best of --repeat samples of --number runs, per request
+(or per GroupIndex build).
+
+The generated data only depends on the options, so the checksum of all
+results of a case is the same on every run. With --baseline, checksums
+and timings are compared to a file written by --save-baseline; the exit
+status is 1 if a result differs or a case got slower by more than
+--tolerance and by more than --noise-floor microseconds.
+"""
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import argparse
+import collections
+import hashlib
+import json
+import random
+import re
+import sys
+import timeit
+
+from aws_federation_proxy.provider import ProviderByGroups
+from aws_federation_proxy.provider import grp_provider, provider_by_ip
+from aws_federation_proxy.provider.base_provider import REASON_TEMPLATE
+
+REGEX = 'aws-(?P<account>[a-z0-9]+)-(?P<role>[a-z0-9]+)'
+ALLOWED_DOMAINS = ['ber.example.com', 'ham.example.com', 'aws.example.com']
+
+FakeGroup = collections.namedtuple('FakeGroup', 'gr_name gr_passwd gr_gid gr_mem')
+FakePasswd = collections.namedtuple('FakePasswd', 'pw_name pw_gid')
+
+
+class Directory(object):
+    """Synthetic groups and users, the same for the same arguments"""
+
+    def __init__(self, group_count, user_count, max_user_groups, aws_ratio, seed=0):
+        rng = random.Random(seed)
+        self.group_names = []
+        for gid in range(group_count):
+            if gid % aws_ratio == 0:
+                name = 'aws-account{0}-role{1}'.format(rng.randrange(500), rng.randrange(8))
+            else:
+                name = 'team{0}-{1}'.format(gid, rng.choice(('dev', 'ops', 'read', 'all')))
+            self.group_names.append(name)
+        self.group_names = sorted(set(self.group_names))
+        group_count = len(self.group_names)
+
+        # Mostly small memberships and a few users in very many groups.
+        sizes = [1, 5, 20, 50, 200, max_user_groups]
+        members = [[] for _ in range(group_count)]
+        self.users = {}
+        self.primary_gids = {}
+        for index in range(user_count):
+            user = 'user{0}'.format(index)
+            gids = rng.sample(range(group_count),
+                              min(rng.choice(sizes), max_user_groups, group_count))
+            self.users[user] = [self.group_names[gid] for gid in sorted(gids)]
+            self.primary_gids[user] = gids[0]
+            for gid in gids[1:]:
+                members[gid].append(user)
+        self.groups = [FakeGroup(name, 'x', gid, gr_mem)
+                       for gid, (name, gr_mem) in enumerate(zip(self.group_names, members))]
+
+    def getgrall(self):
+        return list(self.groups)
+
+    def getpwnam(self, user):
+        try:
+            return FakePasswd(user, self.primary_gids[user])
+        except KeyError:
+            raise KeyError('getpwnam(): name not found: {0}'.format(user))
+
+
+class FakeResolver(object):
+    """gethostbyaddr() of count addresses with host names like berweb01"""
+
+    def __init__(self, count):
+        self.names = {}
+        for index in range(count):
+            address = '10.{0}.{1}.{2}'.format(index >> 16 & 255, index >> 8 & 255, index & 255)
+            location = ('ber', 'ham', 'aws')[index % 3]
+            self.names[address] = '{0}{1:03d}{2:02d}.{0}.example.com'.format(
+                location, index % 1000, index % 100)
+
+    def gethostbyaddr(self, address):
+        try:
+            return self.names[address], [], [address]
+        except KeyError:
+            raise Exception('[Errno 1] Unknown host')
+
+
+class ListProvider(ProviderByGroups):
+    group_lists = {}
+
+    def get_group_list(self):
+        return self.group_lists[self.user]
+
+
+def checksum(results):
+    """Return a hash of a list of get_accounts_and_roles() results"""
+    normalized = [sorted((account, sorted(roles)) for account, roles in result.items())
+                  for result in results]
+    return hashlib.sha1(json.dumps(normalized).encode('utf-8')).hexdigest()
+
+
+def best_time(function, repeat, number):
+    """Return the seconds of the fastest of repeat samples of number calls, per call"""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def run_groups(directory, config, repeat, number):
+    ListProvider.group_lists = directory.users
+    users = sorted(directory.users)
+    matcher = ListProvider(users[0], config).group_matcher
+
+    def request():
+        return [ListProvider(user, config).get_accounts_and_roles() for user in users]
+
+    def cold_request():
+        matcher._grants.clear()
+        return request()
+    results = request()
+    memberships = sum(len(groups) for groups in directory.users.values())
+    return {
+        'warm': best_time(request, repeat, number) / len(users),
+        'cold': best_time(cold_request, repeat, number) / len(users),
+        'groups_per_user': memberships / len(users),
+        'checksum': checksum(results),
+    }
+
+
+def old_loop(rules, groups):
+    """get_accounts_and_roles() of ProviderByGroups before GroupMatcher"""
+    accounts_and_roles = {}
+    for group in groups:
+        for regex in rules:
+            match = re.search(regex, group)
+            if match:
+                break
+        else:
+            continue
+        account = match.group('account')
+        role = match.group('role')
+        reason = REASON_TEMPLATE % (group, regex)
+        accounts_and_roles.setdefault(account, set()).add((role, reason))
+    return accounts_and_roles
+
+
+def run_old_loop(directory, config, repeat, number):
+    rules = ['^{0}$'.format(config['regex'])]
+    users = sorted(directory.users)
+
+    def request():
+        return [old_loop(rules, directory.users[user]) for user in users]
+    results = request()
+    return {
+        'warm': best_time(request, repeat, number) / len(users),
+        'checksum': checksum(results),
+    }
+
+
+def run_grp(directory, config, repeat, number):
+    grp_provider.grp = directory
+    grp_provider.pwd = directory
+    users = sorted(directory.users)
+
+    def build():
+        grp_provider.GROUP_INDEX.clear()
+        grp_provider.GROUP_INDEX.get_groups(users[0])
+
+    def request():
+        return [grp_provider.Provider(user, config).get_accounts_and_roles()
+                for user in users]
+    build_time = best_time(build, repeat, number)
+    results = request()
+    return {
+        'build': build_time,
+        'warm': best_time(request, repeat, number) / len(users),
+        'checksum': checksum(results),
+    }
+
+
+def run_ip(count, cold_count, repeat, number):
+    resolver = FakeResolver(count)
+    provider_by_ip.gethostbyaddr = resolver.gethostbyaddr
+    provider_by_ip.REVERSE_DNS_CACHE.clear()
+    config = {'account_name': 'machines', 'allowed_domains': ALLOWED_DOMAINS,
+              'dns_cache_size': count}
+    addresses = sorted(resolver.names)
+    cold_addresses = addresses[::max(1, len(addresses) // cold_count)][:cold_count]
+
+    def request(addresses=addresses):
+        return [provider_by_ip.Provider(address, config).get_accounts_and_roles()
+                for address in addresses]
+
+    def cold_request():
+        provider_by_ip.REVERSE_DNS_CACHE.clear()
+        return request(cold_addresses)
+    cold_time = best_time(cold_request, repeat, number) / len(cold_addresses)
+    # The first round fills the cache, one lookup thread per address.
+    results = request()
+    return {
+        'warm': best_time(request, repeat, number) / len(addresses),
+        'cold': cold_time,
+        'checksum': checksum(results),
+    }
+
+
+def run(args):
+    config = {'regex': REGEX, 'group_memo_size': max(args.sizes) * 2,
+              'group_index_ttl': 3600}
+    cases = {}
+    for size in args.sizes:
+        directory = Directory(size, args.users, args.max_user_groups, args.aws_ratio)
+        if 'groups' in args.cases:
+            cases['groups/{0}'.format(size)] = run_groups(
+                directory, config, args.repeat, args.number)
+        if 'old_loop' in args.cases:
+            cases['old_loop/{0}'.format(size)] = run_old_loop(
+                directory, config, args.repeat, args.number)
+        if 'grp' in args.cases:
+            cases['grp/{0}'.format(size)] = run_grp(directory, config, args.repeat, args.number)
+        if 'ip' in args.cases:
+            cases['ip/{0}'.format(size)] = run_ip(size, args.users, args.repeat, args.number)
+    return cases
+
+
+def format_case(name, case):
+    timings = ['{0} {1:9.2f} us'.format(key, case[key] * 1e6) for key in ('warm', 'cold')
+               if key in case]
+    if 'build' in case:
+        timings.append('build {0:.3f} s'.format(case['build']))
+    if 'groups_per_user' in case:
+        timings.append('{0:.0f} groups/user'.format(case['groups_per_user']))
+    return '{0:16} {1}'.format(name, '   '.join(timings))
+
+
+def compare(cases, baseline, tolerance, noise_floor):
+    """Return descriptions of differences to baseline
+
+    A timing is a regression if it is more than tolerance times and more
+    than noise_floor seconds above the baseline.
+    """
+    problems = []
+    for name, case in sorted(cases.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if case['checksum'] != expected['checksum']:
+            problems.append('{0}: results differ from baseline'.format(name))
+        for key in ('warm', 'cold', 'build'):
+            if key not in case or key not in expected:
+                continue
+            if case[key] > expected[key] * tolerance and case[key] - expected[key] > noise_floor:
+                problems.append('{0}: {1} is {2:.2f} times the baseline'.format(
+                    name, key, case[key] / expected[key]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 200000],
+                        help='numbers of groups (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--max-user-groups', type=int, default=2000)
+    parser.add_argument('--aws-ratio', type=int, default=10)
+    parser.add_argument('--cases', nargs='+', choices=['groups', 'old_loop', 'grp', 'ip'],
+                        default=['groups', 'old_loop', 'grp', 'ip'])
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='samples per timing, the fastest counts (default: %(default)s)')
+    parser.add_argument('--number', type=int, default=3,
+                        help='runs per sample (default: %(default)s)')
+    parser.add_argument('--baseline', help='compare to this file of --save-baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed slowdown against --baseline (default: %(default)s)')
+    parser.add_argument('--noise-floor', type=float, default=5,
+                        help='microseconds a timing may always exceed --baseline by '
+                             '(default: %(default)s)')
+    parser.add_argument('--save-baseline', help='write the results to this file')
+    args = parser.parse_args()
+
+    cases = run(args)
+    for name in sorted(cases, key=lambda name: (name.split('/')[0], int(name.split('/')[1]))):
+        print(format_case(name, cases[name]))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({'options': vars(args), 'cases': cases}, baseline_file,
+                      indent=2, sort_keys=True)
+        print('Baseline written to {0}'.format(args.save_baseline))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        problems = compare(cases, baseline['cases'], args.tolerance, args.noise_floor / 1e6)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print('No regressions against {0}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Lookup tables compiled from the accounts configuration"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import logging
+import re
+
+import six
+
+from .caching import ConfigMemo
+
+ACCOUNT_ID_REGEX = re.compile(r'^[0-9]+$')
+
+
+class AccountIndex(object):
+    """Alias to ID and ID to aliases tables of an accounts configuration
+
+    account_config maps account aliases to dicts with an optional 'id'.
+    Invalid entries are left out, so a typo only breaks the account it is
+    in; self.errors describes them. ValueError is raised if account_config
+    is no dict at all. The index must not be changed after it is built.
+    """
+
+    def __init__(self, account_config):
+        if account_config is None:
+            account_config = {}
+        if not isinstance(account_config, dict):
+            raise ValueError("Accounts configuration must be a dict of "
+                             "account aliases, not {0!r}".format(account_config))
+        self._ids = {}
+        self.errors = []
+        aliases = {}
+        for alias, entry in account_config.items():
+            if not isinstance(entry, dict):
+                self.errors.append("Configuration of account '{0}' must be a "
+                                   "dict, not {1!r}".format(alias, entry))
+                continue
+            account_id = entry.get('id')
+            if account_id is not None:
+                if (isinstance(account_id, bool) or
+                        not isinstance(account_id, six.integer_types + six.string_types) or
+                        not ACCOUNT_ID_REGEX.match(six.text_type(account_id))):
+                    self.errors.append("Account '{0}' has invalid id {1!r}".format(
+                        alias, account_id))
+                    continue
+                aliases.setdefault(six.text_type(account_id), []).append(alias)
+            self._ids[alias] = account_id
+        self._aliases = dict((account_id, tuple(sorted(names)))
+                             for account_id, names in aliases.items())
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, alias):
+        return alias in self._ids
+
+    def get_id(self, alias):
+        """Return the configured id of alias, None if it has none"""
+        return self._ids.get(alias)
+
+    def get_aliases(self, account_id):
+        """Return the sorted tuple of aliases configured with account_id"""
+        return self._aliases.get(six.text_type(account_id), ())
+
+
+def _build_account_index(account_config, logger):
+    index = AccountIndex(account_config)
+    for error in index.errors:
+        logger.error("Ignoring invalid account configuration: %s", error)
+    return index
+
+
+_ACCOUNT_INDEXES = ConfigMemo(_build_account_index)
+
+
+def get_account_index(account_config, logger=None):
+    """Return the AccountIndex of account_config
+
+    Indexes are built once per process and configuration; invalid entries
+    are logged to logger when the index is built.
+    """
+    return _ACCOUNT_INDEXES.get(account_config,
+                                logger or logging.getLogger(__name__))
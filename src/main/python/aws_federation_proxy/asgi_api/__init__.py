@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""ASGI front end, needs Python 3.5+ unlike the rest of the package"""
+
+from aws_federation_proxy.asgi_api.asgi_api import get_asgi_app, ASGIApp
+from aws_federation_proxy.asgi_api.async_proxy import AsyncAWSFederationProxy
+
+__all__ = ['get_asgi_app', 'ASGIApp', 'AsyncAWSFederationProxy']
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""ASGI version of wsgi_api for asyncio servers (Python 3.5+ only)"""
+
+import asyncio
+import functools
+import os
+import re
+import time
+
+import simplejson
+
+from concurrent.futures import ThreadPoolExecutor
+from six.moves.http_client import responses
+from six.moves.urllib.parse import parse_qs
+
+from aws_federation_proxy import ConfigurationError, PermissionError, metrics
+from aws_federation_proxy.config_cache import load_config
+from aws_federation_proxy.tracing import SERVER_TIMING_ENVIRON_KEY, Trace, finish_trace
+from aws_federation_proxy.util import setup_logging
+from aws_federation_proxy.wsgi_api.wsgi_api import (
+    DEFAULT_BATCH_MAX_PAIRS,
+    LOGGER_NAME,
+    build_account_list,
+    build_batch_result,
+    build_credentials_dict,
+    get_account_and_role,
+    get_error_status,
+    parse_batch_request
+)
+from .async_proxy import AsyncAWSFederationProxy
+
+DEFAULT_PROVIDER_THREADS = 20
+DEFAULT_AWS_THREADS = 20
+MAX_BODY_SIZE = 1024 * 1024
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+
+
+class HTTPError(Exception):
+    """Answer the request with status and message"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request(object):
+    """The parts of an ASGI http scope the routes need"""
+
+    def __init__(self, scope, body):
+        self.path = scope['path']
+        self.method = scope['method']
+        # Rule of the matching route, set by ASGIApp.
+        self.endpoint = 'unknown'
+        self.trace = Trace()
+        # None if larger than MAX_BODY_SIZE
+        self.body = body
+        self.query = parse_qs(scope.get('query_string', b'').decode('latin-1'),
+                              keep_blank_values=True)
+        # Looks like the WSGI environ to api.user_identification.
+        self.environ = {}
+        if scope.get('client'):
+            self.environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            self.environ['HTTP_' + name] = value.decode('latin-1')
+
+    def get_query(self, name):
+        """Return the first value of query parameter name, "" if missing"""
+        return self.query.get(name, [""])[0]
+
+
+def _json(value):
+    return JSON_CONTENT_TYPE, simplejson.dumps(value)
+
+
+async def get_monitoring_status(request, proxy):
+    """Return status page for monitoring"""
+    # Reports broken provider and accounts configurations, without setting
+    # up the provider.
+    await proxy.run_provider(proxy.get_provider_class)
+    proxy.get_account_index()
+    return _json({"status": "200", "message": "OK"})
+
+
+async def get_metrics(request, proxy):
+    """Return the latency histograms of this worker process for Prometheus
+
+    Served without a proxy (proxy is None), so it works with any config.
+    """
+    return metrics.CONTENT_TYPE, metrics.render()
+
+
+async def get_accountlist(request, proxy):
+    """Return a dict-of-lists of all accounts and roles for the current user"""
+    accounts_and_roles = await proxy.get_account_and_role_dict_async()
+    return _json(build_account_list(accounts_and_roles, proxy,
+                                    'withid' in request.query))
+
+
+async def get_credentials_and_console(request, proxy, account, role):
+    """Return credentials and console url"""
+    credentials = await proxy.get_aws_credentials_async(account, role)
+    credentials_dict = build_credentials_dict(credentials)
+    credentials_dict['ConsoleUrl'] = await proxy.get_console_url_async(
+        credentials, request.get_query('callbackurl'))
+    return _json(credentials_dict)
+
+
+async def get_credentials(request, proxy, account, role):
+    """Return credentials"""
+    credentials = await proxy.get_aws_credentials_async(account, role)
+    return _json(build_credentials_dict(credentials))
+
+
+async def get_console(request, proxy, account, role):
+    """Return ConsoleURL"""
+    credentials = await proxy.get_aws_credentials_async(account, role)
+    console_url = await proxy.get_console_url_async(
+        credentials, request.get_query('callbackurl'))
+    return 'text/plain; charset=utf-8', str(console_url)
+
+
+async def get_ims_role(request, proxy):
+    account, role = await proxy.run_provider(get_account_and_role, proxy)
+    try:
+        # Cached for the request for them that usually follows.
+        await proxy.get_aws_credentials_async(account, role)
+    except PermissionError:
+        return 'text/plain', ""
+    return 'text/plain', role
+
+
+async def get_ims_credentials(request, proxy, role):
+    account, _ = await proxy.run_provider(get_account_and_role, proxy)
+    credentials = await proxy.get_aws_credentials_async(account, role)
+    return _json(build_credentials_dict(credentials))
+
+
+async def get_credentials_batch(request, proxy):
+    """Return credentials for many account/role pairs, see wsgi_api
+
+    Each line is sent as soon as its pair is done.
+    """
+    max_pairs = proxy.application_config.get('batch_credentials', {}).get(
+        'max_pairs', DEFAULT_BATCH_MAX_PAIRS)
+    try:
+        pairs = parse_batch_request(request.body, max_pairs)
+    except ValueError as exc:
+        raise HTTPError(400, str(exc))
+    accounts_and_roles = await proxy.get_account_and_role_dict_async()
+
+    async def get_line(account, role):
+        try:
+            credentials = await proxy.get_aws_credentials_async(
+                account, role, accounts_and_roles)
+        except Exception as exc:
+            return build_batch_result(account, role, None, exc)
+        return build_batch_result(account, role, credentials, None)
+    return ('application/x-ndjson; charset=utf-8',
+            asyncio.as_completed([get_line(account, role) for account, role in pairs]))
+
+
+GET = ('GET', 'HEAD')
+
+
+def _compile_rule(rule):
+    """Return a regex for a bottle style rule like '/account/<account>'"""
+    return re.compile('^' + re.sub('<[^/>]+>', '([^/]+)', rule) + '$')
+
+
+# User of routes that are served without loading the configuration and
+# building a proxy; they get None instead.
+NO_PROXY = object()
+
+# (path regex, rule, methods, user, route); user is a fixed user, None for
+# the user of the request, or NO_PROXY. Groups are passed to the route and
+# the rule labels metrics, as in wsgi_api. Routes return (content type,
+# body), the body being a string or an iterable of awaitables for the parts
+# of a streamed response.
+ROUTES = [(_compile_rule(rule), rule, methods, user, route)
+          for rule, methods, user, route in (
+    ('/status', GET, 'monitoring', get_monitoring_status),
+    ('/metrics', GET, NO_PROXY, get_metrics),
+    ('/account', GET, None, get_accountlist),
+    ('/account/<account>/<role>', GET, None, get_credentials_and_console),
+    ('/account/<account>/<role>/credentials', GET, None, get_credentials),
+    ('/account/<account>/<role>/consoleurl', GET, None, get_console),
+    ('/credentials', ('POST',), None, get_credentials_batch),
+    ('/meta-data/iam/security-credentials/', GET, None, get_ims_role),
+    ('/meta-data/iam/security-credentials/<role>', GET, None, get_ims_credentials),
+)]
+
+
+class ASGIApp(object):
+    """ASGI application serving the routes of wsgi_api
+
+    Configuration is read as in wsgi_api, from config_path and
+    account_config_path (default: $CONFIG_PATH and $ACCOUNT_CONFIG_PATH).
+    Providers run in up to provider_threads threads, STS and signin calls in
+    up to aws_threads threads; requests waiting for them hold no thread.
+    """
+
+    def __init__(self, config_path=None, account_config_path=None,
+                 provider_threads=DEFAULT_PROVIDER_THREADS,
+                 aws_threads=DEFAULT_AWS_THREADS):
+        self.config_path = config_path or os.environ.get('CONFIG_PATH')
+        self.account_config_path = (account_config_path or
+                                    os.environ.get('ACCOUNT_CONFIG_PATH'))
+        self.provider_executor = ThreadPoolExecutor(provider_threads)
+        self.aws_executor = ThreadPoolExecutor(aws_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported ASGI scope type '{0}'".format(scope['type']))
+        request = Request(scope, await self._read_body(receive))
+        status, headers, body = await self.handle(request)
+        if isinstance(body, bytes):
+            headers.append(('Content-Length', str(len(body))))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers]})
+        if isinstance(body, bytes):
+            await send({
+                'type': 'http.response.body',
+                'body': b'' if request.method == 'HEAD' else body})
+            return
+        for part in body:
+            await send({
+                'type': 'http.response.body',
+                'body': (await part).encode('utf-8'),
+                'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def _read_body(receive):
+        """Return the request body, None if larger than MAX_BODY_SIZE"""
+        parts = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            parts.append(message.get('body', b''))
+            size += len(parts[-1])
+            if size > MAX_BODY_SIZE:
+                return None
+            more_body = message.get('more_body', False)
+        return b''.join(parts)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.provider_executor.shutdown(wait=False)
+                self.aws_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, request):
+        """Return (status, headers, body) for request"""
+        start = time.time()
+        user = "Unknown User"
+        proxy = None
+        try:
+            route, request.endpoint, route_user, args = self._find_route(request)
+            if route_user is not NO_PROXY:
+                proxy = await asyncio.get_event_loop().run_in_executor(
+                    self.provider_executor, self.initialize_federation_proxy,
+                    request, route_user)
+                user = proxy.user
+            content_type, body = await route(request, proxy, *args)
+            status = 200
+        except Exception as exc:
+            status, body = self._handle_exception(exc, request)
+            content_type = JSON_CONTENT_TYPE
+        # Streamed responses are only timed until they start.
+        metrics.REQUEST_SECONDS.observe(time.time() - start, request.endpoint,
+                                        str(status))
+        headers = [('Content-Type', content_type), ('X-Username', user)]
+        if proxy is not None and request.trace.recording:
+            # Writing a sampled trace may block.
+            server_timing = await asyncio.get_event_loop().run_in_executor(
+                self.provider_executor, functools.partial(
+                    finish_trace, request.trace,
+                    proxy.application_config.get('tracing', {}), proxy.logger,
+                    endpoint=request.endpoint, path=request.path,
+                    status=status, user=user))
+            if server_timing is not None:
+                headers.append(('Server-Timing', server_timing))
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return status, headers, body
+
+    @staticmethod
+    def _find_route(request):
+        if request.body is None:
+            raise HTTPError(413, "Request body too large.")
+        path_found = False
+        for path, rule, methods, user, route in ROUTES:
+            match = path.match(request.path)
+            if match:
+                if request.method in methods:
+                    return route, rule, user, match.groups()
+                path_found = True
+        if path_found:
+            raise HTTPError(405, "Method not allowed.")
+        raise HTTPError(404, "Not found: '{0}'".format(request.path))
+
+    @staticmethod
+    def _handle_exception(exc, request):
+        """Log exc and return (status, JSON error document)
+
+        Must be called from the except clause handling exc.
+        """
+        if isinstance(exc, HTTPError):
+            status, message = exc.status, exc.message
+        else:
+            status, message = get_error_status(exc, request.path)
+        return status, simplejson.dumps({
+            "status": status,
+            "error": "{0} {1}".format(status, responses.get(status, "")),
+            "exception": None,
+            "message": message,
+            "traceback": None
+        })
+
+    def initialize_federation_proxy(self, request, user=None):
+        """Get needed config parts and initialize AsyncAWSFederationProxy"""
+        with request.trace.span('initialize_federation_proxy'):
+            return self._build_federation_proxy(request, user)
+
+    def _build_federation_proxy(self, request, user):
+        if self.config_path is None:
+            raise Exception("No Config Path specified")
+        with metrics.CONFIG_SECONDS.time(request.endpoint):
+            config = load_config(self.config_path)
+        request.trace.decide(config.get('tracing', {}),
+                             request.environ.get(SERVER_TIMING_ENVIRON_KEY))
+
+        try:
+            logger = setup_logging(config, logger_name=LOGGER_NAME)
+        except Exception as exc:
+            raise ConfigurationError(str(exc))
+
+        if user is None:
+            field = config['api']['user_identification']['environment_field']
+            if field not in request.environ:
+                raise Exception("No {0} specified".format(field))
+            user = request.environ[field]
+        if self.account_config_path is None:
+            raise Exception("No Account Config Path specified")
+        with metrics.CONFIG_SECONDS.time(request.endpoint):
+            account_config = load_config(self.account_config_path)
+        proxy = AsyncAWSFederationProxy(
+            user=user, config=config, account_config=account_config,
+            logger=logger, endpoint=request.endpoint,
+            provider_executor=self.provider_executor,
+            aws_executor=self.aws_executor)
+        if request.trace.recording:
+            proxy.trace = request.trace
+        return proxy
+
+
+def get_asgi_app(**kwargs):
+    """Return a new ASGIApp, see there for the arguments"""
+    return ASGIApp(**kwargs)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""AWSFederationProxy for asyncio event loops (Python 3.5+ only)"""
+
+import asyncio
+import functools
+
+from aws_federation_proxy.aws_federation_proxy import (
+    AWSFederationProxy,
+    STS_CALLS
+)
+from aws_federation_proxy.metrics import SIGNIN_SECONDS
+
+
+class AsyncSingleFlight(object):
+    """Like caching.SingleFlight, for coroutines of an event loop
+
+    Waiting callers hold no thread, so any number of them can share a call.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def do(self, key, start):
+        """Return an awaitable for the future returned by start()
+
+        start() is only called if no call for key is in progress.
+        """
+        future = self._futures.get(key)
+        if future is None:
+            future = self._futures[key] = start()
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        # A caller that is cancelled (e.g. the client went away) must not
+        # cancel the call for all the others.
+        return asyncio.shield(future)
+
+
+def traced(name):
+    """Like tracing.traced for coroutine functions, with the span name"""
+    def decorator(coroutine_function):
+        @functools.wraps(coroutine_function)
+        async def new_coroutine_function(self, *args, **kwargs):
+            if self.trace is None:
+                return await coroutine_function(self, *args, **kwargs)
+            with self.trace.span(name):
+                return await coroutine_function(self, *args, **kwargs)
+        return new_coroutine_function
+    return decorator
+
+
+# Concurrent cache misses for the same credentials share one executor job.
+ASYNC_STS_CALLS = AsyncSingleFlight()
+
+
+class AsyncAWSFederationProxy(AWSFederationProxy):
+    """AWSFederationProxy with coroutines for use in an asyncio event loop
+
+    Blocking work never runs in the event loop: the provider is called in
+    provider_executor, STS and signin requests are made in aws_executor
+    (both default to the default executor of the loop). Cached credentials
+    are returned without leaving the event loop.
+
+    The provider is set up on first use, i.e. in provider_executor.
+    """
+
+    def __init__(self, user, config, account_config, logger=None, endpoint='',
+                 provider_executor=None, aws_executor=None):
+        self.provider_executor = provider_executor
+        self.aws_executor = aws_executor
+        super().__init__(user, config, account_config, logger=logger,
+                         endpoint=endpoint)
+
+    def run_provider(self, function, *args):
+        """Return a future for function(*args) run in provider_executor"""
+        return asyncio.get_event_loop().run_in_executor(
+            self.provider_executor, function, *args)
+
+    def run_aws(self, function, *args):
+        """Return a future for function(*args) run in aws_executor"""
+        return asyncio.get_event_loop().run_in_executor(
+            self.aws_executor, function, *args)
+
+    async def get_account_and_role_dict_async(self):
+        """Coroutine version of get_account_and_role_dict()"""
+        return await self.run_provider(self.get_account_and_role_dict)
+
+    @traced('get_aws_credentials')
+    async def get_aws_credentials_async(self, account_alias, role,
+                                        accounts_and_roles=None):
+        """Coroutine version of get_aws_credentials()"""
+        if accounts_and_roles is None:
+            await self.run_provider(self.check_user_permissions, account_alias, role)
+        else:
+            self.check_user_permissions(account_alias, role, accounts_and_roles)
+        cache_key, key_id, secret_key, arn, cache_config = \
+            self._get_credentials_request(account_alias, role)
+        credentials = self._get_cached_credentials(cache_key, arn, cache_config)
+        if credentials is None:
+            # STS_CALLS also joins renewals by CREDENTIALS_REFRESHER.
+            credentials = await ASYNC_STS_CALLS.do(cache_key, functools.partial(
+                self.run_aws, STS_CALLS.do, cache_key, self._assume_role_and_cache,
+                cache_key, cache_config, key_id, secret_key, arn))
+        if cache_config.get('refresh_ahead'):
+            self._track_for_refresh(cache_key, credentials, cache_config,
+                                    key_id, secret_key, arn)
+        return credentials
+
+    @traced('get_console_url')
+    async def get_console_url_async(self, credentials, callback_url):
+        """Coroutine version of get_console_url()"""
+        with SIGNIN_SECONDS.time(self.endpoint):
+            token = await self.run_aws(self._get_signin_token, credentials)
+        return self._construct_console_url(token, callback_url)
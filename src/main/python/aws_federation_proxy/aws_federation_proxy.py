@@ -6,34 +6,98 @@ from __future__ import print_function, absolute_import, unicode_literals, divisi
 
 import json
 import time
+import calendar
 import logging
-import requests
+import numbers
+import threading
 
+from six.moves import queue
 from six.moves.urllib.parse import quote_plus
-from yamlreader import data_merge
-from boto.sts import STSConnection
 
+from .account_config import get_account_index
+from .caching import LRUCache, SingleFlight
+from .metrics import PROVIDER_SECONDS, SIGNIN_SECONDS, STS_SECONDS
+from .connection_pool import ConnectionPool, LazyHTTPSession
+from .refresher import Refresher
+from .tracing import traced
 from .util import _get_item_from_module
 
+DEFAULT_CREDENTIALS_CACHE_SIZE = 1000
+# Cached credentials are handed out until this many seconds before they
+# expire, so clients always get credentials that are still usable for a while.
+DEFAULT_CREDENTIALS_EXPIRY_MARGIN = 300
+# Seconds STS refusing a role (e.g. because it does not exist) is
+# remembered, so clients polling for it do not hit STS every time. Off by
+# default: a fixed trust policy would only take effect after this time.
+DEFAULT_CREDENTIALS_DENIED_TTL = 0
 
-def log_function_call(old_func):
-    """Log Timings of function calls."""
-    def new_func(self, *args, **kwargs):
-        start = time.time()
-        try:
-            retval = old_func(self, *args, **kwargs)
-        except Exception as exc:
-            stop = time.time()
-            self.logger.debug(
-                "%s(%s, %s) raised Exception %s after %.3f seconds",
-                old_func.__name__, args, kwargs, exc, stop - start)
-            raise
-        stop = time.time()
-        self.logger.debug(
-            "%s(%s, %s) took %.3f seconds and returned %s",
-            old_func.__name__, args, kwargs, stop - start, retval)
-        return retval
-    return new_func
+# Temporary credentials per (access key, role ARN, user), shared by all
+# AWSFederationProxy instances of this process.
+CREDENTIALS_CACHE = LRUCache(DEFAULT_CREDENTIALS_CACHE_SIZE)
+# Concurrent cache misses for the same key share a single AssumeRole call.
+STS_CALLS = SingleFlight()
+
+DEFAULT_REFRESH_MAX_ENTRIES = 1000
+DEFAULT_REFRESH_CONCURRENCY = 4
+DEFAULT_REFRESH_IDLE_TIME = 900
+
+# Renews recently used credentials before they expire, if configured with
+# credentials_cache.refresh_ahead.
+CREDENTIALS_REFRESHER = Refresher(DEFAULT_REFRESH_MAX_ENTRIES,
+                                  DEFAULT_REFRESH_CONCURRENCY,
+                                  DEFAULT_REFRESH_IDLE_TIME)
+
+DEFAULT_STS_CONNECTION_POOL_SIZE = 10
+
+
+def _close_sts_connection(sts_connection):
+    """Close the HTTPS connections a boto STSConnection keeps alive
+
+    boto's own close() only forgets them, leaving the sockets open until
+    they are garbage collected.
+    """
+    pool = sts_connection._pool
+    with pool.mutex:
+        host_pools = list(pool.host_to_pool.values())
+        pool.host_to_pool.clear()
+    for host_pool in host_pools:
+        for http_connection, _ in host_pool.queue:
+            http_connection.close()
+
+
+# Idle STSConnection objects per (access key, secret key). boto keeps their
+# HTTPS connections alive, so reusing them saves the TLS handshake.
+STS_CONNECTION_POOL = ConnectionPool(DEFAULT_STS_CONNECTION_POOL_SIZE,
+                                     close=_close_sts_connection)
+
+
+def STSConnection(**kwargs):
+    """Return a new boto.sts.STSConnection
+
+    boto is only imported when the first connection is made, so workers
+    that never call STS do not pay for it.
+    """
+    from boto.sts import STSConnection as connection_class
+    return connection_class(**kwargs)
+
+
+SIGNIN_URL = "https://signin.aws.amazon.com/federation"
+# (connect, read) timeouts in seconds for requests to SIGNIN_URL.
+SIGNIN_TIMEOUT = (5, 10)
+SIGNIN_SESSION = LazyHTTPSession(pool_size=20)
+
+DEFAULT_BATCH_CONCURRENCY = 10
+
+# Metrics label of work not done for a request, e.g. credential renewals.
+BACKGROUND_ENDPOINT = 'background'
+
+DEFAULT_PROVIDER_CACHE_SIZE = 10000
+
+# (fetch time, accounts and roles) per (user, provider configuration).
+PROVIDER_CACHE = LRUCache(DEFAULT_PROVIDER_CACHE_SIZE)
+# Keys of PROVIDER_CACHE currently being refreshed in the background.
+_PROVIDER_REFRESHES = set()
+_PROVIDER_REFRESHES_LOCK = threading.Lock()
 
 
 class AWSError(Exception):
@@ -52,9 +116,14 @@ class PermissionError(Exception):
 
 
 class AWSFederationProxy(object):
-    """For a given user, fetch AWS accounts/roles and retrieve credentials"""
+    """For a given user, fetch AWS accounts/roles and retrieve credentials
+
+    Timings are recorded in the histograms of the metrics module, labeled
+    with endpoint (e.g. the route of the request), and in trace if set.
+    """
 
-    def __init__(self, user, config, account_config, logger=None):
+    def __init__(self, user, config, account_config, logger=None,
+                 endpoint=''):
         default_config = {
             'aws': {
                 'access_key': None,
@@ -64,27 +133,60 @@ class AWSFederationProxy(object):
                 'class': 'Provider'
             }
         }
+        from yamlreader import data_merge
         self.logger = logger or logging.getLogger(__name__)
         self.user = user
+        self.endpoint = endpoint
+        # tracing.Trace of the current request, None if it is not traced.
+        self.trace = None
         self.application_config = data_merge(default_config, config)
         self.account_config = account_config
-        self.provider = None
-        self._setup_provider()
+        self._provider = None
 
-    def _setup_provider(self):
-        """Import and set up provider module from given config"""
+    def get_account_index(self):
+        """Return the AccountIndex of account_config, see account_config.py
+
+        Raises ConfigurationError if account_config is no dict. Invalid
+        accounts in it are logged and left out.
+        """
+        try:
+            return get_account_index(self.account_config, self.logger)
+        except ValueError as error:
+            raise ConfigurationError(str(error))
+
+    @property
+    def provider(self):
+        """The provider of the user, set up on first use"""
+        if self._provider is None:
+            self._setup_provider()
+        return self._provider
+
+    @provider.setter
+    def provider(self, provider):
+        self._provider = provider
+
+    def get_provider_class(self):
+        """Import and return the configured provider class
+
+        Raises ConfigurationError like accessing the provider would, but
+        does not set it up.
+        """
         try:
             provider_config = self.application_config['provider']
             provider_module_name = provider_config['module']
         except KeyError:
             message = "No module defined in 'provider' configuration."
             raise ConfigurationError(message)
-        provider_class_name = self.application_config['provider']['class']
         try:
-            provider_class = _get_item_from_module(provider_module_name,
-                                                   provider_class_name)
+            return _get_item_from_module(provider_module_name,
+                                         provider_config['class'])
         except Exception as exc:
             raise ConfigurationError(str(exc))
+
+    def _setup_provider(self):
+        """Import and set up provider module from given config"""
+        provider_class = self.get_provider_class()
+        provider_class_name = self.application_config['provider']['class']
         try:
             self.provider = provider_class(
                 user=self.user,
@@ -95,16 +197,90 @@ class AWSFederationProxy(object):
             raise ConfigurationError(message.format(
                 class_name=provider_class_name, error=error))
 
-    @log_function_call
+    @traced
     def get_account_and_role_dict(self):
-        """Get all accounts and roles for the user"""
-        return self.provider.get_accounts_and_roles()
+        """Get all accounts and roles for the user
+
+        If provider['cache']['ttl'] is configured, results are cached per
+        user for that many seconds. For another provider['cache']['stale_ttl']
+        seconds, the old result is still returned while it is refreshed in
+        the background. The result must be treated as read-only.
+        """
+        provider_config = self.application_config['provider']
+        cache_config = provider_config.get('cache', {})
+        ttl = cache_config.get('ttl', 0)
+        if not ttl:
+            return self._ask_provider()
+        stale_ttl = cache_config.get('stale_ttl', 0)
+        PROVIDER_CACHE.max_size = cache_config.get(
+            'max_size', DEFAULT_PROVIDER_CACHE_SIZE)
+        cache_key = (self.user, json.dumps(provider_config, sort_keys=True,
+                                           default=str))
 
-    def check_user_permissions(self, account_alias, role):
+        cached = PROVIDER_CACHE.get(cache_key)
+        if cached is None:
+            self.logger.info(
+                "Provider cache miss for user '%s' (hits: %d, misses: %d)",
+                self.user, PROVIDER_CACHE.hits, PROVIDER_CACHE.misses)
+            return self._fetch_account_and_role_dict(cache_key, ttl, stale_ttl)
+
+        fetched_at, accounts_and_roles = cached
+        age = time.time() - fetched_at
+        if age < ttl:
+            self.logger.debug(
+                "Provider cache hit for user '%s', %.1f seconds old "
+                "(hits: %d, misses: %d)", self.user, age,
+                PROVIDER_CACHE.hits, PROVIDER_CACHE.misses)
+            return accounts_and_roles
+
+        self.logger.info(
+            "Provider cache entry for user '%s' is stale (%.1f seconds old), "
+            "refreshing in the background (hits: %d, misses: %d)",
+            self.user, age, PROVIDER_CACHE.hits, PROVIDER_CACHE.misses)
+        with _PROVIDER_REFRESHES_LOCK:
+            if cache_key in _PROVIDER_REFRESHES:
+                return accounts_and_roles
+            _PROVIDER_REFRESHES.add(cache_key)
+        refresh = threading.Thread(
+            target=self._refresh_account_and_role_dict,
+            args=(cache_key, ttl, stale_ttl))
+        refresh.daemon = True
+        refresh.start()
+        return accounts_and_roles
+
+    def _ask_provider(self):
+        with PROVIDER_SECONDS.time(self.endpoint):
+            return self.provider.get_accounts_and_roles()
+
+    def _fetch_account_and_role_dict(self, cache_key, ttl, stale_ttl):
+        """Ask the provider and put the result into PROVIDER_CACHE"""
+        fetched_at = time.time()
+        accounts_and_roles = self._ask_provider()
+        PROVIDER_CACHE.set(cache_key, (fetched_at, accounts_and_roles),
+                           expires_at=fetched_at + ttl + stale_ttl)
+        return accounts_and_roles
+
+    def _refresh_account_and_role_dict(self, cache_key, ttl, stale_ttl):
+        """Background part of get_account_and_role_dict()"""
+        try:
+            self._fetch_account_and_role_dict(cache_key, ttl, stale_ttl)
+        except Exception:
+            self.logger.exception(
+                "Refreshing accounts and roles for user '%s' failed, "
+                "keeping the stale cache entry:", self.user)
+        finally:
+            with _PROVIDER_REFRESHES_LOCK:
+                _PROVIDER_REFRESHES.discard(cache_key)
+
+    @traced
+    def check_user_permissions(self, account_alias, role, accounts_and_roles=None):
         """Check if a user has permissions to access a role.
 
-        Raise exception if access is not granted."""
-        accounts_and_roles = self.get_account_and_role_dict()
+        Raise exception if access is not granted. accounts_and_roles is the
+        result of get_account_and_role_dict(), if the caller already has it.
+        """
+        if accounts_and_roles is None:
+            accounts_and_roles = self.get_account_and_role_dict()
         permitted_roles = accounts_and_roles.get(account_alias, [])
         for permitted_role, reason in permitted_roles:
             if role == permitted_role:
@@ -120,26 +296,186 @@ class AWSFederationProxy(object):
         self.logger.warn(message)
         raise PermissionError(message)
 
-    @log_function_call
-    def get_aws_credentials(self, account_alias, role):
+    @traced
+    def get_aws_credentials(self, account_alias, role, accounts_and_roles=None):
         """Get temporary credentials from AWS"""
-        self.check_user_permissions(account_alias, role)
-        try:
-            account_id = self.account_config[account_alias]['id']
-        except Exception:
+        self.check_user_permissions(account_alias, role, accounts_and_roles)
+        cache_key, key_id, secret_key, arn, cache_config = \
+            self._get_credentials_request(account_alias, role)
+        credentials = self._get_cached_credentials(cache_key, arn, cache_config)
+        if credentials is None:
+            credentials = STS_CALLS.do(cache_key, self._assume_role_and_cache,
+                                       cache_key, cache_config, key_id, secret_key, arn)
+        if cache_config.get('refresh_ahead'):
+            self._track_for_refresh(cache_key, credentials, cache_config,
+                                    key_id, secret_key, arn)
+        return credentials
+
+    def get_aws_credentials_batch(self, pairs):
+        """Get temporary credentials for a list of (account, role) pairs
+
+        The provider is asked only once, then up to
+        batch_credentials['concurrency'] threads call STS in parallel.
+        Return an iterator of (account, role, credentials, error) in the
+        order in which the pairs are done, with error set to the exception
+        (and credentials to None) for pairs that failed.
+        """
+        accounts_and_roles = self.get_account_and_role_dict()
+        concurrency = self.application_config.get('batch_credentials', {}).get(
+            'concurrency', DEFAULT_BATCH_CONCURRENCY)
+        todo = queue.Queue()
+        for pair in pairs:
+            todo.put(pair)
+        done = queue.Queue()
+
+        def work():
+            while True:
+                try:
+                    account_alias, role = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    credentials = self.get_aws_credentials(
+                        account_alias, role, accounts_and_roles)
+                except Exception as error:
+                    done.put((account_alias, role, None, error))
+                else:
+                    done.put((account_alias, role, credentials, None))
+
+        for _ in range(min(concurrency, len(pairs))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+        return (done.get() for _ in pairs)
+
+    def _get_credentials_request(self, account_alias, role):
+        """Return (cache key, key id, secret key, role ARN, cache config)"""
+        account_id = self.get_account_index().get_id(account_alias)
+        if account_id is None:
             message = "No Configuration for account '{account}'."
             raise ConfigurationError(message.format(account=account_alias))
         arn = "arn:aws:iam::{account_id}:role/{role}".format(
             account_id=account_id, role=role)
         key_id = self.application_config['aws']['access_key']
         secret_key = self.application_config['aws']['secret_key']
+        cache_config = self.application_config.get('credentials_cache', {})
+        self._check_refresh_config(cache_config)
+        return (key_id, arn, self.user), key_id, secret_key, arn, cache_config
+
+    @staticmethod
+    def _check_refresh_config(cache_config):
+        """Raise ConfigurationError for invalid background renewal options"""
+        refresh_ahead = cache_config.get('refresh_ahead')
+        if not refresh_ahead:
+            return
+        expiry_margin = cache_config.get('expiry_margin',
+                                         DEFAULT_CREDENTIALS_EXPIRY_MARGIN)
+        if (not isinstance(refresh_ahead, numbers.Number) or
+                refresh_ahead <= expiry_margin):
+            # Renewed credentials would only be cached once they are no
+            # longer handed out.
+            raise ConfigurationError(
+                "credentials_cache.refresh_ahead must be a number larger than "
+                "expiry_margin ({0}), not {1!r}".format(expiry_margin, refresh_ahead))
+        concurrency = cache_config.get('refresh_concurrency',
+                                       DEFAULT_REFRESH_CONCURRENCY)
+        if (isinstance(concurrency, bool) or
+                not isinstance(concurrency, numbers.Integral) or concurrency < 1):
+            raise ConfigurationError(
+                "credentials_cache.refresh_concurrency must be a positive "
+                "integer, not {0!r}".format(concurrency))
+
+    def _get_cached_credentials(self, cache_key, arn, cache_config):
+        """Return credentials from CREDENTIALS_CACHE, None on a miss
+
+        Raise PermissionError if STS recently refused the role.
+        """
+        CREDENTIALS_CACHE.max_size = cache_config.get(
+            'max_size', DEFAULT_CREDENTIALS_CACHE_SIZE)
+        credentials = CREDENTIALS_CACHE.get(cache_key)
+        self.logger.debug(
+            "Credentials cache %s for '%s' (hits: %d, misses: %d)",
+            "miss" if credentials is None else "hit", arn,
+            CREDENTIALS_CACHE.hits, CREDENTIALS_CACHE.misses)
+        if isinstance(credentials, PermissionError):
+            raise PermissionError(
+                "{0} (cached, STS is asked again after at most {1} "
+                "seconds)".format(credentials, cache_config.get(
+                    'denied_ttl', DEFAULT_CREDENTIALS_DENIED_TTL)))
+        return credentials
+
+    def _cache_denial(self, cache_key, error, cache_config):
+        """Put the PermissionError from STS into CREDENTIALS_CACHE"""
+        ttl = cache_config.get('denied_ttl', DEFAULT_CREDENTIALS_DENIED_TTL)
+        if ttl:
+            CREDENTIALS_CACHE.set(cache_key, error, expires_at=time.time() + ttl)
+
+    def _track_for_refresh(self, cache_key, credentials, cache_config,
+                           key_id, secret_key, arn):
+        """Let CREDENTIALS_REFRESHER renew credentials before they expire"""
+        expiration = self._get_expiration_timestamp(credentials)
+        if expiration is None:
+            return
+        refresh_ahead = cache_config['refresh_ahead']
+
+        def renew():
+            new_credentials = STS_CALLS.do(cache_key, self._assume_role_and_cache,
+                                           cache_key, cache_config, key_id,
+                                           secret_key, arn, BACKGROUND_ENDPOINT)
+            new_expiration = self._get_expiration_timestamp(new_credentials)
+            self.logger.info("Renewed credentials of user '%s' for '%s' "
+                             "in the background", self.user, arn)
+            if new_expiration is None:
+                return None
+            return new_expiration - refresh_ahead
+
+        CREDENTIALS_REFRESHER.max_entries = cache_config.get(
+            'refresh_max_entries', DEFAULT_REFRESH_MAX_ENTRIES)
+        CREDENTIALS_REFRESHER.idle_time = cache_config.get(
+            'refresh_idle_time', DEFAULT_REFRESH_IDLE_TIME)
+        CREDENTIALS_REFRESHER.concurrency = cache_config.get(
+            'refresh_concurrency', DEFAULT_REFRESH_CONCURRENCY)
+        CREDENTIALS_REFRESHER.track(cache_key, renew,
+                                    due_at=expiration - refresh_ahead)
+
+    def _assume_role_and_cache(self, cache_key, cache_config, key_id,
+                               secret_key, arn, endpoint=None):
+        """Call _assume_role() and put the result into CREDENTIALS_CACHE
+
+        This runs inside STS_CALLS.do(), so the cache is filled before the
+        call is over for STS_CALLS. Otherwise a thread that just missed the
+        cache could start another AssumeRole call for the same key.
+        """
         try:
-            sts_connection = STSConnection(
-                aws_access_key_id=key_id,
-                aws_secret_access_key=secret_key)
-            assumed_role_object = sts_connection.assume_role(
-                role_arn=arn,
-                role_session_name=self.user)
+            credentials = self._assume_role(key_id, secret_key, arn, endpoint)
+        except PermissionError as error:
+            self._cache_denial(cache_key, error, cache_config)
+            raise
+        self._cache_credentials(cache_key, credentials, cache_config)
+        return credentials
+
+    def _assume_role(self, key_id, secret_key, arn, endpoint=None):
+        """Call STS AssumeRole for arn and return the credentials
+
+        The call is timed for endpoint, by default self.endpoint.
+        """
+        if endpoint is None:
+            endpoint = self.endpoint
+        with STS_SECONDS.time(endpoint):
+            return self._call_assume_role(key_id, secret_key, arn)
+
+    def _call_assume_role(self, key_id, secret_key, arn):
+        try:
+            STS_CONNECTION_POOL.max_idle = self.application_config['aws'].get(
+                'connection_pool_size', DEFAULT_STS_CONNECTION_POOL_SIZE)
+            with STS_CONNECTION_POOL.connection(
+                    (key_id, secret_key),
+                    lambda: STSConnection(aws_access_key_id=key_id,
+                                          aws_secret_access_key=secret_key)
+            ) as sts_connection:
+                assumed_role_object = sts_connection.assume_role(
+                    role_arn=arn,
+                    role_session_name=self.user)
         except Exception as error:
             if getattr(error, 'status', None) == 403:
                 raise PermissionError(str(error))
@@ -148,6 +484,30 @@ class AWSFederationProxy(object):
             raise AWSError(str(error))
         return assumed_role_object.credentials
 
+    def _get_expiration_timestamp(self, credentials):
+        """Return the expiration of credentials in seconds since the epoch"""
+        from boto.utils import parse_ts
+        try:
+            expiration = parse_ts(credentials.expiration)
+        except Exception as exc:
+            self.logger.warn("Credentials have unparsable expiration '%s': %s",
+                             credentials.expiration, exc)
+            return None
+        return calendar.timegm(expiration.utctimetuple())
+
+    def _cache_credentials(self, cache_key, credentials, cache_config):
+        """Put credentials into CREDENTIALS_CACHE until shortly before expiry
+
+        Return the expiration timestamp of the credentials, None if unknown.
+        """
+        margin = cache_config.get('expiry_margin',
+                                  DEFAULT_CREDENTIALS_EXPIRY_MARGIN)
+        expiration = self._get_expiration_timestamp(credentials)
+        if expiration is not None:
+            CREDENTIALS_CACHE.set(cache_key, credentials,
+                                  expires_at=expiration - margin)
+        return expiration
+
     @staticmethod
     def _generate_urlencoded_json_credentials(credentials):
         """Return urlencoded json-string with given credentials"""
@@ -168,27 +528,31 @@ class AWSFederationProxy(object):
     @classmethod
     def _get_signin_token(cls, credentials):
         """Return signin token for given credentials"""
+        import requests
         request_url = (
-            "https://signin.aws.amazon.com/federation"
+            SIGNIN_URL +
             "?Action=getSigninToken"
             "&SessionDuration=43200"
             "&Session=" +
             cls._generate_urlencoded_json_credentials(credentials))
-        reply = requests.get(request_url)
+        try:
+            reply = SIGNIN_SESSION.get(request_url, timeout=SIGNIN_TIMEOUT)
+        except requests.RequestException as error:
+            message = 'Could not get session from AWS: {0}'
+            raise AWSError(message.format(error))
         if reply.status_code != 200:
             message = 'Could not get session from AWS: Error {0} {1}'
             raise AWSError(message.format(reply.status_code, reply.reason))
         # reply.text is a JSON document with a single element named SigninToken
         return json.loads(reply.text)["SigninToken"]
 
-    @log_function_call
     def _construct_console_url(self, signin_token, callback_url):
         """Construct and return string with URL to aws console"""
         # Create URL that will let users sign in to the console using the
         # sign-in token. This URL must be used within 15 minutes of when the
         # sign-in token was issued.
         request_url_template = (
-            "https://signin.aws.amazon.com/federation"
+            SIGNIN_URL +
             "?Action=login"
             "&Issuer={callbackurl}"
             "&Destination={destination}"
@@ -198,7 +562,9 @@ class AWSFederationProxy(object):
             destination=quote_plus("https://console.aws.amazon.com/"),
             signin_token=signin_token)
 
+    @traced
     def get_console_url(self, credentials, callback_url):
         """Return Console URL for given credentials"""
-        token = self._get_signin_token(credentials)
+        with SIGNIN_SECONDS.time(self.endpoint):
+            token = self._get_signin_token(credentials)
         return self._construct_console_url(token, callback_url)
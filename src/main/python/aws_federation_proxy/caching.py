@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Thread-safe helpers to cache and de-duplicate expensive work in a worker"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from ordereddict import OrderedDict
+
+
+class LRUCache(object):
+    """Mapping of at most max_size entries with optional per-entry expiry
+
+    When full, the least recently used entry is dropped. Entries stored
+    with an expires_at timestamp (seconds since the epoch) are no longer
+    returned once that time has passed. Lookups are counted in self.hits
+    and self.misses.
+    """
+
+    def __init__(self, max_size, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default if missing/expired"""
+        with self.lock:
+            try:
+                value, expires_at = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= self.clock():
+                self.misses += 1
+                return default
+            # Re-insert to mark the entry as most recently used.
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """Store value for key, evicting the least recently used entry"""
+        with self.lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key and return its value, or default if missing"""
+        with self.lock:
+            try:
+                return self._entries.pop(key)[0]
+            except KeyError:
+                return default
+
+    def clear(self):
+        """Remove all entries and reset the statistics"""
+        with self.lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call(object):
+    """A call in progress in SingleFlight"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Run at most one call per key at a time
+
+    Threads asking for a key while a call for it is in progress wait for
+    that call and get its return value, or its exception raised again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """Return function(*args, **kwargs), shared by concurrent callers"""
+        with self.lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class ConfigMemo(object):
+    """Values computed from configuration objects, once per object
+
+    Configurations are only reloaded when their files change, so the same
+    object is passed in again until then and values are keyed by its id().
+    Values of superseded objects are never asked for again; they are all
+    dropped once max_size values are stored. Exceptions raised by compute
+    are not remembered.
+    """
+
+    def __init__(self, compute, max_size=16):
+        self.compute = compute
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # id(config) -> (config, value)
+        self._values = {}
+
+    def get(self, config, *args):
+        """Return compute(config, *args), computed once per config object"""
+        try:
+            cached_config, value = self._values[id(config)]
+            if cached_config is config:
+                return value
+        except KeyError:
+            pass
+        value = self.compute(config, *args)
+        with self.lock:
+            if len(self._values) >= self.max_size:
+                self._values.clear()
+            # Keep a reference to config, so its id() is not reused.
+            self._values[id(config)] = (config, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self._values = {}
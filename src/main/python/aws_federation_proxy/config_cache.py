@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Process-wide cache for YAML configuration read with yamlreader"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import glob
+import os
+import threading
+import time
+
+from yamlreader import yaml_load
+
+# Files modified less than this many seconds before they were examined may
+# still be changed without a visible difference in (mtime, size): filesystem
+# timestamps are much coarser than the time needed to rewrite a small file.
+# Such "racy" results are never trusted and get reloaded on the next access.
+RACY_INTERVAL = 2
+
+
+def _get_yaml_files(source):
+    """Return the files yaml_load() would read for the given source"""
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.yaml")))
+    if os.path.isfile(source):
+        return [source]
+    return sorted(glob.glob(source))
+
+
+def _get_fingerprint(source):
+    """Return (fingerprint, newest mtime) of all files read for source"""
+    fingerprint = []
+    newest_mtime = 0
+    for filename in _get_yaml_files(source):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # Deleted between glob() and stat(), the next check will notice.
+            continue
+        fingerprint.append((filename, stat.st_ino, stat.st_mtime,
+                            stat.st_size))
+        newest_mtime = max(newest_mtime, stat.st_mtime)
+    return tuple(fingerprint), newest_mtime
+
+
+class CachedYamlConfig(object):
+    """The merged YAML data found in source, reloaded only on file changes
+
+    The returned data is shared between all threads of the process and
+    must be treated as read-only.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.lock = threading.Lock()
+        # (fingerprint, data), replaced as a whole so readers always see
+        # a consistent pair without taking the lock.
+        self._state = (None, None)
+
+    def get(self):
+        """Return the data, reloading it if any of its files changed"""
+        fingerprint, data = self._state
+        if fingerprint is not None and fingerprint == _get_fingerprint(self.source)[0]:
+            return data
+        with self.lock:
+            # The fingerprint must be taken before reading the files: if a
+            # file changes while it is read, the next check will see it.
+            check_time = time.time()
+            new_fingerprint, newest_mtime = _get_fingerprint(self.source)
+            fingerprint, data = self._state
+            if fingerprint is not None and fingerprint == new_fingerprint:
+                return data
+            data = yaml_load(self.source)
+            if newest_mtime > check_time - RACY_INTERVAL:
+                new_fingerprint = None
+            self._state = (new_fingerprint, data)
+        return data
+
+
+_CACHED_CONFIGS = {}
+_CACHED_CONFIGS_LOCK = threading.Lock()
+
+
+def load_config(source):
+    """Return yaml_load(source), cached for the lifetime of the process"""
+    try:
+        cached_config = _CACHED_CONFIGS[source]
+    except KeyError:
+        with _CACHED_CONFIGS_LOCK:
+            cached_config = _CACHED_CONFIGS.setdefault(
+                source, CachedYamlConfig(source))
+    return cached_config.get()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Long-lived connections shared by all threads of a worker"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+def _has_http_status(error):
+    """True if error is an answer from the remote side, not a broken link"""
+    return getattr(error, 'status', None) is not None
+
+
+class ConnectionPool(object):
+    """Idle connections per key, each used by only one thread at a time
+
+    A connection is returned to the pool after successful use, or when
+    is_usable(error) says the exception raised while using it left it
+    intact. By default that is the case for errors carrying an HTTP status.
+    Any other exception may mean the connection is broken, so it is
+    discarded and a new one is built for the next request.
+
+    At most max_idle connections are kept per key. Connections idle for
+    more than idle_timeout seconds are not used again. Discarded
+    connections are passed to close(), if given.
+    """
+
+    def __init__(self, max_idle, idle_timeout=None, close=None,
+                 is_usable=_has_http_status, clock=time.time):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.close = close
+        self.is_usable = is_usable
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> list of (connection, time it was returned to the pool)
+        self._idle = {}
+
+    @contextmanager
+    def connection(self, key, factory, new=False):
+        """Yield an idle connection for key, or a new one from factory()
+
+        With new=True, a new connection is made even if idle ones exist.
+        """
+        connection = None if new else self._get(key)
+        if connection is None:
+            connection = factory()
+        try:
+            yield connection
+        except Exception as error:
+            if self.is_usable(error):
+                self._put(key, connection)
+            else:
+                self._discard(connection)
+            raise
+        self._put(key, connection)
+
+    def _get(self, key):
+        expired = []
+        connection = None
+        with self.lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, returned_at = idle.pop()
+                if (self.idle_timeout is not None and
+                        returned_at + self.idle_timeout < self.clock()):
+                    expired.append(candidate)
+                else:
+                    connection = candidate
+                    break
+        for candidate in expired:
+            self._discard(candidate)
+        return connection
+
+    def _put(self, key, connection):
+        with self.lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((connection, self.clock()))
+                return
+        self._discard(connection)
+
+    def _discard(self, connection):
+        if self.close is None:
+            return
+        try:
+            self.close(connection)
+        except Exception:
+            # Closing a broken connection is expected to fail sometimes.
+            pass
+
+    def clear(self, key=None):
+        """Drop all idle connections, or only those for key"""
+        with self.lock:
+            if key is None:
+                idle = self._idle
+                self._idle = {}
+            else:
+                idle = {key: self._idle.pop(key, [])}
+        for connections in idle.values():
+            for connection, _ in connections:
+                self._discard(connection)
+
+
+def new_http_session(pool_size):
+    """Return a requests.Session keeping up to pool_size connections per host
+
+    The session is meant to be shared by all threads, i.e. all users, so it
+    never stores cookies.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from six.moves.http_cookiejar import DefaultCookiePolicy
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class LazyHTTPSession(object):
+    """A new_http_session(pool_size), made when it is first used
+
+    Importing requests takes a good part of a worker's startup time, so it
+    is only done once a request is actually sent.
+    """
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = new_http_session(self.pool_size)
+        return self._session
+
+    def get(self, *args, **kwargs):
+        """Like requests.Session.get()"""
+        return self.session.get(*args, **kwargs)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Logging handler that never blocks the thread logging"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import logging
+import threading
+
+from six.moves import queue
+
+DEFAULT_LOGGING_QUEUE_SIZE = 10000
+# Seconds flush() and close() wait for the listener thread.
+DEFAULT_FLUSH_TIMEOUT = 5
+
+
+class _Flush(object):
+    """Marker put into the queue, set when all records before it are handled"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class QueueHandler(logging.Handler):
+    """Pass records to target in a single listener thread
+
+    emit() only puts the record into a queue of at most max_size records.
+    If the queue is full, e.g. because syslog stalls, the record is dropped
+    and counted in self.dropped; the listener reports the count to target
+    once it catches up.
+
+    close() handles all queued records before it closes target, and is
+    called by logging.shutdown() when the process exits.
+    """
+
+    def __init__(self, target, max_size=DEFAULT_LOGGING_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = queue.Queue(max_size)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._listener = threading.Thread(target=self._listen,
+                                          name='afp-logging-queue')
+        self._listener.daemon = True
+        self._listener.start()
+
+    def prepare(self, record):
+        """Render the message now: args may change after emit() returns,
+        and the traceback must not keep its frames alive
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _listen(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, _Flush):
+                item.done.set()
+                continue
+            self._handle(item)
+            if self.dropped != self._reported_dropped and self.queue.empty():
+                self._report_dropped()
+
+    def _handle(self, record):
+        try:
+            self.target.handle(record)
+        except Exception:
+            # target.handle() reports its own errors, this is a last resort
+            # to keep the listener alive.
+            pass
+
+    def _report_dropped(self):
+        with self._dropped_lock:
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        self._handle(logging.LogRecord(
+            __name__, logging.WARNING,
+            __file__, 0, "Logging queue was full, dropped %d log records "
+            "(%d in total)", (dropped, self.dropped), None))
+
+    def flush(self, timeout=DEFAULT_FLUSH_TIMEOUT):
+        """Wait up to timeout seconds for all queued records to be handled"""
+        if not self._listener.is_alive():
+            return
+        marker = _Flush()
+        try:
+            self.queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.done.wait(timeout)
+        self.target.flush()
+
+    def close(self, timeout=DEFAULT_FLUSH_TIMEOUT):
+        """Handle the queued records, stop the listener and close target"""
+        if self._listener.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._listener.join(timeout)
+        self.target.close()
+        logging.Handler.close(self)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Latency histograms shared by all threads of a worker, in Prometheus format"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the +Inf bucket is implicit.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Outcome of a phase that did not raise.
+OK = 'ok'
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+class Histogram(object):
+    """Durations per (endpoint, outcome)
+
+    observe() only takes a lock for a few additions, so all threads can
+    share one instance. Counts are kept per bucket and only summed up
+    when rendered.
+    """
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS,
+                 clock=time.time):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (endpoint, outcome) -> [count per bucket..., count above, sum]
+        self._series = {}
+
+    def observe(self, seconds, endpoint, outcome):
+        index = bisect.bisect_left(self.buckets, seconds)
+        key = (endpoint, outcome)
+        with self.lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def time(self, endpoint):
+        """Observe the duration of the with block
+
+        The outcome is OK, or the class name of the exception raised.
+        """
+        start = self.clock()
+        try:
+            yield
+        except Exception as error:
+            self.observe(self.clock() - start, endpoint, type(error).__name__)
+            raise
+        self.observe(self.clock() - start, endpoint, OK)
+
+    def clear(self):
+        with self.lock:
+            self._series = {}
+
+    def render(self):
+        """Return the histogram in Prometheus text format"""
+        with self.lock:
+            series = [(key, list(values)) for key, values in self._series.items()]
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} histogram'.format(self.name)]
+        for (endpoint, outcome), values in sorted(series):
+            labels = 'endpoint="{0}",outcome="{1}"'.format(
+                _escape(endpoint), _escape(outcome))
+            count = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), values):
+                count += bucket_count
+                if bound != '+Inf':
+                    bound = _format_float(bound)
+                lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                    self.name, labels, bound, count))
+            lines.append('{0}_sum{{{1}}} {2}'.format(
+                self.name, labels, _format_float(values[-1])))
+            lines.append('{0}_count{{{1}}} {2}'.format(self.name, labels, count))
+        return '\n'.join(lines) + '\n'
+
+
+PROVIDER_SECONDS = Histogram(
+    'afp_provider_lookup_seconds',
+    'Time the provider took to return the accounts and roles of a user.')
+STS_SECONDS = Histogram(
+    'afp_sts_assume_role_seconds',
+    'Time of STS AssumeRole calls.')
+SIGNIN_SECONDS = Histogram(
+    'afp_signin_token_seconds',
+    'Time to fetch a console signin token.')
+CONFIG_SECONDS = Histogram(
+    'afp_config_load_seconds',
+    'Time to get a configuration, including the check for changed files.')
+REQUEST_SECONDS = Histogram(
+    'afp_request_seconds',
+    'Time to answer a request; outcome is the HTTP status.')
+
+HISTOGRAMS = (PROVIDER_SECONDS, STS_SECONDS, SIGNIN_SECONDS, CONFIG_SECONDS,
+              REQUEST_SECONDS)
+
+
+def render():
+    """Return all histograms in Prometheus text format"""
+    return ''.join(histogram.render() for histogram in HISTOGRAMS)
+
+
+def clear():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
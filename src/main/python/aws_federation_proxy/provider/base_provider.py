@@ -26,8 +26,161 @@ class BaseProvider(object):
         raise NotImplementedError
 
 
+DEFAULT_GROUP_MEMO_SIZE = 100000
+REASON_TEMPLATE = 'user is in group "%s" which matches regexp "%s"'
+
+# Named groups and references to them in a regular expression.
+_NAMED_GROUP = re.compile(r'\(\?P([<=])(\w+)')
+
+
+def _anchor(regex):
+    """Make regex match whole strings only"""
+    if not regex.startswith('^'):
+        regex = '^' + regex
+    if not regex.endswith('$'):
+        regex = regex + '$'
+    return regex
+
+
+# Inline flags like (?i) that apply to the whole regular expression.
+_GLOBAL_FLAGS = re.compile(r'\^?\(\?[aiLmsux]+\)')
+
+
+def _is_combinable(regex):
+    """True if the anchored regex means the same in GroupMatcher's pattern
+
+    It does not with top-level alternatives like '^a|b$', where re.search()
+    finds 'b' at the end of any group name but the combined pattern is only
+    tried at its start, with numbered backreferences and conditionals,
+    which refer to other groups once rules are combined, and with global
+    inline flags, which must start the whole pattern.
+    """
+    if _GLOBAL_FLAGS.match(regex):
+        return False
+    depth = 0
+    in_class = False
+    position = 0
+    while position < len(regex):
+        char = regex[position]
+        if char == '\\':
+            if not in_class and regex[position + 1:position + 2] in '123456789':
+                return False
+            position += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # A ']' right after '[' or '[^' is a literal.
+            if regex[position + 1:position + 2] == '^':
+                position += 1
+            if regex[position + 1:position + 2] == ']':
+                position += 1
+        elif char == '(':
+            if regex.startswith('(?(', position) and regex[position + 3:position + 4].isdigit():
+                return False
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return False
+        position += 1
+    return True
+
+
+class GroupMatcher(object):
+    """Maps group names to (account, role, regex) with a single regex match
+
+    rules is a sequence of (regex, account_template, role_template). The
+    templates are str.format() strings using the named groups of regex. If
+    several rules match, the first one wins.
+
+    Consecutive rules are combined into one regular expression, so each
+    group name is matched only once. Rules that would mean something else
+    in it (see _is_combinable) are searched for on their own, with
+    re.search() like before rules could be combined.
+
+    get_grant() remembers its result for up to memo_size group names.
+    """
+
+    def __init__(self, rules, memo_size=DEFAULT_GROUP_MEMO_SIZE):
+        self.memo_size = memo_size
+        self._grants = {}
+        self.rules = []
+        # (match or search method of a compiled pattern, index of its rule
+        # or None for combined rules, where match.lastgroup tells it)
+        self._finders = []
+        alternatives = []
+        for index, (regex, account_template, role_template) in enumerate(rules):
+            regex = _anchor(regex)
+            group_names = list(re.compile(regex).groupindex)
+            if _is_combinable(regex):
+                prefix = 'rule%d_' % index
+                alternatives.append('(?P<rule%d>(?:%s))' % (index, _NAMED_GROUP.sub(
+                    lambda match: '(?P%s%s%s' % (match.group(1), prefix, match.group(2)),
+                    regex)))
+                group_names = [(prefix + name, name) for name in group_names]
+            else:
+                self._add_combined(alternatives)
+                alternatives = []
+                self._finders.append((re.compile(regex).search, index))
+                group_names = [(name, name) for name in group_names]
+            self.rules.append((regex, group_names, account_template, role_template))
+        self._add_combined(alternatives)
+
+    def _add_combined(self, alternatives):
+        if alternatives:
+            self._finders.append((re.compile('|'.join(alternatives)).match, None))
+
+    def match(self, group):
+        """Return (account, role, regex) for group, None if no rule matches"""
+        for find, index in self._finders:
+            match = find(group)
+            if match is None:
+                continue
+            if index is None:
+                index = int(match.lastgroup[4:])
+            regex, group_names, account_template, role_template = self.rules[index]
+            values = dict((name, match.group(group_name))
+                          for group_name, name in group_names)
+            return (account_template.format(**values),
+                    role_template.format(**values),
+                    regex)
+        return None
+
+    def get_grant(self, group):
+        """Return (account, role, reason) for group, None if no rule matches"""
+        try:
+            return self._grants[group]
+        except KeyError:
+            pass
+        grant = self.match(group)
+        if grant is not None:
+            account, role, regex = grant
+            grant = (account, role, REASON_TEMPLATE % (group, regex))
+        grants = self._grants
+        if len(grants) >= self.memo_size:
+            # Much cheaper than LRU bookkeeping on every lookup, and the
+            # group names in use are quickly remembered again.
+            grants.clear()
+        grants[group] = grant
+        return grant
+
+
+_GROUP_MATCHERS = {}
+
+
+def get_group_matcher(rules):
+    """Return the GroupMatcher for rules, compiled once per process"""
+    rules = tuple(rules)
+    try:
+        return _GROUP_MATCHERS[rules]
+    except KeyError:
+        return _GROUP_MATCHERS.setdefault(rules, GroupMatcher(rules))
+
+
 class ProviderByGroups(BaseProvider):
-    """Uses a user's groups and a regex to determine the accounts/roles
+    """Uses a user's groups and regexes to determine the accounts/roles
 
     This class assumes that config['regex'] is a regular expression that will
     produce two matching-groups called 'account' and 'role' when applied to
@@ -38,6 +191,15 @@ class ProviderByGroups(BaseProvider):
     will produce a matching-group "account" which matched "myaccount" and a
     matching group "role" which matched "administrator".
 
+    Additional naming conventions can be configured in config['rules'], a
+    list of dicts with a 'regex' and optional 'account' and 'role'
+    str.format() templates using its named groups, e.g.
+            {'regex': 'prod_(?P<name>.*)_admins',
+             'account': 'prod-{name}',
+             'role': 'administrator'}
+    The templates default to '{account}' and '{role}'. The first regex (or
+    rule) matching a group determines its account and role.
+
     Actually retrieving group information must be implemented by subclasses.
     """
     def __init__(self, user, config, logger=None, **kwargs):
@@ -46,12 +208,20 @@ class ProviderByGroups(BaseProvider):
             config,
             logger=logger,
             **kwargs)
-        regex = config['regex']
-        if not regex.startswith('^'):
-            regex = '^' + regex
-        if not regex.endswith('$'):
-            regex = regex + '$'
-        self.regex = regex
+        rules = []
+        self.regex = None
+        if 'regex' in config:
+            self.regex = _anchor(config['regex'])
+            rules.append((self.regex, '{account}', '{role}'))
+        for rule in config.get('rules', []):
+            rules.append((rule['regex'],
+                          rule.get('account', '{account}'),
+                          rule.get('role', '{role}')))
+        if not rules:
+            raise Exception("Neither 'regex' nor 'rules' configured")
+        self.group_matcher = get_group_matcher(rules)
+        self.group_matcher.memo_size = config.get('group_memo_size',
+                                                  DEFAULT_GROUP_MEMO_SIZE)
 
     def get_group_list(self):
         """Return the groups for self.user"""
@@ -63,24 +233,20 @@ class ProviderByGroups(BaseProvider):
         groups which are assigned to the user
         """
         groups = self.get_group_list()
+        get_grant = self.group_matcher.get_grant
         accounts_and_roles = {}
         for group in groups:
-            match = re.search(self.regex, group)
-            if match:
-                account = match.group('account')
-                role = match.group('role')
-                reason = 'user is in group "%s" which matches regexp "%s"' % (
-                    group, self.regex)
-                self.logger.debug(
-                    'User "%s" may access account "%s", role "%s" because %s.',
-                    self.user, role, account, reason)
-                if account in accounts_and_roles:
-                    accounts_and_roles[account].add((role, reason))
-                else:
-                    accounts_and_roles[account] = set([(role, reason)])
+            grant = get_grant(group)
+            if grant is None:
+                continue
+            account, role, reason = grant
+            self.logger.debug(
+                'User "%s" may access account "%s", role "%s" because %s.',
+                self.user, account, role, reason)
+            if account in accounts_and_roles:
+                accounts_and_roles[account].add((role, reason))
             else:
-                self.logger.debug('Group "%s" did not match regex "%s"',
-                                  group, self.regex)
+                accounts_and_roles[account] = set([(role, reason)])
         return accounts_and_roles
 
 
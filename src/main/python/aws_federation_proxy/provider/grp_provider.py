@@ -3,10 +3,92 @@ from __future__ import print_function, absolute_import, unicode_literals, divisi
 from aws_federation_proxy.provider import ProviderByGroups
 
 import grp
+import os
+import pwd
+import threading
+import time
+
+GROUP_FILE = '/etc/group'
+DEFAULT_GROUP_INDEX_TTL = 300
+
+
+def _get_group_file_state():
+    """Return (inode, mtime, size) of GROUP_FILE, None if it cannot be read"""
+    try:
+        stat = os.stat(GROUP_FILE)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+class GroupIndex(object):
+    """Maps lowercased user names to the names of their groups
+
+    The index is built from grp.getgrall() and rebuilt when GROUP_FILE
+    changes or when it is older than ttl seconds, whichever comes first.
+    Groups from other NSS sources are therefore seen after at most ttl
+    seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (built_at, group file state, members, gid -> group name,
+        #  user -> primary group name)
+        self._state = None
+
+    def _build(self, group_file_state):
+        built_at = time.time()
+        members = {}
+        group_names = {}
+        for group in grp.getgrall():
+            group_names[group.gr_gid] = group.gr_name
+            for member in group.gr_mem:
+                groups = members.setdefault(member.lower(), [])
+                if not groups or groups[-1] != group.gr_name:
+                    groups.append(group.gr_name)
+        return built_at, group_file_state, members, group_names, {}
+
+    def _get_state(self):
+        state = self._state
+        group_file_state = _get_group_file_state()
+        if (state is not None and state[1] == group_file_state and
+                state[0] + self.ttl > time.time()):
+            return state
+        with self.lock:
+            if self._state is state:
+                self._state = self._build(group_file_state)
+            return self._state
+
+    def get_groups(self, user):
+        """Return the names of all groups of user, primary group first"""
+        _, _, members, group_names, primary_groups = self._get_state()
+        groups = members.get(user.lower(), [])
+        try:
+            primary_group = primary_groups[user]
+        except KeyError:
+            try:
+                primary_group = group_names.get(pwd.getpwnam(user).pw_gid)
+            except KeyError:
+                primary_group = None
+            primary_groups[user] = primary_group
+        if primary_group is None or primary_group in groups:
+            return list(groups)
+        return [primary_group] + groups
+
+    def clear(self):
+        """Force a rebuild on the next lookup"""
+        self._state = None
+
+
+# Shared by all Provider instances of the process.
+GROUP_INDEX = GroupIndex(DEFAULT_GROUP_INDEX_TTL)
 
 
 class Provider(ProviderByGroups):
     """Uses the builtin grp module to retrieve group information"""
 
     def get_group_list(self):
-        return [g.gr_name for g in grp.getgrall() if self.user.lower() in map(str.lower, g.gr_mem)]
+        GROUP_INDEX.ttl = self.config.get('group_index_ttl',
+                                          DEFAULT_GROUP_INDEX_TTL)
+        return GROUP_INDEX.get_groups(self.user)
@@ -2,53 +2,169 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import, division
 
+import time
+
 import ldap
+from aws_federation_proxy.caching import LRUCache
+from aws_federation_proxy.connection_pool import ConnectionPool
 from aws_federation_proxy.provider import ProviderByGroups
 
+DEFAULT_LDAP_POOL_SIZE = 10
+DEFAULT_LDAP_IDLE_TIMEOUT = 300
+DEFAULT_LDAP_CACHE_SIZE = 10000
+DEFAULT_LDAP_DN_CACHE_TTL = 3600
+DEFAULT_LDAP_NEGATIVE_CACHE_TTL = 60
+DEFAULT_LDAP_GROUP_CACHE_TTL = 60
+
+# Cached instead of a DN for users that do not exist.
+UNKNOWN_USER = ''
+
+# (ldap_uri, ldap_base_users, lowercased user) -> DN or UNKNOWN_USER
+USER_DN_CACHE = LRUCache(DEFAULT_LDAP_CACHE_SIZE)
+# (ldap_uri, ldap_base_groups, DN) -> group names
+GROUP_CACHE = LRUCache(DEFAULT_LDAP_CACHE_SIZE)
+
+# Errors after which an LDAP connection must not be used again.
+CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR)
+
+
+def _is_usable(error):
+    """True if the connection survived the given error"""
+    return not isinstance(error, CONNECTION_ERRORS)
+
+
+def _unbind(connection):
+    connection.unbind_s()
+
+
+# Bound connections per (ldap_uri, ldap_bind_dn, ldap_bind_password), shared
+# by all Provider instances of the process.
+LDAP_CONNECTION_POOL = ConnectionPool(DEFAULT_LDAP_POOL_SIZE,
+                                      idle_timeout=DEFAULT_LDAP_IDLE_TIMEOUT,
+                                      close=_unbind,
+                                      is_usable=_is_usable)
+
 
 class Provider(ProviderByGroups):
     """Uses the ldap module to retrieve group information from LDAP"""
 
+    def _connect(self):
+        """Return a new LDAP connection, bound with the configured DN"""
+        connection = ldap.initialize(self.config['ldap_uri'])
+        connection.simple_bind_s(self.config['ldap_bind_dn'],
+                                 self.config['ldap_bind_password'])
+        return connection
+
     def get_group_list(self):
-        ldap_uri = self.config['ldap_uri']
-        ldap_base_users = self.config['ldap_base_users']
-        ldap_base_groups = self.config['ldap_base_groups']
-        ldap_bind_dn = self.config['ldap_bind_dn']
-        ldap_bind_password = self.config['ldap_bind_password']
+        USER_DN_CACHE.max_size = GROUP_CACHE.max_size = self.config.get(
+            'ldap_cache_size', DEFAULT_LDAP_CACHE_SIZE)
+        dn = USER_DN_CACHE.get(self._get_dn_cache_key())
+        if dn == UNKNOWN_USER:
+            self.logger.debug('User "%s" is cached as unknown', self.user)
+            return []
+        if dn is not None:
+            groups = GROUP_CACHE.get(self._get_group_cache_key(dn))
+            if groups is not None:
+                return list(groups)
+
+        LDAP_CONNECTION_POOL.max_idle = self.config.get(
+            'ldap_pool_size', DEFAULT_LDAP_POOL_SIZE)
+        LDAP_CONNECTION_POOL.idle_timeout = self.config.get(
+            'ldap_idle_timeout', DEFAULT_LDAP_IDLE_TIMEOUT)
+        pool_key = (self.config['ldap_uri'],
+                    self.config['ldap_bind_dn'],
+                    self.config['ldap_bind_password'])
+        try:
+            try:
+                with LDAP_CONNECTION_POOL.connection(pool_key, self._connect) as connection:
+                    return self._search_group_list(connection, dn)
+            except CONNECTION_ERRORS as e:
+                # The server probably closed the pooled connection, e.g. on a
+                # restart, and then all other idle ones as well. Drop them and
+                # try once more with a new connection.
+                self.logger.warning('LDAP connection failed, reconnecting: %s', e)
+                LDAP_CONNECTION_POOL.clear(pool_key)
+                with LDAP_CONNECTION_POOL.connection(pool_key, self._connect,
+                                                     new=True) as connection:
+                    return self._search_group_list(connection, dn)
+        except ldap.LDAPError:
+            self.logger.exception('LDAP search for user "%s" failed:', self.user)
+            raise
 
-        l = ldap.initialize(ldap_uri)
+    def _get_dn_cache_key(self):
+        return (self.config['ldap_uri'], self.config['ldap_base_users'],
+                self.user.lower())
 
+    def _get_group_cache_key(self, dn):
+        return (self.config['ldap_uri'], self.config['ldap_base_groups'], dn)
+
+    def _search_user_dn(self, connection):
+        """Return the DN of self.user, UNKNOWN_USER if there is none"""
         self.logger.debug('User: "%s"', self.user.lower())
         search_filter = '(|(&(objectClass=user)' \
                         '(sAMAccountName=%s)))' \
                         % self.user.lower()
 
         self.logger.debug('User DN Search Filter: "%s"', search_filter)
-        try:
-            l.simple_bind_s(ldap_bind_dn, ldap_bind_password)
-
-            # Find user's DN
-            result = l.search_s(ldap_base_users, ldap.SCOPE_SUBTREE, search_filter, ['dn', ])
-            dn, _ = result[0]
-            self.logger.debug('User DN: "%s"', dn)
-
-            search_filter = '(|(&(objectClass=group)' \
-                            '(member:1.2.840.113556.1.4.1941:=%s)))' \
-                            % dn
-            self.logger.debug('Group Search Filter: "%s"', search_filter)
-
-            result = l.search_s(ldap_base_groups, ldap.SCOPE_SUBTREE, search_filter, ['name', ])
-            results = []
-            for _, entry in result:
-                if type(entry) is dict:
-                    results.append(entry['name'][0])
-
-            self.logger.debug('Groups: "%s"', results)
-            return results
-        except ldap.LDAPError as e:
-            print(e.message['info'])
-            if type(e.message) == dict and 'desc' in e.message:
-                print(e.message['desc'])
-            else:
-                print(e)
-        return False
+
+        # Find user's DN
+        result = connection.search_s(self.config['ldap_base_users'], ldap.SCOPE_SUBTREE,
+                                     search_filter, ['dn', ])
+        # Active Directory may answer with search references (None, [urls])
+        # only, e.g. for unknown users; they are no DN.
+        dns = [dn for dn, _ in result if dn is not None]
+        if dns:
+            dn = dns[0]
+            ttl = self.config.get('ldap_dn_cache_ttl', DEFAULT_LDAP_DN_CACHE_TTL)
+        else:
+            dn = UNKNOWN_USER
+            ttl = self.config.get('ldap_negative_cache_ttl',
+                                  DEFAULT_LDAP_NEGATIVE_CACHE_TTL)
+        self.logger.debug('User DN: "%s"', dn)
+        if ttl:
+            USER_DN_CACHE.set(self._get_dn_cache_key(), dn,
+                              expires_at=time.time() + ttl)
+        return dn
+
+    def _search_group_list(self, connection, dn=None):
+        """Return the groups of self.user, using the bound connection
+
+        dn is the cached DN of self.user, None if it must be searched.
+        """
+        if dn is not None:
+            results = self._search_groups(connection, dn)
+            if results:
+                return results
+            # The user may have been moved or renamed in the directory
+            # since the DN was cached.
+            USER_DN_CACHE.pop(self._get_dn_cache_key())
+            new_dn = self._search_user_dn(connection)
+            if new_dn == dn:
+                return results
+            dn = new_dn
+        else:
+            dn = self._search_user_dn(connection)
+        if dn == UNKNOWN_USER:
+            self.logger.info('User "%s" not found in LDAP', self.user)
+            return []
+        return self._search_groups(connection, dn)
+
+    def _search_groups(self, connection, dn):
+        """Return the names of the groups that dn is a member of"""
+        search_filter = '(|(&(objectClass=group)' \
+                        '(member:1.2.840.113556.1.4.1941:=%s)))' \
+                        % dn
+        self.logger.debug('Group Search Filter: "%s"', search_filter)
+
+        result = connection.search_s(self.config['ldap_base_groups'], ldap.SCOPE_SUBTREE, search_filter, ['name', ])
+        results = []
+        for _, entry in result:
+            if type(entry) is dict:
+                results.append(entry['name'][0])
+
+        self.logger.debug('Groups: "%s"', results)
+        ttl = self.config.get('ldap_group_cache_ttl', DEFAULT_LDAP_GROUP_CACHE_TTL)
+        if ttl:
+            GROUP_CACHE.set(self._get_group_cache_key(dn), tuple(results),
+                            expires_at=time.time() + ttl)
+        return results
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import socket
+
+from binascii import hexlify
+from bisect import bisect_right
+
+from aws_federation_proxy import PermissionError
+from aws_federation_proxy.caching import ConfigMemo
+from aws_federation_proxy.provider import BaseProvider
+
+_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+# IPv6 addresses ::ffff:a.b.c.d are IPv4 clients of a dual-stack socket.
+_IPV4_MAPPED = 0xffff << 32
+
+
+def _parse_address(address):
+    """Return (version, address as int), raise ValueError if invalid"""
+    for version in (4, 6):
+        try:
+            packed = socket.inet_pton(_FAMILIES[version][0], address)
+        except (socket.error, ValueError, TypeError):
+            continue
+        value = int(hexlify(packed), 16)
+        if version == 6 and value >> 32 == 0xffff:
+            return 4, value - _IPV4_MAPPED
+        return version, value
+    raise ValueError("'{0}' is not an IP address".format(address))
+
+
+def _parse_network(network):
+    """Return (version, first, last address as int) of a CIDR network"""
+    address, _, length = network.partition('/')
+    try:
+        version, first = _parse_address(address)
+        bits = _FAMILIES[version][1]
+        length = int(length) if length else bits
+        if ':' in address and version == 4:
+            # Mapped IPv4 networks are written with IPv6 prefix lengths.
+            length -= 96
+        if not 0 <= length <= bits:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Invalid network '{0}'".format(network))
+    host_mask = (1 << (bits - length)) - 1
+    if first & host_mask:
+        raise ValueError("Network '{0}' has host bits set".format(network))
+    return version, first, first | host_mask
+
+
+class NetworkTable(object):
+    """Longest prefix match of IP addresses against a table of networks
+
+    networks is a sequence of (network, value) with networks in CIDR
+    notation, e.g. ('10.1.0.0/16', value). Nested networks are allowed, the
+    most specific one wins. The table is flattened into sorted, disjoint
+    address ranges per IP version, so a lookup is a single binary search.
+    """
+
+    def __init__(self, networks):
+        prefixes = {4: [], 6: []}
+        seen = {}
+        for network, value in networks:
+            version, first, last = _parse_network(network)
+            if (version, first, last) in seen:
+                raise ValueError("Network '{0}' is configured twice (as '{1}')".format(
+                    network, seen[version, first, last]))
+            seen[version, first, last] = network
+            prefixes[version].append((first, -last, (network, value)))
+        # version -> (sorted range starts, [(range end, (network, value))])
+        self._ranges = dict((version, self._flatten(prefixes[version]))
+                            for version in prefixes)
+        self.size = len(seen)
+
+    @staticmethod
+    def _flatten(prefixes):
+        """Return the disjoint ranges covered by prefixes, sorted by address
+
+        Two CIDR networks are either disjoint or one contains the other, so
+        sorted by start address (and outermost first for equal starts) they
+        nest like parentheses.
+        """
+        starts = []
+        ranges = []
+
+        def add(first, last, entry):
+            if first <= last:
+                starts.append(first)
+                ranges.append((last, entry))
+
+        open_networks = []
+        position = 0
+        for first, negative_last, entry in sorted(prefixes, key=lambda p: p[:2]):
+            last = -negative_last
+            while open_networks and open_networks[-1][0] < first:
+                outer_last, outer_entry = open_networks.pop()
+                add(position, outer_last, outer_entry)
+                position = outer_last + 1
+            if open_networks:
+                add(position, first - 1, open_networks[-1][1])
+            open_networks.append((last, entry))
+            position = first
+        while open_networks:
+            outer_last, outer_entry = open_networks.pop()
+            add(position, outer_last, outer_entry)
+            position = outer_last + 1
+        return starts, ranges
+
+    def lookup(self, address):
+        """Return (network, value) of the most specific network containing
+        address, None if there is none. Raise ValueError for invalid addresses.
+        """
+        version, value = _parse_address(address)
+        starts, ranges = self._ranges[version]
+        index = bisect_right(starts, value) - 1
+        if index < 0:
+            return None
+        last, entry = ranges[index]
+        if value > last:
+            return None
+        return entry
+
+
+def _compile_network_table(networks):
+    return NetworkTable((entry['network'], (entry['account'], entry['role']))
+                        for entry in networks)
+
+
+_NETWORK_TABLES = ConfigMemo(_compile_network_table)
+
+
+def get_network_table(networks):
+    """Return the NetworkTable for the configured networks
+
+    Tables are compiled once per process and list of networks.
+    """
+    return _NETWORK_TABLES.get(networks)
+
+
+class Provider(BaseProvider):
+    """Uses the client IP address and a table of networks, returning exactly
+    one role
+
+    config['networks'] is a list of dicts with 'network' (CIDR notation),
+    'account' and 'role'. The most specific network containing the client
+    address determines account and role.
+    """
+
+    def __init__(self, user, config, logger=None, **kwargs):
+        super(Provider, self).__init__(user, config, logger=logger, **kwargs)
+        self.network_table = get_network_table(config['networks'])
+
+    def get_accounts_and_roles(self):
+        """Return a dict with one account and one aws role"""
+        try:
+            entry = self.network_table.lookup(self.user)
+        except ValueError as exc:
+            raise PermissionError(str(exc))
+        if entry is None:
+            raise PermissionError(
+                "Client IP {0} is not in any configured network".format(self.user))
+        network, (account, role) = entry
+        reason = "Machine {0} is in network {1} which maps to role {2}".format(
+            self.user, network, role)
+        return {account: set([(role, reason)])}
@@ -2,11 +2,110 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import, unicode_literals, division
 
+import threading
+import time
+
 from socket import gethostbyaddr
 
 from aws_federation_proxy import PermissionError
+from aws_federation_proxy.caching import LRUCache
 from aws_federation_proxy.provider import BaseProvider
 
+DEFAULT_DNS_CACHE_SIZE = 10000
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_DNS_NEGATIVE_CACHE_TTL = 30
+DEFAULT_DNS_REFRESH_AHEAD = 60
+DEFAULT_DNS_TIMEOUT = 2
+DEFAULT_DNS_MAX_LOOKUPS = 20
+
+
+class _Lookup(object):
+    """A reverse lookup in progress in ReverseDNSCache"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class ReverseDNSCache(object):
+    """Cached gethostbyaddr() that never blocks the caller for long
+
+    Lookups run in a separate thread per address; the caller waits at most
+    timeout seconds for them. A lookup that takes longer still completes and
+    fills the cache for later requests. Successful lookups are cached for
+    ttl seconds and renewed in the background during their last
+    refresh_ahead seconds; failed lookups are cached for negative_ttl
+    seconds.
+
+    At most max_lookups lookups run at a time, so a hanging resolver does
+    not pile up threads. When that many are running, uncached addresses
+    are denied at once and cached names are not renewed early.
+    """
+
+    def __init__(self, max_size, max_lookups=DEFAULT_DNS_MAX_LOOKUPS):
+        self.cache = LRUCache(max_size)
+        self.max_lookups = max_lookups
+        self.lock = threading.Lock()
+        self._lookups = {}
+
+    def get_fqdn(self, address, ttl, negative_ttl, refresh_ahead, timeout):
+        """Return the FQDN of address, raise Exception if there is none"""
+        cached = self.cache.get(address)
+        if cached is None:
+            lookup = self._start_lookup(address, ttl, negative_ttl)
+            if lookup is None:
+                raise Exception("Lookup for '{0}' not started, {1} lookups are "
+                                "in progress".format(address, self.max_lookups))
+            lookup.done.wait(timeout)
+            if not lookup.done.is_set():
+                raise Exception("Lookup for '{0}' timed out after {1} "
+                                "seconds".format(address, timeout))
+            cached = lookup.result
+        fqdn, error, expires_at = cached
+        if error is not None:
+            raise Exception(error)
+        if expires_at - time.time() < refresh_ahead:
+            self._start_lookup(address, ttl, negative_ttl)
+        return fqdn
+
+    def _start_lookup(self, address, ttl, negative_ttl):
+        """Return the lookup of address, None if too many are in progress"""
+        with self.lock:
+            lookup = self._lookups.get(address)
+            if lookup is not None:
+                return lookup
+            if len(self._lookups) >= self.max_lookups:
+                return None
+            lookup = self._lookups[address] = _Lookup()
+        thread = threading.Thread(target=self._lookup,
+                                  args=(address, lookup, ttl, negative_ttl))
+        thread.daemon = True
+        thread.start()
+        return lookup
+
+    def _lookup(self, address, lookup, ttl, negative_ttl):
+        try:
+            fqdn, error = gethostbyaddr(address)[0], None
+        except Exception as exc:
+            # The exception message of gethostbyaddr() is quite useless since
+            # it does not include the address that was looked up.
+            fqdn = None
+            error = "Lookup for '{0}' failed: {1}".format(address, exc)
+            ttl = negative_ttl
+        expires_at = time.time() + ttl
+        lookup.result = (fqdn, error, expires_at)
+        self.cache.set(address, lookup.result, expires_at=expires_at)
+        with self.lock:
+            del self._lookups[address]
+        lookup.done.set()
+
+    def clear(self):
+        """Forget all cached lookups"""
+        self.cache.clear()
+
+
+# Shared by all ProviderByIP instances of the process.
+REVERSE_DNS_CACHE = ReverseDNSCache(DEFAULT_DNS_CACHE_SIZE)
+
 
 class ProviderByIP(BaseProvider):
     """Uses IP address/FQDN as username, returning exactly one role
@@ -18,13 +117,18 @@ class ProviderByIP(BaseProvider):
     def get_accounts_and_roles(self):
         """Return a dict with one account and one aws role"""
         self.role_prefix = self.config.get('role_prefix', "")
-        try:
-            self.client_fqdn = gethostbyaddr(self.user)[0]
-        except Exception as exc:
-            # The exception message of gethostbyaddr() is quite useless since
-            # it does not include the address that was looked up.
-            message = "Lookup for '{0}' failed: {1}".format(self.user, exc)
-            raise Exception(message)
+        REVERSE_DNS_CACHE.cache.max_size = self.config.get(
+            'dns_cache_size', DEFAULT_DNS_CACHE_SIZE)
+        REVERSE_DNS_CACHE.max_lookups = self.config.get(
+            'dns_max_lookups', DEFAULT_DNS_MAX_LOOKUPS)
+        self.client_fqdn = REVERSE_DNS_CACHE.get_fqdn(
+            self.user,
+            ttl=self.config.get('dns_cache_ttl', DEFAULT_DNS_CACHE_TTL),
+            negative_ttl=self.config.get('dns_negative_cache_ttl',
+                                         DEFAULT_DNS_NEGATIVE_CACHE_TTL),
+            refresh_ahead=self.config.get('dns_refresh_ahead',
+                                          DEFAULT_DNS_REFRESH_AHEAD),
+            timeout=self.config.get('dns_timeout', DEFAULT_DNS_TIMEOUT))
         self.check_host_allowed()
         self._get_role_name()
         reason = "Machine {0} (FQDN {1}) matched the role {2}".format(
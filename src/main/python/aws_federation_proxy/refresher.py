@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Background renewal of frequently used cache entries before they expire"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import logging
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6
+    from ordereddict import OrderedDict
+
+from six.moves import queue
+
+
+class Refresher(object):
+    """Call the renew function of recently used entries when they are due
+
+    track() registers a key with a renew function and the time at which it
+    is due. A scheduler thread checks every check_interval seconds for due
+    entries and hands them to at most concurrency worker threads. renew()
+    returns the next due time, or None to stop tracking the key.
+
+    Entries not tracked again for idle_time seconds are dropped, and at most
+    max_entries (the most recently used ones) are kept. Changing
+    concurrency starts or stops workers as needed.
+    """
+
+    def __init__(self, max_entries, concurrency, idle_time,
+                 check_interval=5, clock=time.time, logger=None):
+        self.max_entries = max_entries
+        self._concurrency = concurrency
+        self.idle_time = idle_time
+        self.check_interval = check_interval
+        self.clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        # key -> (renew, due_at, last_used)
+        self._entries = OrderedDict()
+        self._in_progress = set()
+        self._queue = queue.Queue()
+        self._started = False
+        self._workers = 0
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @concurrency.setter
+    def concurrency(self, concurrency):
+        with self.lock:
+            self._concurrency = concurrency
+            if self._started:
+                self._adjust_workers()
+
+    def track(self, key, renew, due_at):
+        """Remember that key was just used and must be renewed at due_at"""
+        with self.lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (renew, due_at, self.clock())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if not self._started:
+                self._start_thread(self._schedule)
+                self._started = True
+                self._adjust_workers()
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def _adjust_workers(self):
+        """Start or stop workers to match concurrency, with self.lock held"""
+        while self._workers < self._concurrency:
+            self._start_thread(self._work)
+            self._workers += 1
+        while self._workers > self._concurrency:
+            # The next idle worker taking this from the queue stops.
+            self._queue.put(None)
+            self._workers -= 1
+
+    def _schedule(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.run_due()
+            except Exception:
+                self.logger.exception("Scheduling renewals failed:")
+
+    def run_due(self):
+        """Drop idle entries and queue all entries that are due for renewal"""
+        now = self.clock()
+        with self.lock:
+            for key, (renew, due_at, last_used) in list(self._entries.items()):
+                if last_used + self.idle_time < now:
+                    del self._entries[key]
+                elif due_at <= now and key not in self._in_progress:
+                    self._in_progress.add(key)
+                    self._queue.put((key, renew))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                self._renew(*item)
+            finally:
+                self._queue.task_done()
+
+    def _renew(self, key, renew):
+        try:
+            due_at = renew()
+        except Exception:
+            self.logger.exception("Renewing %s in the background failed:", key)
+            due_at = None
+        with self.lock:
+            self._in_progress.discard(key)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if due_at is None:
+                del self._entries[key]
+            else:
+                # Keep last_used: renewal alone must not keep an entry alive.
+                self._entries[key] = (entry[0], due_at, entry[2])
+
+    def clear(self):
+        """Forget all tracked entries"""
+        with self.lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
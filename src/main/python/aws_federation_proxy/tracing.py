@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Sampled per-request traces of the phases of a request"""
+
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import io
+import json
+import random
+import threading
+import time
+
+from functools import wraps
+
+# Request header asking for a Server-Timing response header, and its key
+# in the WSGI environ.
+SERVER_TIMING_REQUEST_HEADER = 'X-Server-Timing'
+SERVER_TIMING_ENVIRON_KEY = 'HTTP_X_SERVER_TIMING'
+
+
+class _NoSpan(object):
+    """Span of requests that are not traced"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span(object):
+    """Context manager adding the time of its block to a Trace"""
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.trace.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.trace.add_span(self.name, self.start, self.trace.clock(),
+                            exc_type.__name__ if exc_type else None)
+        return False
+
+
+class Trace(object):
+    """Spans of one request
+
+    Spans are recorded from the start, since whether the request is traced
+    is only known once the configuration is loaded: decide() stops
+    recording if the request is neither sampled nor asked for
+    Server-Timing. Spans may be added from several threads.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.recording = True
+        self.sampled = False
+        self.server_timing = False
+        # (name, start, end, name of the exception raised or None)
+        self.spans = []
+
+    def decide(self, tracing_config, server_timing_requested,
+               random_number=random.random):
+        """Decide whether to keep recording, see the tracing config"""
+        sample_rate = tracing_config.get('sample_rate', 0)
+        self.sampled = bool(sample_rate) and random_number() < sample_rate
+        self.server_timing = bool(server_timing_requested)
+        self.recording = self.sampled or self.server_timing
+        if not self.recording:
+            self.spans = []
+
+    def span(self, name):
+        """Return a context manager recording the time of its block"""
+        if not self.recording:
+            return NO_SPAN
+        return Span(self, name)
+
+    def add_span(self, name, start, end, error=None):
+        if self.recording:
+            # list.append() is atomic, no lock needed.
+            self.spans.append((name, start, end, error))
+
+    def get_server_timing(self, end=None):
+        """Return the value of a Server-Timing header with all spans"""
+        end = self.clock() if end is None else end
+        entries = ['{0};dur={1:.1f}'.format(name, (span_end - start) * 1e3)
+                   for name, start, span_end, _ in self.spans]
+        entries.append('total;dur={0:.1f}'.format((end - self.start) * 1e3))
+        return ', '.join(entries)
+
+    def to_dict(self, end=None, **fields):
+        """Return the trace as a dict for JSON, with fields added"""
+        end = self.clock() if end is None else end
+        trace = dict(fields)
+        trace['start'] = self.start
+        trace['duration_ms'] = round((end - self.start) * 1e3, 3)
+        trace['spans'] = [
+            {'name': name,
+             'offset_ms': round((start - self.start) * 1e3, 3),
+             'duration_ms': round((span_end - start) * 1e3, 3),
+             'error': error}
+            for name, start, span_end, error in sorted(
+                self.spans, key=lambda span: span[1])]
+        return trace
+
+
+def traced(method):
+    """Decorator recording calls of method in self.trace, if not None"""
+    name = method.__name__
+
+    @wraps(method)
+    def new_method(self, *args, **kwargs):
+        if self.trace is None:
+            return method(self, *args, **kwargs)
+        with self.trace.span(name):
+            return method(self, *args, **kwargs)
+    return new_method
+
+
+_WRITE_LOCK = threading.Lock()
+
+
+def write_trace(filename, trace_dict):
+    """Append trace_dict as a JSON line to filename
+
+    Lines of concurrent requests never interleave within a process.
+    """
+    line = json.dumps(trace_dict, sort_keys=True, default=str) + '\n'
+    with _WRITE_LOCK:
+        with io.open(filename, 'a', encoding='utf-8') as trace_file:
+            trace_file.write(line)
+
+
+def finish_trace(trace, tracing_config, logger, **fields):
+    """Write trace to tracing_config['file'] if it was sampled
+
+    Return the Server-Timing header value if that was asked for, else None.
+    Errors writing the trace are logged, not raised.
+    """
+    if trace is None or not trace.recording:
+        return None
+    end = trace.clock()
+    filename = tracing_config.get('file')
+    if trace.sampled and filename:
+        try:
+            write_trace(filename, trace.to_dict(end, **fields))
+        except Exception as error:
+            logger.warning("Could not write trace to '%s': %s", filename, error)
+    if trace.server_timing:
+        return trace.get_server_timing(end)
+    return None
@@ -4,6 +4,8 @@ import logging
 
 from pils import levelname_to_integer
 
+from .logging_queue import DEFAULT_LOGGING_QUEUE_SIZE, QueueHandler
+
 
 def _get_item_from_module(module_name, item_name):
     """Load classes/modules/functions/... from given config"""
@@ -56,5 +58,10 @@ def setup_logging(config, logger_name=''):
     formatter = logging.Formatter(log_format)
     handler.setFormatter(formatter)
 
+    # A stalled syslog or disk must not block requests.
+    queue_size = config.get('logging_queue_size', DEFAULT_LOGGING_QUEUE_SIZE)
+    if queue_size:
+        handler = QueueHandler(handler, max_size=queue_size)
+
     logger.addHandler(handler)
     return logger
@@ -5,6 +5,9 @@ from __future__ import print_function, absolute_import, division
 import datetime
 import logging
 import simplejson
+import six
+import sys
+import time
 
 from aws_federation_proxy import (
     AWSFederationProxy,
@@ -13,43 +16,128 @@ from aws_federation_proxy import (
     PermissionError
 )
 from functools import wraps
-from yamlreader import yaml_load
-from bottle import route, abort, request, response, error, default_app
+from bottle import (
+    route, abort, request, response, error, default_app, HTTPError, HTTPResponse)
+from aws_federation_proxy import metrics
+from aws_federation_proxy.tracing import (
+    SERVER_TIMING_ENVIRON_KEY, Trace, finish_trace)
 from aws_federation_proxy.util import setup_logging
+from aws_federation_proxy.config_cache import load_config
 
 
 LOGGER_NAME = 'AWSFederationProxy'
+DEFAULT_BATCH_MAX_PAIRS = 100
+# Key of the AWSFederationProxy of the current request in request.environ.
+PROXY_ENVIRON_KEY = 'aws_federation_proxy.proxy'
+# Key of the tracing.Trace of the current request in request.environ.
+TRACE_ENVIRON_KEY = 'aws_federation_proxy.trace'
+
+
+# (exception class, HTTP status, message, log message) for errors in routes,
+# the first matching class counts.
+EXCEPTION_STATUS = (
+    (ConfigurationError, 404, "ConfigurationError", "Call to '%s' failed:"),
+    (AWSError, 502, "Call to AWS failed", "AWS call in '%s' failed:"),
+    (PermissionError, 403, "Permission Denied", "Permission denied in '%s':"),
+    (Exception, 500, "Internal Server Error", "Call to '%s' failed:"),
+)
+
+
+def get_error_status(error, function_name):
+    """Log error raised in function_name, return (HTTP status, message)"""
+    logger = logging.getLogger(LOGGER_NAME)
+    for exception_class, status, message, log_message in EXCEPTION_STATUS:
+        if isinstance(error, exception_class):
+            if sys.exc_info()[1] is error:
+                logger.exception(log_message, function_name)
+            else:
+                # Raised elsewhere, e.g. in a worker thread.
+                logger.error(log_message + " %s", function_name, error)
+            return status, message
 
 
 def with_exception_handling(old_function):
-    """Decorator function to ensure proper exception handling"""
+    """Decorator function to ensure proper exception handling
+
+    Also times the request and traces it, see tracing.py.
+    """
     @wraps(old_function)
     def new_function(*args, **kwargs):
-        logger = logging.getLogger(LOGGER_NAME)
+        start = time.time()
+        request.environ[TRACE_ENVIRON_KEY] = Trace()
         try:
             result = old_function(*args, **kwargs)
-        except ConfigurationError:
-            logger.exception("Call to '%s' failed:", old_function.__name__)
-            abort(404, "ConfigurationError")
-        except AWSError:
-            logger.exception("AWS call in '%s' failed:", old_function.__name__)
-            abort(502, "Call to AWS failed")
-        except PermissionError:
-            logger.exception("Permission denied:")
-            abort(403, "Permission Denied")
-        except Exception:
-            logger.exception("Call to '%s' failed:", old_function.__name__)
-            abort(500, "Internal Server Error")
+        except HTTPResponse as exc:
+            # Explicit abort() by the route.
+            finish_request(start, exc.status_code, exc)
+            raise
+        except Exception as exc:
+            status, message = get_error_status(exc, old_function.__name__)
+            error = HTTPError(status, message)
+            finish_request(start, status, error)
+            raise error
+        finish_request(start, 200, response)
         return result
     return new_function
 
 
+def finish_request(start, status, response_object):
+    """Record metrics and the trace of the current request
+
+    The Server-Timing header, if asked for, is set on response_object.
+    Streamed responses are only timed until they start.
+    """
+    endpoint = get_endpoint()
+    metrics.REQUEST_SECONDS.observe(time.time() - start, endpoint, str(status))
+    proxy = request.environ.get(PROXY_ENVIRON_KEY)
+    if proxy is None:
+        # Failed before the configuration said whether to trace.
+        return
+    server_timing = finish_trace(
+        request.environ.get(TRACE_ENVIRON_KEY),
+        proxy.application_config.get('tracing', {}),
+        proxy.logger, endpoint=endpoint, path=request.path,
+        status=status, user=proxy.user)
+    if server_timing is not None:
+        response_object.set_header('Server-Timing', server_timing)
+
+
+def get_endpoint():
+    """Return the rule of the route of the current request, e.g.
+    '/account/<account>/<role>', to label metrics with
+    """
+    route = request.environ.get('bottle.route')
+    if route is None:
+        return 'unknown'
+    return route.rule
+
+
 def initialize_federation_proxy(user=None):
-    """Get needed config parts and initialize AWSFederationProxy"""
+    """Get needed config parts and initialize AWSFederationProxy
+
+    The proxy is built only once per request and then stored in the
+    request environ, so error handlers can use it again.
+    """
+    proxy = request.environ.get(PROXY_ENVIRON_KEY)
+    if proxy is not None:
+        return proxy
+    trace = request.environ.get(TRACE_ENVIRON_KEY)
+    if trace is None:
+        return _build_federation_proxy(user, None)
+    with trace.span('initialize_federation_proxy'):
+        return _build_federation_proxy(user, trace)
+
+
+def _build_federation_proxy(user, trace):
+    endpoint = get_endpoint()
     config_path = request.environ.get('CONFIG_PATH')
     if config_path is None:
         raise Exception("No Config Path specified")
-    config = yaml_load(config_path)
+    with metrics.CONFIG_SECONDS.time(endpoint):
+        config = load_config(config_path)
+    if trace is not None:
+        trace.decide(config.get('tracing', {}),
+                     request.environ.get(SERVER_TIMING_ENVIRON_KEY))
 
     try:
         logger = setup_logging(config, logger_name=LOGGER_NAME)
@@ -61,12 +149,32 @@ def initialize_federation_proxy(user=None):
     account_config_path = request.environ.get('ACCOUNT_CONFIG_PATH')
     if account_config_path is None:
         raise Exception("No Account Config Path specified")
-    account_config = yaml_load(account_config_path)
+    with metrics.CONFIG_SECONDS.time(endpoint):
+        account_config = load_config(account_config_path)
     proxy = AWSFederationProxy(user=user, config=config,
-                               account_config=account_config, logger=logger)
+                               account_config=account_config, logger=logger,
+                               endpoint=endpoint)
+    if trace is not None and trace.recording:
+        proxy.trace = trace
+    request.environ[PROXY_ENVIRON_KEY] = proxy
     return proxy
 
 
+def get_request_user():
+    """Return the user of the current request, "Unknown User" if unknown
+
+    Uses the proxy of the request if there is one, but never builds it.
+    """
+    proxy = request.environ.get(PROXY_ENVIRON_KEY)
+    if proxy is not None:
+        return proxy.user
+    try:
+        config = load_config(request.environ['CONFIG_PATH'])
+        return get_user(config['api']['user_identification'])
+    except Exception:
+        return "Unknown User"
+
+
 def get_user(user_config):
     """
     user_config = {
@@ -93,17 +201,29 @@ def build_credentials_dict(credentials):
     }
 
 
+def build_account_list(accounts_and_roles_with_sets, proxy, with_id=False):
+    """Convert the sets of (role, reason) tuples to lists of roles
+
+    With with_id, the account IDs are included as well, e.g.
+    "testaccount": {"id": "123456789012", "roles": ["testrole"]}
+    instead of "testaccount": ["testrole"].
+    """
+    if not with_id:
+        return dict((account, [role for role, reason in role_set])
+                    for account, role_set in accounts_and_roles_with_sets.items())
+    get_id = proxy.get_account_index().get_id
+    return dict((account, {'id': get_id(account),
+                           'roles': [role for role, reason in role_set]})
+                for account, role_set in accounts_and_roles_with_sets.items())
+
+
+@error(400)
 @error(403)
 @error(404)
 @error(500)
 @error(502)
 def get_error_json(err):
-    try:
-        proxy = initialize_federation_proxy()
-    except Exception:
-        user = "Unknown User"
-    else:
-        user = proxy.user
+    user = get_request_user()
     response_dict = {
         "status": err.status_code,
         "error": err.status,
@@ -135,29 +255,27 @@ def get_proxy_return_json(user=None):
 @get_proxy_return_json(user='monitoring')
 def get_monitoring_status(proxy):
     """Return status page for monitoring"""
+    # Reports broken provider and accounts configurations, without setting
+    # up the provider.
+    proxy.get_provider_class()
+    proxy.get_account_index()
     return {"status": "200", "message": "OK"}
 
 
+@route('/metrics')
+def get_metrics():
+    """Return the latency histograms of this worker process for Prometheus"""
+    response.content_type = metrics.CONTENT_TYPE
+    return metrics.render()
+
+
 @route('/account')
 @with_exception_handling
 @get_proxy_return_json()
 def get_accountlist(proxy):
     """Return a dict-of-lists of all accounts and roles for the current user"""
-    def role_set_to_list(role_set):
-        """Convert a set of (role, reason) tuples to a list of roles"""
-        return [role for role, reason in role_set]
-    accounts_and_roles_with_sets = proxy.get_account_and_role_dict()
-    accounts_and_roles = dict(
-        (key, role_set_to_list(value)) for (key, value)
-        in accounts_and_roles_with_sets.items()
-    )
-    if 'withid' in request.query:
-        # "testaccount": {"id": "123456789012", "roles": ["testrole"]}
-        return dict([(x, {'id': proxy.account_config.get(x, {}).get('id', None), 'roles': y})
-                     for x, y in accounts_and_roles.items()])
-    else:
-        # "testaccount": ["testrole"]
-        return accounts_and_roles
+    return build_account_list(proxy.get_account_and_role_dict(), proxy,
+                              'withid' in request.query)
 
 
 @route('/account/<account>/<role>')
@@ -205,6 +323,59 @@ def get_console(account, role):
     return str(console_url)
 
 
+def parse_batch_request(body, max_pairs):
+    """Return the (account, role) pairs of a batch request
+
+    body must be a JSON list of {"account": ..., "role": ...} with string
+    values and at most max_pairs elements, else ValueError is raised.
+    """
+    try:
+        pairs = [(pair['account'], pair['role']) for pair in simplejson.loads(body)]
+        if not all(isinstance(value, six.string_types) for pair in pairs for value in pair):
+            raise ValueError
+    except Exception:
+        raise ValueError('Expected a JSON list of {"account": ..., "role": ...}')
+    if len(pairs) > max_pairs:
+        raise ValueError("At most {0} account/role pairs per request".format(max_pairs))
+    return pairs
+
+
+def build_batch_result(account, role, credentials, error):
+    """Return the JSON line for one pair of a batch request"""
+    result = {'account': account, 'role': role}
+    if error is None:
+        result['status'] = 200
+        result['credentials'] = build_credentials_dict(credentials)
+    else:
+        result['status'], result['message'] = get_error_status(
+            error, 'get_credentials_batch')
+    return simplejson.dumps(result) + '\n'
+
+
+@route('/credentials', method='POST')
+@with_exception_handling
+def get_credentials_batch():
+    """Return credentials for many account/role pairs
+
+    The request body is a JSON list of {"account": ..., "role": ...}. The
+    response has one JSON document per line for each pair, in the order in
+    which they are done: {"account": ..., "role": ..., "status": 200,
+    "credentials": {...}} or, if this pair failed, "status" and "message"
+    like the error responses of the other routes.
+    """
+    proxy = initialize_federation_proxy()
+    response.set_header('X-Username', proxy.user)
+    max_pairs = proxy.application_config.get('batch_credentials', {}).get(
+        'max_pairs', DEFAULT_BATCH_MAX_PAIRS)
+    try:
+        pairs = parse_batch_request(request.body.read(), max_pairs)
+    except ValueError as exc:
+        abort(400, str(exc))
+    results = proxy.get_aws_credentials_batch(pairs)
+    response.content_type = 'application/x-ndjson; charset=utf-8'
+    return (build_batch_result(*result) for result in results)
+
+
 def get_account_and_role(proxy):
     accounts_and_roles = proxy.get_account_and_role_dict()
     if len(accounts_and_roles) != 1:
@@ -228,6 +399,8 @@ def get_ims_role():
     account, role = get_account_and_role(proxy)
     response.content_type = 'text/plain'
     try:
+        # Only list roles that can be assumed. The credentials are cached,
+        # so the request for them that usually follows needs no STS call.
         proxy.get_aws_credentials(account, role)
     except PermissionError:
         return ""
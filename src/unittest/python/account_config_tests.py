@@ -0,0 +1,68 @@
+from __future__ import print_function, absolute_import, division
+
+from mock import Mock
+from unittest2 import TestCase
+
+from aws_federation_proxy.account_config import AccountIndex, get_account_index
+
+
+class AccountIndexTest(TestCase):
+    def test_looks_up_ids_and_aliases(self):
+        index = AccountIndex({
+            'prod': {'id': '123456789012'},
+            'prod-alias': {'id': 123456789012},
+            'dev': {'id': '210987654321'},
+            'no-id': {}})
+
+        self.assertEqual(len(index), 4)
+        self.assertIn('no-id', index)
+        self.assertEqual(index.get_id('prod'), '123456789012')
+        self.assertEqual(index.get_id('no-id'), None)
+        self.assertEqual(index.get_id('unknown'), None)
+        self.assertEqual(index.get_aliases('123456789012'), ('prod', 'prod-alias'))
+        self.assertEqual(index.get_aliases(210987654321), ('dev',))
+        self.assertEqual(index.get_aliases('000000000000'), ())
+
+    def test_empty_config(self):
+        self.assertEqual(len(AccountIndex(None)), 0)
+
+    def test_leaves_out_invalid_entries(self):
+        for invalid_entry in ('123456789012',
+                              None,
+                              {'id': 'prod'},
+                              {'id': True},
+                              {'id': ['123456789012']}):
+            index = AccountIndex({'prod': invalid_entry, 'dev': {'id': '210987654321'}})
+
+            self.assertNotIn('prod', index)
+            self.assertEqual(index.get_id('dev'), '210987654321')
+            self.assertEqual(len(index.errors), 1)
+            self.assertIn("'prod'", index.errors[0])
+
+    def test_rejects_config_that_is_no_dict(self):
+        self.assertRaises(ValueError, AccountIndex, ['prod'])
+
+
+class GetAccountIndexTest(TestCase):
+    def test_builds_index_once_per_config(self):
+        account_config = {'prod': {'id': '123456789012'}}
+
+        index = get_account_index(account_config)
+
+        self.assertIs(get_account_index(account_config), index)
+        self.assertIsNot(get_account_index(dict(account_config)), index)
+
+    def test_logs_invalid_entries_once(self):
+        account_config = {'prod': {'id': 'prod'}}
+        logger = Mock()
+
+        get_account_index(account_config, logger)
+        get_account_index(account_config, logger)
+
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertIn("'prod'", logger.error.call_args[0][1])
+
+    def test_invalid_config_raises_every_time(self):
+        account_config = ['prod']
+        self.assertRaisesRegexp(ValueError, "'prod'", get_account_index, account_config)
+        self.assertRaisesRegexp(ValueError, "'prod'", get_account_index, account_config)
@@ -8,7 +8,10 @@ import tempfile
 import shutil
 import yaml
 import logging
+import simplejson
 import aws_federation_proxy.wsgi_api as wsgi_api
+from aws_federation_proxy.aws_federation_proxy import CREDENTIALS_CACHE, STS_CONNECTION_POOL
+from aws_federation_proxy.logging_queue import QueueHandler
 from aws_federation_proxy.util import setup_logging
 
 from moto import mock_sts
@@ -16,7 +19,7 @@ from six.moves.urllib.parse import quote_plus
 from webtest import TestApp
 from unittest2 import TestCase
 from mock import patch, Mock
-from aws_federation_proxy import AWSError, PermissionError
+from aws_federation_proxy import AWSError, PermissionError, metrics
 
 # Else we run into problems with mocking
 os.environ['http_proxy'] = ''
@@ -42,6 +45,8 @@ CREDENTIALS = {
 class BaseEndpointTest(TestCase):
     def setUp(self):
         self.user = 'testuser'
+        CREDENTIALS_CACHE.clear()
+        STS_CONNECTION_POOL.clear()
         self.config_path = tempfile.mkdtemp(prefix='afp-config-')
         self.account_config_path = tempfile.mkdtemp(
             prefix='afp-account-config-')
@@ -114,9 +119,17 @@ class BaseEndpointTest(TestCase):
     def tearDown(self):
         shutil.rmtree(self.config_path)
         shutil.rmtree(self.account_config_path)
-        os.unlink(self.log_file.name)
         if self.logger.handlers:
-            self.logger.removeHandler(self.logger.handlers[0])
+            handler = self.logger.handlers[0]
+            self.logger.removeHandler(handler)
+            handler.close()
+        os.unlink(self.log_file.name)
+
+    def read_log(self):
+        """Return what was logged so far"""
+        for handler in self.logger.handlers:
+            handler.flush()
+        return str(self.log_file.read())
 
 
 class AWSEndpointTest(BaseEndpointTest):
@@ -167,12 +180,41 @@ class AWSEndpointTest(BaseEndpointTest):
 
         self.assertEqual(result_dict, CREDENTIALS)
 
-        logged_data = str(self.log_file.read())
+        logged_data = self.read_log()
         self.assertIn('access to account', logged_data)
         self.assertIn('the_only_account', logged_data)
         self.assertIn('the_only_role', logged_data)
         self.assertIn(self.user, logged_data)
 
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_role_listing_hands_credentials_to_the_following_request(self, mock_sts_connection):
+        self.providerconfig['provider']['class'] = "SingleAccountSingleRoleProvider"
+        self._create_app()
+        mock_sts_connection.return_value.assume_role.return_value.credentials = Mock(
+            access_key='a', secret_key='s', session_token='t',
+            expiration='2099-01-01T00:00:00Z')
+
+        self.app.get('/meta-data/iam/security-credentials/')
+        result = self.app.get('/meta-data/iam/security-credentials/the_only_role')
+
+        self.assertEqual(result.json['Token'], 't')
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 1)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_role_listing_does_not_ask_sts_again_for_missing_role(self, mock_sts_connection):
+        class FakeHTTPError(Exception):
+            status = 403
+        self.providerconfig['provider']['class'] = "SingleAccountSingleRoleProvider"
+        self.basicconfig['credentials_cache'] = {'denied_ttl': 60}
+        self._create_app()
+        mock_sts_connection.return_value.assume_role.side_effect = FakeHTTPError
+
+        for _ in range(2):
+            result = self.app.get('/meta-data/iam/security-credentials/')
+            self.assertEqual(result.body, b"")
+
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 1)
+
     @mock_sts
     def test_get_credentials_must_fail_for_forbidden_role(self):
         result = self.app.get('/meta-data/iam/security-credentials/forbidden_role', expect_errors=True)
@@ -189,6 +231,29 @@ class AFPEndpointTest(BaseEndpointTest):
         expected_json = {"status": "200", "message": "OK"}
         self.assertEqual(result.json, expected_json)
 
+    @patch("aws_federation_proxy.AWSFederationProxy._setup_provider")
+    def test_status_does_not_set_up_provider(self, mock_setup_provider):
+        result = self.app.get('/status')
+        self.assertEqual(result.status_int, 200)
+        self.assertFalse(mock_setup_provider.called)
+
+    def test_metrics(self):
+        metrics.clear()
+        self.app.get('/account')
+        self.app.get('/account/testaccount/illegalrole/credentials', expect_errors=True)
+
+        result = self.app.get('/metrics')
+
+        self.assertEqual(result.content_type, 'text/plain')
+        self.assertIn('afp_request_seconds_count{endpoint="/account",outcome="200"} 1',
+                      result.text)
+        self.assertIn('afp_request_seconds_count{endpoint="/account/<account>/<role>'
+                      '/credentials",outcome="403"} 1', result.text)
+        self.assertIn('afp_provider_lookup_seconds_count{endpoint="/account",'
+                      'outcome="ok"} 1', result.text)
+        self.assertIn('afp_config_load_seconds_count{endpoint="/account",'
+                      'outcome="ok"} 2', result.text)
+
     def test_status_broken_providerconfig_must_be_reported(self):
         self.providerconfig = {
             'provider': {
@@ -215,6 +280,19 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(result.status_int, 404)
         self.assertIn('X-Username', result.headers)
 
+    def test_status_broken_accountconfig_must_be_reported(self):
+        self.accountconfig = ['testaccount']
+        self._create_app()
+        result = self.app.get('/status', expect_errors=True)
+        self.assertEqual(result.status_int, 404)
+
+    def test_status_logs_invalid_accounts(self):
+        self.accountconfig['testaccount'] = ['123456789']
+        self._create_app()
+        result = self.app.get('/status')
+        self.assertEqual(result.status_int, 200)
+        self.assertIn("Ignoring invalid account configuration", self.read_log())
+
     def test_status_broken_basicconfig_must_be_reported(self):
         self.basicconfig['logging_handler']['module'] = "a-module-that-does-not-exist"
         self._create_app()
@@ -234,6 +312,16 @@ class AFPEndpointTest(BaseEndpointTest):
         logger = logging.getLogger('foobar')
         self.assertEqual(logger.getEffectiveLevel(), logging.DEBUG)
 
+    def test_setup_logging_queues_records(self):
+        logger = setup_logging(self.basicconfig, logger_name='queued')
+        self.addCleanup(logger.handlers[0].close)
+        self.assertIsInstance(logger.handlers[0], QueueHandler)
+        self.assertIsInstance(logger.handlers[0].target, logging.FileHandler)
+
+        self.basicconfig['logging_queue_size'] = 0
+        logger = setup_logging(self.basicconfig, logger_name='unqueued')
+        self.assertIsInstance(logger.handlers[0], logging.FileHandler)
+
     def test_get_list_roles_and_accounts(self):
         result = self.app.get('/account')
         accounts_and_roles = {
@@ -254,6 +342,42 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(result.json, accounts_and_roles_withid)
         self.assertEqual(self.user, result.headers['X-Username'])
 
+    @mock_sts
+    def test_server_timing_if_asked_for(self):
+        result = self.app.get('/account/testaccount/testrole/credentials',
+                              headers={'X-Server-Timing': '1'})
+
+        names = [entry.split(';')[0]
+                 for entry in result.headers['Server-Timing'].split(', ')]
+        self.assertEqual(sorted(names), [
+            'check_user_permissions', 'get_account_and_role_dict',
+            'get_aws_credentials', 'initialize_federation_proxy', 'total'])
+
+    def test_server_timing_on_errors(self):
+        result = self.app.get('/account/testaccount/illegalrole/credentials',
+                              headers={'X-Server-Timing': '1'}, expect_errors=True)
+        self.assertEqual(result.status_int, 403)
+        self.assertIn('check_user_permissions;dur=', result.headers['Server-Timing'])
+
+    def test_no_server_timing_by_default(self):
+        result = self.app.get('/account')
+        self.assertNotIn('Server-Timing', result.headers)
+
+    def test_sampled_traces_are_written(self):
+        trace_file = os.path.join(self.account_config_path, 'traces.jsonl')
+        self.basicconfig['tracing'] = {'sample_rate': 1, 'file': trace_file}
+        self._create_app()
+
+        self.app.get('/account')
+
+        with open(trace_file) as lines:
+            trace = simplejson.loads(lines.readline())
+        self.assertEqual(trace['endpoint'], '/account')
+        self.assertEqual(trace['status'], 200)
+        self.assertEqual(trace['user'], self.user)
+        self.assertEqual([span['name'] for span in trace['spans']],
+                         ['initialize_federation_proxy', 'get_account_and_role_dict'])
+
     @mock_sts
     def test_get_credentials(self):
         result = self.app.get('/account/testaccount/testrole/credentials')
@@ -262,7 +386,7 @@ class AFPEndpointTest(BaseEndpointTest):
         del(result_dict['Expiration'])
         del(result_dict['LastUpdated'])
         self.assertEqual(result_dict, CREDENTIALS)
-        logged_data = str(self.log_file.read())
+        logged_data = self.read_log()
         self.assertIn('access to account', logged_data)
         self.assertIn('testaccount', logged_data)
         self.assertIn('testrole', logged_data)
@@ -270,7 +394,7 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(self.user, result.headers['X-Username'])
 
     @mock_sts
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_get_console_url(self, mock_get):
         token = "abcdefg123"
         callbackurl = ""
@@ -299,7 +423,7 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(result.body, expected_url)
 
     @mock_sts
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_get_credentials_and_consoleurl(self, mock_get):
         token = "abcdefg123"
         callbackurl = ""
@@ -324,7 +448,7 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(self.user, result.headers['X-Username'])
 
     @mock_sts
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_404_on_unconfigured_account(self, mock_get):
         token = "abcdefg123"
         mock_get.return_value = Mock(text=u'{"SigninToken": "%s"}' % token,
@@ -350,7 +474,7 @@ class AFPEndpointTest(BaseEndpointTest):
         self.assertEqual(self.user, result.headers['X-Username'])
 
     @mock_sts
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_403_on_illegal_role(self, mock_get):
         token = "abcdefg123"
         mock_get.return_value = Mock(text=u'{"SigninToken": "%s"}' % token,
@@ -374,14 +498,14 @@ class AFPEndpointTest(BaseEndpointTest):
         result.mustcontain("Permission Denied")
         self.assertEqual(self.user, result.headers['X-Username'])
 
-        logged_data = str(self.log_file.read())
+        logged_data = self.read_log()
         self.assertIn('may not access role', logged_data)
         self.assertIn('testaccount', logged_data)
         self.assertIn('illegalrole', logged_data)
         self.assertIn(self.user, logged_data)
 
     @mock_sts
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_403_on_illegal_account(self, mock_get):
         token = "abcdefg123"
         mock_get.return_value = Mock(text=u'{"SigninToken": "%s"}' % token,
@@ -405,7 +529,7 @@ class AFPEndpointTest(BaseEndpointTest):
         result.mustcontain("Permission Denied")
         self.assertEqual(self.user, result.headers['X-Username'])
 
-        logged_data = str(self.log_file.read())
+        logged_data = self.read_log()
         self.assertIn('may not access role', logged_data)
         self.assertIn('testaccount1', logged_data)
         self.assertIn('testrole', logged_data)
@@ -428,3 +552,52 @@ class AFPEndpointTest(BaseEndpointTest):
 
         with self.assertLogs(wsgi_api.LOGGER_NAME, logging.ERROR):
             self.app.get('/account/testaccount/testrole', expect_errors=True)
+
+    @mock_sts
+    def test_get_credentials_batch(self):
+        body = simplejson.dumps([
+            {'account': 'testaccount', 'role': 'testrole'},
+            {'account': 'testaccount', 'role': 'illegalrole'}])
+
+        result = self.app.post('/credentials', body)
+
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.content_type, 'application/x-ndjson')
+        self.assertEqual(self.user, result.headers['X-Username'])
+        lines = dict((line['role'], line) for line in
+                     (simplejson.loads(line) for line in result.text.splitlines()))
+        self.assertEqual(lines['illegalrole'], {
+            'account': 'testaccount', 'role': 'illegalrole',
+            'status': 403, 'message': 'Permission Denied'})
+        self.assertEqual(lines['testrole']['status'], 200)
+        self.assertEqual(lines['testrole']['credentials']['Token'], CREDENTIALS['Token'])
+
+    def test_get_credentials_batch_rejects_invalid_requests(self):
+        self.basicconfig['batch_credentials'] = {'max_pairs': 1}
+        self._create_app()
+        for body in ('no json', '{"account": "testaccount"}', '[{"role": "testrole"}]',
+                     '[{"account": "a", "role": "b"}, {"account": "a", "role": "c"}]',
+                     '[{"account": 123456789012, "role": "b"}]',
+                     '[{"account": "a", "role": ["b", "c"]}]',
+                     '[{"account": "a", "role": null}]'):
+            result = self.app.post('/credentials', body, expect_errors=True)
+            self.assertEqual(result.status_int, 400)
+            self.assertEqual(result.json['status'], 400)
+
+    def test_proxy_is_built_once_per_failing_request(self):
+        with patch("aws_federation_proxy.wsgi_api.wsgi_api.AWSFederationProxy",
+                   wraps=wsgi_api.wsgi_api.AWSFederationProxy) as mock_proxy:
+            result = self.app.get('/account/testaccount/illegalrole/credentials',
+                                  expect_errors=True)
+
+        self.assertEqual(result.status_int, 403)
+        self.assertEqual(mock_proxy.call_count, 1)
+        self.assertEqual(self.user, result.headers['X-Username'])
+
+    def test_unknown_path_reports_user_without_building_proxy(self):
+        with patch("aws_federation_proxy.wsgi_api.wsgi_api.AWSFederationProxy") as mock_proxy:
+            result = self.app.get('/no/such/path', expect_errors=True)
+
+        self.assertEqual(result.status_int, 404)
+        self.assertFalse(mock_proxy.called)
+        self.assertEqual(self.user, result.headers['X-Username'])
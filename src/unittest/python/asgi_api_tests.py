@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, division
+
+import sys
+import threading
+
+import simplejson
+
+from moto import mock_sts
+from mock import patch, Mock
+from unittest2 import TestCase, skipIf
+from api_endpoint_tests import BaseEndpointTest, CREDENTIALS
+from aws_federation_proxy import metrics
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from aws_federation_proxy.asgi_api import get_asgi_app
+    from aws_federation_proxy.asgi_api.async_proxy import AsyncSingleFlight
+
+
+class Response(object):
+    def __init__(self, messages):
+        start = messages[0]
+        self.status_int = start['status']
+        self.headers = dict((name.decode(), value.decode())
+                            for name, value in start['headers'])
+        self.body = b''.join(message['body'] for message in messages[1:])
+
+    @property
+    def json(self):
+        return simplejson.loads(self.body.decode())
+
+
+@skipIf(sys.version_info < (3, 5), "asgi_api needs Python 3.5+")
+class ASGIEndpointTest(BaseEndpointTest):
+    def setUp(self):
+        super(ASGIEndpointTest, self).setUp()
+        self.asgi_app = get_asgi_app(config_path=self.config_path,
+                                     account_config_path=self.account_config_path)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super(ASGIEndpointTest, self).tearDown()
+
+    def _completed(self, result):
+        future = self.loop.create_future()
+        future.set_result(result)
+        return future
+
+    def _call(self, scope, body=b''):
+        """Run the app for scope and return the messages it sent"""
+        messages = []
+
+        def receive():
+            return self._completed({'type': 'http.request', 'body': body})
+
+        def send(message):
+            messages.append(message)
+            return self._completed(None)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+        return messages
+
+    def get(self, path, query_string=b'', method='GET', body=b'', headers=()):
+        return Response(self._call({
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string,
+            'client': ('192.0.2.1', 50000),
+            'headers': [(b'x-remote-user', self.user.encode())] + list(headers),
+        }, body))
+
+    def _create_app(self):
+        self.basicconfig['api']['user_identification']['environment_field'] = \
+            'HTTP_X_REMOTE_USER'
+        super(ASGIEndpointTest, self)._create_app()
+
+    def test_status(self):
+        result = self.get('/status')
+
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.json, {"status": "200", "message": "OK"})
+        self.assertEqual(result.headers['x-username'], 'monitoring')
+
+    def test_metrics(self):
+        metrics.clear()
+        self.get('/account')
+
+        result = self.get('/metrics')
+
+        self.assertEqual(result.headers['content-type'], metrics.CONTENT_TYPE)
+        self.assertIn(b'afp_request_seconds_count{endpoint="/account",outcome="200"} 1',
+                      result.body)
+
+    def test_metrics_do_not_need_a_config(self):
+        self.asgi_app.config_path = None
+        self.assertEqual(self.get('/status').status_int, 500)
+
+        result = self.get('/metrics')
+
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.headers['content-type'], metrics.CONTENT_TYPE)
+
+    def test_get_list_roles_and_accounts(self):
+        result = self.get('/account')
+
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.json, {"testaccount": ["testrole"],
+                                       "testaccount1": ["testrole2"]})
+        self.assertEqual(result.headers['x-username'], self.user)
+        self.assertEqual(result.headers['content-type'],
+                         'application/json; charset=utf-8')
+
+    def test_get_list_roles_and_accounts_withid(self):
+        result = self.get('/account', query_string=b'withid')
+
+        self.assertEqual(result.json, {
+            "testaccount": {"id": "123456789", "roles": ["testrole"]},
+            "testaccount1": {"id": None, "roles": ["testrole2"]}})
+
+    def test_user_from_client_address(self):
+        self.basicconfig['api']['user_identification']['environment_field'] = 'REMOTE_ADDR'
+        self.writeyaml(self.basicconfig, self.config_path + '/basic.yaml')
+
+        result = self.get('/account')
+
+        self.assertEqual(result.headers['x-username'], '192.0.2.1')
+
+    @mock_sts
+    def test_get_credentials(self):
+        result = self.get('/account/testaccount/testrole/credentials')
+
+        self.assertEqual(result.status_int, 200)
+        result_dict = dict(result.json)
+        del result_dict['Expiration']
+        del result_dict['LastUpdated']
+        self.assertEqual(result_dict, CREDENTIALS)
+
+    @mock_sts
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
+    def test_get_console_url(self, mock_get):
+        mock_get.return_value = Mock(text=u'{"SigninToken": "abc"}',
+                                     status_code=200, reason="Ok")
+
+        result = self.get('/account/testaccount/testrole/consoleurl',
+                          query_string=b'callbackurl=https%3A%2F%2Ffoo.invalid')
+
+        self.assertEqual(result.status_int, 200)
+        self.assertIn(b'Issuer=https%3A%2F%2Ffoo.invalid', result.body)
+        self.assertIn(b'SigninToken=abc', result.body)
+
+        result = self.get('/account/testaccount/testrole')
+        self.assertEqual(result.json['ConsoleUrl'].split('SigninToken=')[1], 'abc')
+        self.assertEqual(result.json['AccessKeyId'], CREDENTIALS['AccessKeyId'])
+
+    @mock_sts
+    def test_ims_endpoints(self):
+        self.providerconfig['provider']['class'] = "SingleAccountSingleRoleProvider"
+        self._create_app()
+
+        result = self.get('/meta-data/iam/security-credentials/')
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.body, b"the_only_role")
+
+        result = self.get('/meta-data/iam/security-credentials/the_only_role')
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.json['Token'], CREDENTIALS['Token'])
+
+    @mock_sts
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
+    def test_server_timing_if_asked_for(self, mock_get):
+        mock_get.return_value = Mock(text=u'{"SigninToken": "abc"}',
+                                     status_code=200, reason="Ok")
+
+        result = self.get('/account/testaccount/testrole',
+                          headers=[(b'x-server-timing', b'1')])
+
+        names = [entry.split(';')[0]
+                 for entry in result.headers['server-timing'].split(', ')]
+        self.assertEqual(sorted(names), [
+            'check_user_permissions', 'get_account_and_role_dict',
+            'get_aws_credentials', 'get_console_url',
+            'initialize_federation_proxy', 'total'])
+        self.assertNotIn('server-timing', self.get('/account').headers)
+
+    def test_errors_are_reported_like_wsgi_api(self):
+        result = self.get('/account/testaccount/illegalrole/credentials')
+        self.assertEqual(result.status_int, 403)
+        self.assertEqual(result.json['message'], "Permission Denied")
+        self.assertEqual(result.json['error'], "403 Forbidden")
+        self.assertEqual(result.headers['x-username'], self.user)
+
+        result = self.get('/account/testaccount1/testrole2/credentials')
+        self.assertEqual(result.status_int, 404)
+        self.assertEqual(result.json['message'], "ConfigurationError")
+
+        result = self.get('/no/such/path')
+        self.assertEqual(result.status_int, 404)
+        self.assertEqual(result.headers['x-username'], "Unknown User")
+
+        result = self.get('/account', method='POST')
+        self.assertEqual(result.status_int, 405)
+
+    @mock_sts
+    def test_get_credentials_batch(self):
+        body = simplejson.dumps([
+            {'account': 'testaccount', 'role': 'testrole'},
+            {'account': 'testaccount', 'role': 'illegalrole'}]).encode()
+
+        result = self.get('/credentials', method='POST', body=body)
+
+        self.assertEqual(result.status_int, 200)
+        lines = dict((line['role'], line) for line in
+                     (simplejson.loads(line) for line in result.body.decode().splitlines()))
+        self.assertEqual(lines['illegalrole']['status'], 403)
+        self.assertEqual(lines['testrole']['credentials']['Token'], CREDENTIALS['Token'])
+
+        result = self.get('/credentials', method='POST', body=b'no json')
+        self.assertEqual(result.status_int, 400)
+
+        result = self.get('/credentials')
+        self.assertEqual(result.status_int, 405)
+
+    def test_broken_providerconfig_must_be_reported(self):
+        self.providerconfig['provider']['module'] = 'a-module-that-does-not-exist'
+        self._create_app()
+
+        result = self.get('/account')
+
+        self.assertEqual(result.status_int, 404)
+        # The provider is only set up by the route.
+        self.assertEqual(result.headers['x-username'], self.user)
+
+    def test_head_requests_have_no_body(self):
+        result = self.get('/status', method='HEAD')
+
+        self.assertEqual(result.status_int, 200)
+        self.assertEqual(result.body, b'')
+        self.assertNotEqual(result.headers['content-length'], '0')
+
+    def test_lifespan(self):
+        sent = []
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+        def send(message):
+            sent.append(message['type'])
+            return self._completed(None)
+
+        self.loop.run_until_complete(self.asgi_app(
+            {'type': 'lifespan'}, lambda: self._completed(next(messages)), send))
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_concurrent_requests_share_one_sts_call(self, mock_sts_connection):
+        release = threading.Event()
+        credentials = Mock(access_key='a', secret_key='s', session_token='t',
+                           expiration='2099-01-01T00:00:00Z')
+
+        def assume_role(**kwargs):
+            release.wait(5)
+            return Mock(credentials=credentials)
+        mock_sts_connection.return_value.assume_role.side_effect = assume_role
+        scope = {'type': 'http', 'method': 'GET', 'query_string': b'',
+                 'path': '/account/testaccount/testrole/credentials',
+                 'headers': [(b'x-remote-user', self.user.encode())]}
+        messages = []
+
+        def send(message):
+            messages.append(message)
+            return self._completed(None)
+
+        def receive():
+            return self._completed({'type': 'http.request'})
+
+        requests = [self.loop.create_task(self.asgi_app(scope, receive, send))
+                    for _ in range(10)]
+        self.loop.call_later(0.2, release.set)
+        self.loop.run_until_complete(asyncio.gather(*requests))
+
+        statuses = [m['status'] for m in messages if m['type'] == 'http.response.start']
+        self.assertEqual(statuses, [200] * 10)
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 1)
+
+
+@skipIf(sys.version_info < (3, 5), "asgi_api needs Python 3.5+")
+class AsyncSingleFlightTest(TestCase):
+    def test_cancelled_caller_does_not_cancel_the_call(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        flight = AsyncSingleFlight()
+        future = loop.create_future()
+        first = flight.do('key', lambda: future)
+        second = flight.do('key', lambda: self.fail("started twice"))
+
+        first.cancel()
+        future.set_result(42)
+
+        self.assertEqual(loop.run_until_complete(second), 42)
+        self.assertFalse(future.cancelled())
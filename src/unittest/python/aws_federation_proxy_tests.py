@@ -1,14 +1,25 @@
 from __future__ import print_function, absolute_import, division
 
+import datetime
 import logging
 import json
+import os
+import subprocess
+import sys
+import time
+import threading
 import boto
+import boto.sts.credentials
+import requests
 from unittest2 import TestCase
 from moto import mock_sts
 from mock import patch, Mock
 from six.moves.urllib.parse import quote_plus, unquote_plus
-from aws_federation_proxy import AWSFederationProxy
-from aws_federation_proxy.aws_federation_proxy import log_function_call, PermissionError, AWSError
+from aws_federation_proxy import AWSFederationProxy, metrics
+from aws_federation_proxy.aws_federation_proxy import (
+    PermissionError, AWSError, ConfigurationError, CREDENTIALS_CACHE,
+    PROVIDER_CACHE, STS_CALLS, STS_CONNECTION_POOL, SIGNIN_TIMEOUT, CREDENTIALS_REFRESHER,
+    STSConnection, _close_sts_connection)
 from aws_federation_proxy_mocks import MockAWSFederationProxyForInitTest
 
 
@@ -17,48 +28,6 @@ class CredentialDict(dict):
         return self
 
 
-class LogFunctionCallTest(TestCase):
-    def setUp(self):
-        self.testobject = Mock()
-        self.testobject.logger = Mock()
-        self.testobject.logger.debug = Mock()
-        foobar = Mock()
-        foobar.__name__ = "foobar"
-        self.testobject.foobar = log_function_call(foobar)
-        self.testobject.original_foobar = foobar
-
-    def test_must_pass_parameters(self):
-        self.testobject.foobar(self.testobject, 42, foo=23)
-        self.testobject.original_foobar.assert_called_with(
-            self.testobject,
-            42,
-            foo=23)
-
-    def test_must_pass_exception(self):
-        class MyOwnException(Exception):
-            pass
-        self.testobject.original_foobar.side_effect = MyOwnException
-        self.assertRaises(
-            MyOwnException,
-            self.testobject.foobar,
-            self.testobject)
-
-    def test_must_pass_return_values(self):
-        self.testobject.original_foobar.return_value = 42
-        self.assertEqual(
-            self.testobject.foobar(self.testobject),
-            self.testobject.original_foobar.return_value)
-
-    def test_must_log(self):
-        self.testobject.foobar(self.testobject)
-        self.assertGreaterEqual(self.testobject.logger.debug.call_count, 1)
-
-    def test_must_log_on_Exception(self):
-        self.testobject.original_foobar.side_effect = Exception
-        self.assertRaises(Exception, self.testobject.foobar, self.testobject)
-        self.assertGreaterEqual(self.testobject.logger.debug.call_count, 1)
-
-
 class TestAWSFederationProxyInit(TestCase):
     def test_applies_defaults(self):
         user = "testuser"
@@ -109,9 +78,9 @@ class TestSetupProvider(TestCase):
             }
         }
 
-        self.assertRaisesRegexp(
-            Exception, provider, AWSFederationProxy,
-            user="testuser", config=config, account_config={})
+        proxy = AWSFederationProxy(user="testuser", config=config,
+                                   account_config={})
+        self.assertRaisesRegexp(Exception, provider, getattr, proxy, 'provider')
 
     def test_report_name_if_class_cannot_imported(self):
         provider_class = 'not-existing-class'
@@ -121,14 +90,16 @@ class TestSetupProvider(TestCase):
                 'class': provider_class
             }
         }
-        self.assertRaisesRegexp(
-            Exception, provider_class, AWSFederationProxy,
-            user="testuser", config=config, account_config={})
+        proxy = AWSFederationProxy(user="testuser", config=config,
+                                   account_config={})
+        self.assertRaisesRegexp(Exception, provider_class,
+                                getattr, proxy, 'provider')
 
     def test_report_module_not_configured(self):
         expected_regex = "(No.*defined.*provider)|(provider.*not defined)"
-        self.assertRaisesRegexp(Exception, expected_regex, AWSFederationProxy,
-                                user="testuser", config={}, account_config={})
+        proxy = AWSFederationProxy(user="testuser", config={}, account_config={})
+        self.assertRaisesRegexp(Exception, expected_regex,
+                                getattr, proxy, 'provider')
 
     def test_instantiate_provider_with_proper_parameters(self):
         user = "testuser"
@@ -154,10 +125,38 @@ class TestSetupProvider(TestCase):
                 'class': class_name
             }
         }
+        proxy = AWSFederationProxy(user=user, config=config, account_config={})
         self.assertRaisesRegexp(
-            Exception, "instantiate.*" + class_name,
-            AWSFederationProxy, user=user, config=config, account_config={}
-        )
+            Exception, "instantiate.*" + class_name, getattr, proxy, 'provider')
+
+    @patch("aws_federation_proxy.provider.base_provider.GroupTestProvider")
+    def test_provider_is_set_up_on_first_use(self, mock_provider_class):
+        config = {
+            'provider': {
+                'module': 'aws_federation_proxy.provider.base_provider',
+                'class': 'GroupTestProvider'
+            }
+        }
+        proxy = AWSFederationProxy(user="testuser", config=config,
+                                   account_config={})
+        self.assertFalse(mock_provider_class.called)
+
+        self.assertIs(proxy.provider, proxy.provider)
+        self.assertEqual(mock_provider_class.call_count, 1)
+
+    def test_get_provider_class_reports_broken_config(self):
+        config = {'provider': {'module': 'some-module-that-does-not-exist'}}
+        proxy = AWSFederationProxy(user="testuser", config=config,
+                                   account_config={})
+        self.assertRaisesRegexp(ConfigurationError, "some-module-that",
+                                proxy.get_provider_class)
+
+    def test_import_does_not_load_boto_or_requests(self):
+        code = ("import sys, aws_federation_proxy.wsgi_api; "
+                "print(sorted(set(['boto', 'requests']) & set(sys.modules)))")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env)
+        self.assertEqual(output.decode().strip(), '[]')
 
 
 class TestHandler(logging.Handler):
@@ -181,6 +180,10 @@ class BaseAFPTest(object):
                 'id': '123456789'
             }
         }
+        CREDENTIALS_CACHE.clear()
+        PROVIDER_CACHE.clear()
+        STS_CONNECTION_POOL.clear()
+        CREDENTIALS_REFRESHER.clear()
         proxy_logger = logging.getLogger('proxy_logger')
         self.handler = TestHandler()
         proxy_logger.addHandler(self.handler)
@@ -200,6 +203,81 @@ class BaseAFPTest(object):
             'session_token': self.test_session_token
         })
 
+    def _mock_provider(self):
+        self.proxy.provider = Mock()
+        self.proxy.provider.get_accounts_and_roles.return_value = {
+            'testaccount': set([('testrole', 'reason')])}
+        return self.proxy.provider.get_accounts_and_roles
+
+    @staticmethod
+    def _age_provider_cache_entry(seconds):
+        """Make the only entry in PROVIDER_CACHE older, return its key"""
+        (cache_key, ((fetched_at, result), expires_at)), = PROVIDER_CACHE._entries.items()
+        PROVIDER_CACHE.set(cache_key, (fetched_at - seconds, result),
+                           expires_at=expires_at)
+        return cache_key
+
+    def test_get_account_and_role_dict_is_not_cached_by_default(self):
+        mock_get_accounts_and_roles = self._mock_provider()
+        self.proxy.get_account_and_role_dict()
+        self.proxy.get_account_and_role_dict()
+        self.assertEqual(mock_get_accounts_and_roles.call_count, 2)
+
+    def test_get_account_and_role_dict_is_cached_for_ttl(self):
+        mock_get_accounts_and_roles = self._mock_provider()
+        self.proxy.application_config['provider']['cache'] = {'ttl': 60}
+
+        first = self.proxy.get_account_and_role_dict()
+        second = self.proxy.get_account_and_role_dict()
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get_accounts_and_roles.call_count, 1)
+        self.assertEqual((PROVIDER_CACHE.hits, PROVIDER_CACHE.misses), (1, 1))
+
+    def test_get_account_and_role_dict_is_cached_per_user(self):
+        mock_get_accounts_and_roles = self._mock_provider()
+        self.proxy.application_config['provider']['cache'] = {'ttl': 60}
+
+        self.proxy.get_account_and_role_dict()
+        self.proxy.user = 'someone_else'
+        self.proxy.get_account_and_role_dict()
+
+        self.assertEqual(mock_get_accounts_and_roles.call_count, 2)
+
+    def test_get_account_and_role_dict_serves_stale_entry_while_refreshing(self):
+        mock_get_accounts_and_roles = self._mock_provider()
+        self.proxy.application_config['provider']['cache'] = {
+            'ttl': 60, 'stale_ttl': 600}
+        stale_result = self.proxy.get_account_and_role_dict()
+        cache_key = self._age_provider_cache_entry(120)
+        new_result = {'newaccount': set([('newrole', 'reason')])}
+        mock_get_accounts_and_roles.return_value = new_result
+
+        self.assertEqual(self.proxy.get_account_and_role_dict(), stale_result)
+
+        for _ in range(100):
+            if PROVIDER_CACHE.get(cache_key)[1] == new_result:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.proxy.get_account_and_role_dict(), new_result)
+        self.assertIn('stale', self.handler.logged_messages)
+
+    def test_get_account_and_role_dict_keeps_stale_entry_if_refresh_fails(self):
+        mock_get_accounts_and_roles = self._mock_provider()
+        self.proxy.application_config['provider']['cache'] = {
+            'ttl': 60, 'stale_ttl': 600}
+        stale_result = self.proxy.get_account_and_role_dict()
+        self._age_provider_cache_entry(120)
+        mock_get_accounts_and_roles.side_effect = Exception("directory is down")
+
+        self.proxy.get_account_and_role_dict()
+        for _ in range(100):
+            if 'directory is down' in self.handler.logged_messages:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.proxy.get_account_and_role_dict(), stale_result)
+
     def test_check_user_permissions_ok(self):
         self.proxy.check_user_permissions('testaccount', 'testrole')
         self.assertIn(self.testuser, self.handler.logged_messages)
@@ -261,6 +339,56 @@ class BaseAFPTest(object):
             PermissionError,
             self.proxy.get_aws_credentials, self.account_alias, self.role)
 
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_times_sts_calls(
+            self, mock_check_user_permissions, mock_sts_connection):
+        class FakeHTTPError(Exception):
+            status = 403
+        mock_sts_connection.side_effect = FakeHTTPError
+        self.proxy.endpoint = '/test'
+        metrics.clear()
+
+        self.assertRaises(
+            PermissionError,
+            self.proxy.get_aws_credentials, self.account_alias, self.role)
+
+        self.assertIn('afp_sts_assume_role_seconds_count{endpoint="/test",'
+                      'outcome="PermissionError"} 1', metrics.render())
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_remembers_403_for_denied_ttl(
+            self, mock_check_user_permissions, mock_sts_connection):
+        class FakeHTTPError(Exception):
+            status = 403
+        mock_sts_connection.return_value.assume_role.side_effect = FakeHTTPError
+        self.proxy.application_config['credentials_cache'] = {'denied_ttl': 60}
+
+        self.assertRaises(
+            PermissionError,
+            self.proxy.get_aws_credentials, self.account_alias, self.role)
+        self.assertRaisesRegexp(
+            PermissionError, "cached, STS is asked again after at most 60 seconds",
+            self.proxy.get_aws_credentials, self.account_alias, self.role)
+
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 1)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_does_not_remember_403_by_default(
+            self, mock_check_user_permissions, mock_sts_connection):
+        class FakeHTTPError(Exception):
+            status = 403
+        mock_sts_connection.return_value.assume_role.side_effect = FakeHTTPError
+
+        for _ in range(2):
+            self.assertRaises(
+                PermissionError,
+                self.proxy.get_aws_credentials, self.account_alias, self.role)
+
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 2)
+
     @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
     @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
     def test_get_aws_credentials_handles_sts_errors(
@@ -277,6 +405,234 @@ class BaseAFPTest(object):
         all_log_messages = "".join(cm.output)
         self.assertIn(fake_boto_error.request_id, all_log_messages)
 
+    @staticmethod
+    def _make_sts_credentials(valid_for):
+        credentials = boto.sts.credentials.Credentials()
+        credentials.access_key = "access_key"
+        credentials.secret_key = "secret_key"
+        credentials.session_token = "session_token"
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=valid_for)
+        credentials.expiration = expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return credentials
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_are_cached(
+            self, mock_check_user_permissions, mock_sts_connection):
+        credentials = self._make_sts_credentials(valid_for=3600)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+
+        first = self.proxy.get_aws_credentials(self.account_alias, self.role)
+        second = self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertIs(first, credentials)
+        self.assertIs(second, credentials)
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 1)
+        self.assertEqual(mock_check_user_permissions.call_count, 2)
+        self.assertEqual((CREDENTIALS_CACHE.hits, CREDENTIALS_CACHE.misses), (1, 1))
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_are_cached_before_the_sts_call_is_over(
+            self, mock_check_user_permissions, mock_sts_connection):
+        credentials = self._make_sts_credentials(valid_for=3600)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+        cached_when_over = []
+        original_do = STS_CALLS.do
+
+        def do(key, *args):
+            # A thread missing the cache from now on would call STS again.
+            result = original_do(key, *args)
+            cached_when_over.append(CREDENTIALS_CACHE.get(key))
+            return result
+
+        with patch.object(STS_CALLS, 'do', side_effect=do):
+            self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertEqual(cached_when_over, [credentials])
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_does_not_return_credentials_close_to_expiry(
+            self, mock_check_user_permissions, mock_sts_connection):
+        self.proxy.application_config['credentials_cache'] = {'expiry_margin': 600}
+        credentials = self._make_sts_credentials(valid_for=300)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 2)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_are_not_tracked_for_refresh_by_default(
+            self, mock_check_user_permissions, mock_sts_connection):
+        credentials = self._make_sts_credentials(valid_for=3600)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertEqual(len(CREDENTIALS_REFRESHER), 0)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_are_renewed_ahead_of_expiry(
+            self, mock_check_user_permissions, mock_sts_connection):
+        self.proxy.application_config['credentials_cache'] = {
+            'refresh_ahead': 600, 'expiry_margin': 300}
+        old_credentials = self._make_sts_credentials(valid_for=500)
+        new_credentials = self._make_sts_credentials(valid_for=3600)
+        mock_assume_role = mock_sts_connection.return_value.assume_role
+        mock_assume_role.return_value.credentials = old_credentials
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+        mock_assume_role.return_value.credentials = new_credentials
+
+        CREDENTIALS_REFRESHER.run_due()
+        CREDENTIALS_REFRESHER._queue.join()
+
+        self.assertIs(
+            self.proxy.get_aws_credentials(self.account_alias, self.role),
+            new_credentials)
+        self.assertEqual(mock_assume_role.call_count, 2)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_rejects_invalid_refresh_config(
+            self, mock_check_user_permissions, mock_sts_connection):
+        for cache_config, message in (
+                ({'refresh_ahead': 300}, "larger than expiry_margin"),
+                ({'refresh_ahead': 600, 'expiry_margin': 600}, "larger than expiry_margin"),
+                ({'refresh_ahead': '600'}, "larger than expiry_margin"),
+                ({'refresh_ahead': 600, 'refresh_concurrency': 0}, "positive integer"),
+                ({'refresh_ahead': 600, 'refresh_concurrency': '4'}, "positive integer")):
+            self.proxy.application_config['credentials_cache'] = cache_config
+            self.assertRaisesRegexp(
+                ConfigurationError, message,
+                self.proxy.get_aws_credentials, self.account_alias, self.role)
+        self.assertEqual(mock_sts_connection.call_count, 0)
+
+    def test_get_aws_credentials_reports_invalid_account_config(self):
+        self._mock_provider()
+        self.proxy.account_config = ['testaccount']
+
+        self.assertRaisesRegexp(
+            ConfigurationError, "testaccount",
+            self.proxy.get_aws_credentials, 'testaccount', 'testrole')
+
+    def test_get_aws_credentials_leaves_out_invalid_accounts(self):
+        self._mock_provider()
+        self.account_config['testaccount'] = {'id': 'not-a-number'}
+        self.account_config['otheraccount'] = {'id': '123456789012'}
+
+        self.assertRaisesRegexp(
+            ConfigurationError, "No Configuration for account 'testaccount'",
+            self.proxy.get_aws_credentials, 'testaccount', 'testrole')
+        self.assertIn("'testaccount' has invalid id", self.handler.logged_messages)
+        self.assertEqual(self.proxy.get_account_index().get_id('otheraccount'), '123456789012')
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_get_aws_credentials_checks_permissions_for_cached_credentials(
+            self, mock_sts_connection):
+        credentials = self._make_sts_credentials(valid_for=3600)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+        self.account_config['testaccount'] = {'id': '123456789'}
+
+        self.proxy.get_aws_credentials('testaccount', 'testrole')
+        self.assertRaises(
+            PermissionError,
+            self.proxy.get_aws_credentials, 'testaccount', 'norole')
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_get_aws_credentials_batch_returns_result_per_pair(self, mock_sts_connection):
+        get_accounts_and_roles = self._mock_provider()
+        get_accounts_and_roles.return_value = {
+            'testaccount': set([('testrole', 'reason'), ('otherrole', 'reason')]),
+            'unconfigured': set([('testrole', 'reason')])}
+        self.account_config['testaccount'] = {'id': '123456789'}
+        credentials = self._make_sts_credentials(valid_for=3600)
+        mock_sts_connection.return_value.assume_role.return_value.credentials = credentials
+
+        results = list(self.proxy.get_aws_credentials_batch([
+            ('testaccount', 'testrole'), ('testaccount', 'otherrole'),
+            ('testaccount', 'norole'), ('unconfigured', 'testrole')]))
+
+        results = dict(((account, role), (result, type(error)))
+                       for account, role, result, error in results)
+        self.assertEqual(results, {
+            ('testaccount', 'testrole'): (credentials, type(None)),
+            ('testaccount', 'otherrole'): (credentials, type(None)),
+            ('testaccount', 'norole'): (None, PermissionError),
+            ('unconfigured', 'testrole'): (None, ConfigurationError)})
+        self.assertEqual(get_accounts_and_roles.call_count, 1)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    def test_get_aws_credentials_batch_calls_sts_in_parallel(self, mock_sts_connection):
+        roles = ['role{0}'.format(i) for i in range(6)]
+        self._mock_provider().return_value = {
+            'testaccount': set((role, 'reason') for role in roles)}
+        self.account_config['testaccount'] = {'id': '123456789'}
+        self.proxy.application_config['batch_credentials'] = {'concurrency': 3}
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def assume_role(**kwargs):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return Mock(credentials=self._make_sts_credentials(valid_for=3600))
+        mock_sts_connection.return_value.assume_role.side_effect = assume_role
+
+        results = list(self.proxy.get_aws_credentials_batch(
+            [('testaccount', role) for role in roles]))
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(max_running[0], 3)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_reuses_sts_connection(
+            self, mock_check_user_permissions, mock_sts_connection):
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertEqual(mock_sts_connection.call_count, 1)
+        self.assertEqual(mock_sts_connection.return_value.assume_role.call_count, 2)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.STSConnection")
+    @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
+    def test_get_aws_credentials_replaces_broken_sts_connection(
+            self, mock_check_user_permissions, mock_sts_connection):
+        mock_sts_connection.return_value.assume_role.side_effect = IOError("broken pipe")
+        with patch.object(STS_CONNECTION_POOL, 'close') as mock_close:
+            with self.assertLogs(level='ERROR'):
+                self.assertRaises(
+                    AWSError,
+                    self.proxy.get_aws_credentials, self.account_alias, self.role)
+        mock_sts_connection.return_value.assume_role.side_effect = None
+
+        self.proxy.get_aws_credentials(self.account_alias, self.role)
+
+        self.assertEqual(mock_sts_connection.call_count, 2)
+        mock_close.assert_called_once_with(mock_sts_connection.return_value)
+
+    def test_close_sts_connection_closes_its_http_connections(self):
+        sts_connection = STSConnection(aws_access_key_id='key', aws_secret_access_key='secret')
+        http_connections = [Mock(), Mock()]
+        for http_connection in http_connections:
+            sts_connection._pool.put_http_connection(
+                sts_connection.host, sts_connection.port, True, http_connection)
+
+        _close_sts_connection(sts_connection)
+
+        for http_connection in http_connections:
+            http_connection.close.assert_called_once_with()
+        self.assertEqual(sts_connection._pool.size(), 0)
+
     @mock_sts
     @patch("aws_federation_proxy.AWSFederationProxy.check_user_permissions")
     def test_get_aws_credentials(self, mock_check_user_permissions):
@@ -343,7 +699,7 @@ class BaseAFPTest(object):
             self.proxy._generate_urlencoded_json_credentials, credential_dict
         )
 
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_get_signin_token(self, mock_get):
         token = "abcdefg123"
         mock_get.return_value = Mock(text=u'{"SigninToken": "%s"}' % token,
@@ -352,7 +708,7 @@ class BaseAFPTest(object):
         returned_token = self.proxy._get_signin_token(self.credentials)
         self.assertEqual(token, returned_token)
 
-    @patch("aws_federation_proxy.aws_federation_proxy.requests.get")
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
     def test_get_signin_token_throws_exception_on_error(self, mock_get):
         token = "abcdefg123"
         reason = "Bad request"
@@ -362,6 +718,20 @@ class BaseAFPTest(object):
         self.assertRaisesRegexp(Exception, reason,
                                 self.proxy._get_signin_token, self.credentials)
 
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
+    def test_get_signin_token_uses_timeout(self, mock_get):
+        mock_get.return_value = Mock(text=u'{"SigninToken": "abc"}',
+                                     status_code=200,
+                                     reason="Ok")
+        self.proxy._get_signin_token(self.credentials)
+        self.assertEqual(mock_get.call_args[1]['timeout'], SIGNIN_TIMEOUT)
+
+    @patch("aws_federation_proxy.aws_federation_proxy.SIGNIN_SESSION.get")
+    def test_get_signin_token_raises_aws_error_on_timeout(self, mock_get):
+        mock_get.side_effect = requests.exceptions.ReadTimeout("read timed out")
+        self.assertRaisesRegexp(AWSError, "read timed out",
+                                self.proxy._get_signin_token, self.credentials)
+
     def test_construct_console_url(self):
         token = "abcdefg123"
         callback_url = 'http://callback_url'
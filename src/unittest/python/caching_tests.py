@@ -0,0 +1,165 @@
+from __future__ import print_function, absolute_import, division
+
+import threading
+
+from unittest2 import TestCase
+
+from aws_federation_proxy.caching import ConfigMemo, LRUCache, SingleFlight
+
+
+class LRUCacheTest(TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.cache = LRUCache(max_size=2, clock=lambda: self.now)
+
+    def test_returns_stored_value(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_returns_default_for_missing_key(self):
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+
+    def test_counts_hits_and_misses(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.get('key')
+        self.cache.get('other')
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_evicts_least_recently_used_entry(self):
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+        self.cache.get('first')
+        self.cache.set('third', 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get('first'), 1)
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('third'), 3)
+
+    def test_does_not_return_expired_entries(self):
+        self.cache.set('key', 'value', expires_at=self.now + 10)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+        self.now += 10
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_pop_removes_entry(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.pop('key'), 'value')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_clear_resets_statistics(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+
+class CountingEvent(threading.Event):
+    """An Event that knows how many threads are waiting for it"""
+    def __init__(self):
+        super(CountingEvent, self).__init__()
+        self.waiters = 0
+        self.waiters_changed = threading.Condition()
+
+    def wait(self, timeout=None):
+        with self.waiters_changed:
+            self.waiters += 1
+            self.waiters_changed.notify_all()
+        return super(CountingEvent, self).wait(timeout)
+
+    def wait_for_waiters(self, count):
+        with self.waiters_changed:
+            while self.waiters < count:
+                self.waiters_changed.wait(5)
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow_function(self, result):
+        self.calls.append(result)
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run_concurrently(self, key, result, count):
+        outcomes = []
+
+        def worker():
+            try:
+                outcomes.append(self.single_flight.do(key, self.slow_function, result))
+            except Exception as exc:
+                outcomes.append(exc)
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        threads[0].start()
+        self.started.wait(5)
+        done = self.single_flight._calls[key].done = CountingEvent()
+        for thread in threads[1:]:
+            thread.start()
+        done.wait_for_waiters(count - 1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_returns_result(self):
+        self.release.set()
+        self.assertEqual(self.single_flight.do('key', self.slow_function, 42), 42)
+
+    def test_concurrent_callers_share_one_call(self):
+        outcomes = self.run_concurrently('key', 42, count=5)
+        self.assertEqual(outcomes, [42] * 5)
+        self.assertEqual(self.calls, [42])
+
+    def test_concurrent_callers_share_the_exception(self):
+        error = ValueError("STS is down")
+        outcomes = self.run_concurrently('key', error, count=3)
+        self.assertEqual(outcomes, [error] * 3)
+
+    def test_calls_again_after_previous_call_finished(self):
+        self.release.set()
+        self.single_flight.do('key', self.slow_function, 1)
+        self.single_flight.do('key', self.slow_function, 2)
+        self.assertEqual(self.calls, [1, 2])
+
+
+class ConfigMemoTest(TestCase):
+    def setUp(self):
+        self.computed = []
+
+        def compute(config, suffix=''):
+            self.computed.append(config)
+            return sorted(config) + [suffix]
+        self.memo = ConfigMemo(compute, max_size=2)
+
+    def test_computes_once_per_object(self):
+        config = {'a': 1}
+        value = self.memo.get(config, 'x')
+        self.assertIs(self.memo.get(config, 'y'), value)
+        self.assertEqual(value, ['a', 'x'])
+        self.assertEqual(self.memo.get(dict(config)), ['a', ''])
+        self.assertEqual(len(self.computed), 2)
+
+    def test_drops_all_values_when_full(self):
+        configs = [{'a': 1}, {'b': 2}, {'c': 3}]
+        for config in configs:
+            self.memo.get(config)
+        self.memo.get(configs[0])
+        self.assertEqual(len(self.computed), 4)
+
+    def test_does_not_remember_exceptions(self):
+        self.assertRaises(TypeError, self.memo.get, None)
+        self.assertRaises(TypeError, self.memo.get, None)
+        self.assertEqual(self.computed, [None, None])
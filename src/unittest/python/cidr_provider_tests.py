@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+from unittest2 import TestCase
+from base_provider_tests import BaseProviderTest
+from aws_federation_proxy import PermissionError
+from aws_federation_proxy.provider.provider_by_cidr import (
+    NetworkTable,
+    Provider,
+    get_network_table)
+
+
+class NetworkTableTests(TestCase):
+    def setUp(self):
+        self.table = NetworkTable([
+            ('10.0.0.0/8', 'a'),
+            ('10.1.0.0/16', 'b'),
+            ('10.1.2.0/24', 'c'),
+            ('10.1.2.128/25', 'd'),
+            ('10.2.0.0/16', 'e'),
+            ('192.168.1.1', 'host'),
+            ('2001:db8::/32', 'v6'),
+            ('2001:db8:1::/48', 'v6-nested'),
+        ])
+
+    def test_most_specific_network_wins(self):
+        self.assertEqual(self.table.lookup('10.0.0.1'), ('10.0.0.0/8', 'a'))
+        self.assertEqual(self.table.lookup('10.1.0.0'), ('10.1.0.0/16', 'b'))
+        self.assertEqual(self.table.lookup('10.1.2.3'), ('10.1.2.0/24', 'c'))
+        self.assertEqual(self.table.lookup('10.1.2.200'), ('10.1.2.128/25', 'd'))
+        self.assertEqual(self.table.lookup('10.2.255.255'), ('10.2.0.0/16', 'e'))
+
+    def test_outer_network_continues_after_nested_networks(self):
+        self.assertEqual(self.table.lookup('10.1.3.0'), ('10.1.0.0/16', 'b'))
+        self.assertEqual(self.table.lookup('10.3.0.0'), ('10.0.0.0/8', 'a'))
+        self.assertEqual(self.table.lookup('10.255.255.255'), ('10.0.0.0/8', 'a'))
+
+    def test_addresses_outside_of_all_networks(self):
+        self.assertIsNone(self.table.lookup('9.255.255.255'))
+        self.assertIsNone(self.table.lookup('11.0.0.0'))
+        self.assertIsNone(self.table.lookup('192.168.1.2'))
+        self.assertIsNone(self.table.lookup('2001:db9::'))
+
+    def test_single_host(self):
+        self.assertEqual(self.table.lookup('192.168.1.1'), ('192.168.1.1', 'host'))
+
+    def test_ipv6(self):
+        self.assertEqual(self.table.lookup('2001:db8::1'), ('2001:db8::/32', 'v6'))
+        self.assertEqual(self.table.lookup('2001:db8:1::1'),
+                         ('2001:db8:1::/48', 'v6-nested'))
+        self.assertEqual(self.table.lookup('2001:db8:2::1'), ('2001:db8::/32', 'v6'))
+
+    def test_ipv4_mapped_addresses_match_ipv4_networks(self):
+        self.assertEqual(self.table.lookup('::ffff:10.1.2.3'), ('10.1.2.0/24', 'c'))
+
+    def test_default_route_matches_everything(self):
+        table = NetworkTable([('0.0.0.0/0', 'any'), ('10.0.0.0/8', 'a')])
+
+        self.assertEqual(table.lookup('0.0.0.0'), ('0.0.0.0/0', 'any'))
+        self.assertEqual(table.lookup('255.255.255.255'), ('0.0.0.0/0', 'any'))
+        self.assertEqual(table.lookup('10.0.0.1'), ('10.0.0.0/8', 'a'))
+
+    def test_invalid_addresses_raise_value_error(self):
+        self.assertRaises(ValueError, self.table.lookup, 'tuvfoo42.valid')
+        self.assertRaises(ValueError, self.table.lookup, '10.0.0.256')
+
+    def test_invalid_networks_are_rejected(self):
+        for network in ('10.0.0.0/33', '10.0.0.0/x', '10.0.0.0/-1', 'foo/8',
+                        '2001:db8::/129'):
+            self.assertRaisesRegexp(ValueError, "Invalid network", NetworkTable,
+                                    [(network, 'a')])
+
+    def test_networks_with_host_bits_are_rejected(self):
+        self.assertRaisesRegexp(ValueError, "host bits", NetworkTable,
+                                [('10.0.0.1/8', 'a')])
+
+    def test_duplicate_networks_are_rejected(self):
+        self.assertRaisesRegexp(ValueError, "twice", NetworkTable,
+                                [('10.0.0.0/8', 'a'), ('10.0.0.0/8', 'b')])
+
+
+class CIDRProviderTests(BaseProviderTest):
+    def setUp(self):
+        super(CIDRProviderTests, self).setUp()
+        self.config['networks'] = [
+            {'network': '10.0.0.0/8', 'account': 'prod', 'role': 'machine'},
+            {'network': '10.1.0.0/16', 'account': 'dev', 'role': 'builder'},
+        ]
+        self.mini_config = self.config
+        self.testclass = Provider
+
+    def test_get_accounts_and_roles(self):
+        provider = self.testclass('10.1.2.3', self.config)
+
+        self.assertEqual(provider.get_accounts_and_roles(), {
+            'dev': set([('builder', 'Machine 10.1.2.3 is in network '
+                                    '10.1.0.0/16 which maps to role builder')])})
+
+    def test_unknown_client_raises_permission_error(self):
+        provider = self.testclass('192.168.0.1', self.config)
+
+        self.assertRaises(PermissionError, provider.get_accounts_and_roles)
+
+    def test_invalid_client_raises_permission_error(self):
+        provider = self.testclass('tuvfoo42.valid', self.config)
+
+        self.assertRaises(PermissionError, provider.get_accounts_and_roles)
+
+    def test_table_is_compiled_once_per_config(self):
+        first = self.testclass('10.1.2.3', self.config)
+        second = self.testclass('10.0.0.1', self.config)
+
+        self.assertIs(first.network_table, second.network_table)
+        self.assertIsNot(get_network_table(list(self.config['networks'])),
+                         first.network_table)
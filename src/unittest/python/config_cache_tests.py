@@ -0,0 +1,78 @@
+from __future__ import print_function, absolute_import, division
+
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+from mock import patch
+from unittest2 import TestCase
+
+from aws_federation_proxy.config_cache import CachedYamlConfig, load_config
+
+
+class CachedYamlConfigTest(TestCase):
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp(prefix='afp-config-cache-')
+        self.yaml_file = os.path.join(self.config_path, "config.yaml")
+        self.writeyaml({'foo': 'bar'}, self.yaml_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    @staticmethod
+    def writeyaml(data, yamlfile, age=60):
+        with open(yamlfile, "w") as target:
+            target.write(yaml.dump(data))
+        # Pretend the file was written a while ago, so it is not "racy".
+        mtime = time.time() - age
+        os.utime(yamlfile, (mtime, mtime))
+
+    def test_loads_yaml_data(self):
+        cached_config = CachedYamlConfig(self.config_path)
+        self.assertEqual(cached_config.get(), {'foo': 'bar'})
+
+    @patch("aws_federation_proxy.config_cache.yaml_load")
+    def test_does_not_reload_unchanged_files(self, mock_yaml_load):
+        mock_yaml_load.return_value = {'foo': 'bar'}
+        cached_config = CachedYamlConfig(self.config_path)
+
+        first = cached_config.get()
+        second = cached_config.get()
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_yaml_load.call_count, 1)
+
+    def test_reloads_changed_file(self):
+        cached_config = CachedYamlConfig(self.config_path)
+        cached_config.get()
+
+        self.writeyaml({'foo': 'changed'}, self.yaml_file, age=30)
+
+        self.assertEqual(cached_config.get(), {'foo': 'changed'})
+
+    def test_reloads_on_added_file(self):
+        cached_config = CachedYamlConfig(self.config_path)
+        cached_config.get()
+
+        self.writeyaml({'new': 'file'},
+                       os.path.join(self.config_path, "new.yaml"))
+
+        self.assertEqual(cached_config.get(), {'foo': 'bar', 'new': 'file'})
+
+    @patch("aws_federation_proxy.config_cache.yaml_load")
+    def test_recently_modified_files_are_always_reloaded(self, mock_yaml_load):
+        mock_yaml_load.return_value = {'foo': 'bar'}
+        self.writeyaml({'foo': 'bar'}, self.yaml_file, age=0)
+        cached_config = CachedYamlConfig(self.config_path)
+
+        cached_config.get()
+        cached_config.get()
+
+        self.assertEqual(mock_yaml_load.call_count, 2)
+
+    def test_load_config_shares_cache_per_source(self):
+        first = load_config(self.config_path)
+        second = load_config(self.config_path)
+        self.assertIs(first, second)
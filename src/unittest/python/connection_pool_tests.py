@@ -0,0 +1,129 @@
+from __future__ import print_function, absolute_import, division
+
+from mock import Mock
+from unittest2 import TestCase
+
+from aws_federation_proxy.connection_pool import (
+    ConnectionPool, LazyHTTPSession, new_http_session)
+
+
+class FakeHTTPError(Exception):
+    status = 403
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_idle=2)
+        self.factory = Mock(side_effect=lambda: object())
+
+    def use(self, key='key', error=None):
+        with self.pool.connection(key, self.factory) as connection:
+            if error is not None:
+                raise error
+            return connection
+
+    def test_reuses_idle_connection(self):
+        self.assertIs(self.use(), self.use())
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_keeps_connections_per_key(self):
+        self.assertIsNot(self.use('key1'), self.use('key2'))
+
+    def test_concurrently_used_connections_are_not_shared(self):
+        with self.pool.connection('key', self.factory) as first:
+            with self.pool.connection('key', self.factory) as second:
+                self.assertIsNot(first, second)
+
+    def test_discards_connection_after_error(self):
+        self.assertRaises(IOError, self.use, error=IOError())
+        self.use()
+        self.assertEqual(self.factory.call_count, 2)
+
+    def test_keeps_connection_after_http_error(self):
+        self.assertRaises(FakeHTTPError, self.use, error=FakeHTTPError())
+        self.use()
+        self.assertEqual(self.factory.call_count, 1)
+
+    def test_keeps_at_most_max_idle_connections(self):
+        with self.pool.connection('key', self.factory):
+            with self.pool.connection('key', self.factory):
+                with self.pool.connection('key', self.factory):
+                    pass
+        self.assertEqual(len(self.pool._idle['key']), 2)
+
+    def test_new_connection_is_made_even_if_idle_ones_exist(self):
+        idle = self.use()
+        with self.pool.connection('key', self.factory, new=True) as connection:
+            self.assertIsNot(connection, idle)
+        self.assertEqual(self.factory.call_count, 2)
+
+
+class ConnectionPoolOptionsTest(TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.close = Mock()
+        self.pool = ConnectionPool(max_idle=1, idle_timeout=60, close=self.close,
+                                   is_usable=lambda error: not isinstance(error, IOError),
+                                   clock=lambda: self.now)
+        self.factory = Mock(side_effect=lambda: object())
+
+    def use(self, error=None):
+        with self.pool.connection('key', self.factory) as connection:
+            if error is not None:
+                raise error
+            return connection
+
+    def test_closes_connections_idle_for_too_long(self):
+        first = self.use()
+        self.now += 61
+        second = self.use()
+        self.assertIsNot(first, second)
+        self.close.assert_called_once_with(first)
+
+    def test_closes_connections_exceeding_max_idle(self):
+        with self.pool.connection('key', self.factory) as first:
+            with self.pool.connection('key', self.factory) as second:
+                pass
+        self.close.assert_called_once_with(first)
+        self.assertIs(self.use(), second)
+
+    def test_uses_is_usable_to_decide_about_broken_connections(self):
+        self.assertRaises(ValueError, self.use, error=ValueError())
+        self.assertEqual(self.factory.call_count, 1)
+        self.assertRaises(IOError, self.use, error=IOError())
+        self.assertEqual(self.close.call_count, 1)
+        self.use()
+        self.assertEqual(self.factory.call_count, 2)
+
+    def test_clear_closes_idle_connections(self):
+        connection = self.use()
+        self.pool.clear()
+        self.close.assert_called_once_with(connection)
+
+    def test_clear_with_key_only_closes_idle_connections_of_key(self):
+        connection = self.use()
+        with self.pool.connection('other', self.factory) as other:
+            pass
+        self.pool.clear('key')
+        self.close.assert_called_once_with(connection)
+        self.assertEqual(self.pool._idle, {'other': [(other, self.now)]})
+
+
+class NewHTTPSessionTest(TestCase):
+    def test_uses_given_pool_size(self):
+        session = new_http_session(pool_size=42)
+        self.assertEqual(session.get_adapter('https://example.invalid/')._pool_maxsize, 42)
+
+    def test_does_not_store_cookies(self):
+        session = new_http_session(pool_size=1)
+        self.assertEqual(list(session.cookies.get_policy().allowed_domains()), [])
+
+
+class LazyHTTPSessionTest(TestCase):
+    def test_session_is_made_on_first_use(self):
+        lazy_session = LazyHTTPSession(pool_size=42)
+        self.assertIsNone(lazy_session._session)
+
+        session = lazy_session.session
+        self.assertIs(lazy_session.session, session)
+        self.assertEqual(session.get_adapter('https://example.invalid/')._pool_maxsize, 42)
@@ -4,19 +4,24 @@ import collections
 from mock import patch
 
 from provider_by_groups_tests import ProviderByGroupsTests
-from aws_federation_proxy.provider.grp_provider import Provider
+from aws_federation_proxy.provider.grp_provider import Provider, GROUP_INDEX
+
+fake_struct_group = collections.namedtuple(
+    "struct_group",
+    ["gr_name", "gr_passwd", "gr_gid", "gr_mem"])
+fake_struct_passwd = collections.namedtuple(
+    "struct_passwd",
+    ["pw_name", "pw_passwd", "pw_uid", "pw_gid", "pw_gecos", "pw_dir", "pw_shell"])
 
 
 class GrpProviderTests(ProviderByGroupsTests):
     def setUp(self):
         super(GrpProviderTests, self).setUp()
         self.testclass = Provider
+        GROUP_INDEX.clear()
 
     @patch("aws_federation_proxy.provider.grp_provider.grp.getgrall")
     def check_group_list_with_set_users(self, given_user_name, system_user_name, mock_getgrall):
-        fake_struct_group = collections.namedtuple(
-            "struct_group",
-            ["gr_name", "gr_passwd", "gr_gid", "gr_mem"])
         fake_getgrall_result = fake_struct_group(
             "group_name", "group_password", 42, [system_user_name, "someone_else"])
         mock_getgrall.return_value = [fake_getgrall_result]
@@ -38,3 +43,53 @@ class GrpProviderTests(ProviderByGroupsTests):
 
     def test_get_group_list_must_parse_grp_getgrall_return_value_with_uppercase_system_user(self):
         self.check_group_list_with_set_users("some_user_name", "SOME_USER_NAME")
+
+    @patch("aws_federation_proxy.provider.grp_provider.pwd.getpwnam")
+    @patch("aws_federation_proxy.provider.grp_provider.grp.getgrall")
+    def test_get_group_list_includes_primary_group(self, mock_getgrall, mock_getpwnam):
+        mock_getgrall.return_value = [
+            fake_struct_group("secondary", "x", 42, ["some_user_name"]),
+            fake_struct_group("primary", "x", 23, [])]
+        mock_getpwnam.return_value = fake_struct_passwd(
+            "some_user_name", "x", 1000, 23, "", "/home/some_user_name", "/bin/sh")
+
+        provider = self.testclass("some_user_name", self.config)
+
+        self.assertEqual(provider.get_group_list(), ["primary", "secondary"])
+
+    @patch("aws_federation_proxy.provider.grp_provider.grp.getgrall")
+    def test_get_group_list_does_not_rebuild_index_for_each_call(self, mock_getgrall):
+        mock_getgrall.return_value = [
+            fake_struct_group("group_name", "x", 42, ["some_user_name"])]
+
+        self.testclass("some_user_name", self.config).get_group_list()
+        self.testclass("someone_else", self.config).get_group_list()
+
+        self.assertEqual(mock_getgrall.call_count, 1)
+
+    @patch("aws_federation_proxy.provider.grp_provider._get_group_file_state")
+    @patch("aws_federation_proxy.provider.grp_provider.grp.getgrall")
+    def test_get_group_list_rebuilds_index_if_group_file_changed(
+            self, mock_getgrall, mock_get_group_file_state):
+        mock_get_group_file_state.return_value = (1, 1000.0, 100)
+        mock_getgrall.return_value = [
+            fake_struct_group("old_group", "x", 42, ["some_user_name"])]
+        provider = self.testclass("some_user_name", self.config)
+        provider.get_group_list()
+
+        mock_get_group_file_state.return_value = (1, 1001.0, 100)
+        mock_getgrall.return_value = [
+            fake_struct_group("new_group", "x", 42, ["some_user_name"])]
+
+        self.assertEqual(provider.get_group_list(), ["new_group"])
+
+    @patch("aws_federation_proxy.provider.grp_provider.grp.getgrall")
+    def test_get_group_list_rebuilds_index_after_ttl(self, mock_getgrall):
+        self.config['group_index_ttl'] = 0
+        mock_getgrall.return_value = []
+        provider = self.testclass("some_user_name", self.config)
+
+        provider.get_group_list()
+        provider.get_group_list()
+
+        self.assertEqual(mock_getgrall.call_count, 2)
@@ -0,0 +1,194 @@
+from __future__ import print_function, absolute_import, unicode_literals, division
+
+import importlib
+import sys
+import types
+
+from mock import Mock, patch
+from unittest2 import TestCase
+
+
+class LDAPError(Exception):
+    pass
+
+
+class SERVER_DOWN(LDAPError):
+    pass
+
+
+class TIMEOUT(LDAPError):
+    pass
+
+
+class CONNECT_ERROR(LDAPError):
+    pass
+
+
+# python-ldap is no build dependency, so ldap_provider is tested with this
+# stand-in for it.
+fake_ldap = types.ModuleType(str('ldap'))
+fake_ldap.LDAPError = LDAPError
+fake_ldap.SERVER_DOWN = SERVER_DOWN
+fake_ldap.TIMEOUT = TIMEOUT
+fake_ldap.CONNECT_ERROR = CONNECT_ERROR
+fake_ldap.SCOPE_SUBTREE = 2
+fake_ldap.initialize = None
+
+with patch.dict(sys.modules, {'ldap': fake_ldap}):
+    ldap_provider = importlib.import_module('aws_federation_proxy.provider.ldap_provider')
+
+USER_DN = 'CN=Some User,OU=users,DC=example,DC=com'
+REFERENCE = (None, ['ldap://DomainDnsZones.example.com/DC=DomainDnsZones,DC=example,DC=com'])
+
+
+class LdapProviderTests(TestCase):
+    def setUp(self):
+        self.config = {
+            'regex': '(?P<account>.*)-(?P<role>.*)',
+            'ldap_uri': 'ldap://ldap.example.com',
+            'ldap_bind_dn': 'CN=bind,DC=example,DC=com',
+            'ldap_bind_password': 'secret',
+            'ldap_base_users': 'OU=users,DC=example,DC=com',
+            'ldap_base_groups': 'OU=groups,DC=example,DC=com',
+        }
+        self.pool_key = (self.config['ldap_uri'], self.config['ldap_bind_dn'],
+                         self.config['ldap_bind_password'])
+        ldap_provider.LDAP_CONNECTION_POOL.clear()
+        ldap_provider.USER_DN_CACHE.clear()
+        ldap_provider.GROUP_CACHE.clear()
+        self.user_result = [(USER_DN, {})]
+        self.group_result = [('CN=account-role,' + self.config['ldap_base_groups'],
+                              {'name': ['account-role']}),
+                             REFERENCE]
+        # The DN whose groups are self.group_result
+        self.member_dn = USER_DN
+        self.searches = []
+        patcher = patch.object(ldap_provider.ldap, 'initialize',
+                               side_effect=lambda uri: self.new_connection())
+        self.initialize = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search_s(self, base, scope, search_filter, attributes):
+        self.searches.append((base, search_filter))
+        if base == self.config['ldap_base_users']:
+            return self.user_result
+        if self.member_dn not in search_filter:
+            return []
+        return self.group_result
+
+    def new_connection(self, error=None):
+        connection = Mock()
+        if error is None:
+            connection.search_s.side_effect = self.search_s
+        else:
+            connection.search_s.side_effect = error
+        return connection
+
+    def get_group_list(self):
+        return ldap_provider.Provider('someuser', self.config).get_group_list()
+
+    def test_reuses_pooled_connection(self):
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertEqual(self.initialize.call_count, 1)
+
+    def test_reconnects_if_pooled_connections_are_down(self):
+        dead_connections = [self.new_connection(SERVER_DOWN()) for _ in range(2)]
+        for connection in dead_connections:
+            ldap_provider.LDAP_CONNECTION_POOL._put(self.pool_key, connection)
+
+        self.assertEqual(self.get_group_list(), ['account-role'])
+
+        self.assertEqual(self.initialize.call_count, 1)
+        for connection in dead_connections:
+            connection.unbind_s.assert_called_once_with()
+        # The new connection is pooled in place of the dead ones.
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertEqual(self.initialize.call_count, 1)
+
+    def test_raises_other_ldap_errors_without_reconnecting(self):
+        self.initialize.side_effect = lambda uri: self.new_connection(LDAPError('no such object'))
+        logger = Mock()
+        provider = ldap_provider.Provider('someuser', self.config, logger=logger)
+
+        self.assertRaisesRegexp(LDAPError, 'no such object', provider.get_group_list)
+
+        self.assertEqual(self.initialize.call_count, 1)
+        self.assertEqual(logger.exception.call_count, 1)
+
+    def test_caches_user_dn(self):
+        self.config['ldap_group_cache_ttl'] = 0
+        self.get_group_list()
+        self.searches = []
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertEqual([base for base, _ in self.searches],
+                         [self.config['ldap_base_groups']])
+        self.assertIn(USER_DN, self.searches[0][1])
+
+    def test_looks_up_user_dn_cache_once_per_request(self):
+        self.get_group_list()
+        self.assertEqual(ldap_provider.USER_DN_CACHE.misses, 1)
+
+    def test_does_not_cache_user_dn_if_ttl_is_zero(self):
+        self.config['ldap_dn_cache_ttl'] = 0
+        self.get_group_list()
+        self.assertEqual(len(ldap_provider.USER_DN_CACHE), 0)
+
+    def test_caches_unknown_users(self):
+        self.user_result = []
+        self.assertEqual(self.get_group_list(), [])
+        self.assertEqual(self.get_group_list(), [])
+        self.assertEqual(len(self.searches), 1)
+
+    def test_search_references_are_no_user_dn(self):
+        self.user_result = [REFERENCE]
+        self.assertEqual(self.get_group_list(), [])
+        self.assertEqual(self.get_group_list(), [])
+        self.assertEqual([base for base, _ in self.searches],
+                         [self.config['ldap_base_users']])
+
+    def test_uses_user_dn_after_search_references(self):
+        self.user_result = [REFERENCE, (USER_DN, {})]
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertIn(USER_DN, self.searches[-1][1])
+
+    def test_does_not_cache_groups_if_ttl_is_zero(self):
+        self.config['ldap_group_cache_ttl'] = 0
+        self.get_group_list()
+        self.get_group_list()
+        self.assertEqual([base for base, _ in self.searches].count(
+            self.config['ldap_base_groups']), 2)
+
+    def test_caches_groups_by_default(self):
+        self.get_group_list()
+        self.searches = []
+        self.assertEqual(self.get_group_list(), ['account-role'])
+        self.assertEqual(self.searches, [])
+
+    def test_searches_user_dn_again_if_cached_dn_has_no_groups(self):
+        self.config['ldap_group_cache_ttl'] = 0
+        self.get_group_list()
+        moved_dn = 'CN=Some User,OU=moved,OU=users,DC=example,DC=com'
+        self.user_result = [(moved_dn, {})]
+        self.member_dn = moved_dn
+        self.searches = []
+
+        self.assertEqual(self.get_group_list(), ['account-role'])
+
+        self.assertEqual([base for base, _ in self.searches], [
+            self.config['ldap_base_groups'], self.config['ldap_base_users'],
+            self.config['ldap_base_groups']])
+        self.assertIn(moved_dn, self.searches[-1][1])
+        self.assertEqual(ldap_provider.USER_DN_CACHE.get(
+            (self.config['ldap_uri'], self.config['ldap_base_users'], 'someuser')), moved_dn)
+
+    def test_keeps_no_groups_if_user_dn_is_unchanged(self):
+        self.config['ldap_group_cache_ttl'] = 0
+        self.group_result = []
+        self.assertEqual(self.get_group_list(), [])
+        self.searches = []
+
+        self.assertEqual(self.get_group_list(), [])
+
+        self.assertEqual([base for base, _ in self.searches], [
+            self.config['ldap_base_groups'], self.config['ldap_base_users']])
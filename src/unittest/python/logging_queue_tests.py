@@ -0,0 +1,104 @@
+from __future__ import print_function, absolute_import, division
+
+import logging
+import threading
+
+from unittest2 import TestCase
+
+from aws_federation_proxy.logging_queue import QueueHandler
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.threads = set()
+        self.release = threading.Event()
+        self.release.set()
+        self.closed = False
+
+    def emit(self, record):
+        self.release.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.messages.append(self.format(record))
+
+    def close(self):
+        self.closed = True
+        logging.Handler.close(self)
+
+
+class QueueHandlerTest(TestCase):
+    def setUp(self):
+        self.target = RecordingHandler()
+        self.handler = QueueHandler(self.target, max_size=2)
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger('logging_queue_test')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_target_is_called_in_listener_thread(self):
+        self.logger.info("hello %s", "world")
+        self.handler.flush()
+
+        self.assertEqual(self.target.messages, ["hello world"])
+        self.assertEqual(self.target.threads, set(['afp-logging-queue']))
+
+    def test_message_is_rendered_when_logged(self):
+        args = ['before']
+        self.target.release.clear()
+        self.logger.info("%s", args)
+        args[0] = 'after'
+        self.target.release.set()
+        self.handler.flush()
+
+        self.assertEqual(self.target.messages, ["['before']"])
+
+    def test_traceback_is_kept(self):
+        try:
+            raise KeyError('key')
+        except KeyError:
+            self.logger.exception("failed")
+        self.handler.flush()
+
+        self.assertIn("KeyError: 'key'", self.target.messages[0])
+
+    def test_drops_and_counts_records_if_full(self):
+        self.target.release.clear()
+        self.logger.info("blocks the listener")
+        # Wait until the listener took it out of the queue.
+        while not self.handler.queue.empty():
+            pass
+        for i in range(5):
+            self.logger.info("record %d", i)
+        self.assertEqual(self.handler.dropped, 3)
+
+        self.target.release.set()
+        self.handler.flush()
+
+        self.assertEqual(self.target.messages[:3],
+                         ["blocks the listener", "record 0", "record 1"])
+        self.assertIn("dropped 3 log records", self.target.messages[3])
+
+    def test_close_handles_queued_records_and_closes_target(self):
+        self.logger.info("first")
+        self.logger.info("second")
+        self.handler.close()
+
+        self.assertEqual(self.target.messages, ["first", "second"])
+        self.assertTrue(self.target.closed)
+        self.assertFalse(self.handler._listener.is_alive())
+
+    def test_emit_does_not_block_if_target_stalls(self):
+        self.target.release.clear()
+        done = threading.Event()
+
+        def log():
+            for _ in range(10):
+                self.logger.info("message")
+            done.set()
+        threading.Thread(target=log).start()
+
+        self.assertTrue(done.wait(1))
+        self.target.release.set()
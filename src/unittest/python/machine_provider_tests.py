@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, absolute_import, unicode_literals, division
 
+import threading
+
 from mock import patch
 from base_provider_tests import BaseProviderTest
 from aws_federation_proxy import PermissionError
-from aws_federation_proxy.provider.provider_by_ip import Provider
+from aws_federation_proxy.provider.provider_by_ip import Provider, REVERSE_DNS_CACHE
 
 ACCOUNT_NAME = "testaccount"
 
@@ -14,7 +16,9 @@ class MachineProviderTests(BaseProviderTest):
     def setUp(self):
         super(MachineProviderTests, self).setUp()
         self.config['account_name'] = ACCOUNT_NAME
+        self.config['allowed_domains'] = ["valid"]
         self.testclass = Provider
+        REVERSE_DNS_CACHE.clear()
 
     def test_normalize_loctyp_return_given_loctyp_because_loctyp_is_not_ham_ber_dev_or_tuv(self):
         provider = self.testclass("awsxyz", self.config)
@@ -72,3 +76,81 @@ class MachineProviderTests(BaseProviderTest):
         self.config['allowed_domains'] = ["something.else", "valid"]
         provider = self.testclass("tuvfoo42.valid", self.config)
         self.assertRaises(PermissionError, provider.get_accounts_and_roles)
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_lookups_are_cached(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.return_value = ["tuvfoo42.valid"]
+
+        self.testclass("10.0.0.1", self.config).get_accounts_and_roles()
+        self.testclass("10.0.0.1", self.config).get_accounts_and_roles()
+
+        self.assertEqual(mock_gethostbyaddr.call_count, 1)
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_failed_lookups_are_cached(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.side_effect = Exception("Unknown host")
+        provider = self.testclass("10.0.0.1", self.config)
+
+        self.assertRaisesRegexp(Exception, "10.0.0.1.*Unknown host", provider.get_accounts_and_roles)
+        self.assertRaisesRegexp(Exception, "10.0.0.1.*Unknown host", provider.get_accounts_and_roles)
+
+        self.assertEqual(mock_gethostbyaddr.call_count, 1)
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_slow_lookups_time_out(self, mock_gethostbyaddr):
+        release = threading.Event()
+        mock_gethostbyaddr.side_effect = lambda address: release.wait(5) and ["tuvfoo42.valid"]
+        self.config['dns_timeout'] = 0.01
+        provider = self.testclass("10.0.0.1", self.config)
+
+        self.assertRaisesRegexp(Exception, "timed out", provider.get_accounts_and_roles)
+
+        release.set()
+        for _ in range(100):
+            if REVERSE_DNS_CACHE.cache.get("10.0.0.1") is not None:
+                break
+            release.wait(0.01)
+        self.assertIn(ACCOUNT_NAME, provider.get_accounts_and_roles())
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_expiring_lookups_are_renewed_in_the_background(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.return_value = ["tuvfoo42.valid"]
+        self.config['dns_cache_ttl'] = 60
+        self.config['dns_refresh_ahead'] = 120
+        provider = self.testclass("10.0.0.1", self.config)
+
+        provider.get_accounts_and_roles()
+        provider.get_accounts_and_roles()
+
+        for _ in range(100):
+            if mock_gethostbyaddr.call_count >= 2:
+                break
+            threading.Event().wait(0.01)
+        self.assertGreaterEqual(mock_gethostbyaddr.call_count, 2)
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_limits_lookups_in_progress(self, mock_gethostbyaddr):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        mock_gethostbyaddr.side_effect = lambda address: release.wait(5) and ["tuvfoo42.valid"]
+        self.config['dns_timeout'] = 0.01
+        self.config['dns_max_lookups'] = 1
+
+        self.assertRaisesRegexp(Exception, "timed out",
+                                self.testclass("10.0.0.1", self.config).get_accounts_and_roles)
+        self.assertRaisesRegexp(Exception, "10.0.0.2.* not started",
+                                self.testclass("10.0.0.2", self.config).get_accounts_and_roles)
+        self.assertEqual(mock_gethostbyaddr.call_count, 1)
+
+    @patch("aws_federation_proxy.provider.provider_by_ip.gethostbyaddr")
+    def test_uses_cached_name_if_renewal_cannot_start(self, mock_gethostbyaddr):
+        mock_gethostbyaddr.return_value = ["tuvfoo42.valid"]
+        self.config['dns_cache_ttl'] = 60
+        self.config['dns_refresh_ahead'] = 0
+        provider = self.testclass("10.0.0.1", self.config)
+        provider.get_accounts_and_roles()
+
+        self.config['dns_refresh_ahead'] = 120
+        self.config['dns_max_lookups'] = 0
+        self.assertIn(ACCOUNT_NAME, provider.get_accounts_and_roles())
+        self.assertEqual(mock_gethostbyaddr.call_count, 1)
@@ -0,0 +1,58 @@
+from __future__ import print_function, absolute_import, division
+
+from unittest2 import TestCase
+
+from aws_federation_proxy.metrics import Histogram, OK
+
+
+class HistogramTest(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.histogram = Histogram('test_seconds', 'Test.', buckets=(0.1, 1.0),
+                                   clock=lambda: self.now)
+
+    def test_renders_cumulative_buckets(self):
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            self.histogram.observe(seconds, '/account', OK)
+
+        self.assertEqual(self.histogram.render().splitlines(), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{endpoint="/account",outcome="ok",le="0.1"} 2',
+            'test_seconds_bucket{endpoint="/account",outcome="ok",le="1.0"} 3',
+            'test_seconds_bucket{endpoint="/account",outcome="ok",le="+Inf"} 4',
+            'test_seconds_sum{endpoint="/account",outcome="ok"} 2.65',
+            'test_seconds_count{endpoint="/account",outcome="ok"} 4'])
+
+    def test_keeps_series_per_endpoint_and_outcome(self):
+        self.histogram.observe(0.5, '/a', OK)
+        self.histogram.observe(0.5, '/a', '403')
+        self.histogram.observe(0.5, '/b', OK)
+
+        counts = [line for line in self.histogram.render().splitlines()
+                  if line.startswith('test_seconds_count')]
+        self.assertEqual(counts, [
+            'test_seconds_count{endpoint="/a",outcome="403"} 1',
+            'test_seconds_count{endpoint="/a",outcome="ok"} 1',
+            'test_seconds_count{endpoint="/b",outcome="ok"} 1'])
+
+    def test_time_observes_outcome(self):
+        with self.histogram.time('/a'):
+            self.now += 0.5
+        with self.assertRaises(KeyError):
+            with self.histogram.time('/a'):
+                self.now += 2
+                raise KeyError()
+
+        rendered = self.histogram.render()
+        self.assertIn('test_seconds_sum{endpoint="/a",outcome="ok"} 0.5', rendered)
+        self.assertIn('test_seconds_sum{endpoint="/a",outcome="KeyError"} 2.0', rendered)
+
+    def test_escapes_label_values(self):
+        self.histogram.observe(0.5, '/"a"\\', OK)
+        self.assertIn('endpoint="/\\"a\\"\\\\"', self.histogram.render())
+
+    def test_clear(self):
+        self.histogram.observe(0.5, '/a', OK)
+        self.histogram.clear()
+        self.assertNotIn('_count', self.histogram.render())
@@ -1,9 +1,12 @@
 from __future__ import print_function, absolute_import, unicode_literals, division
 
+import re
+
 from base_provider_tests import BaseProviderTest
-from mock import Mock
+from mock import Mock, patch
+from unittest2 import TestCase
 
-from aws_federation_proxy.provider.base_provider import ProviderByGroups
+from aws_federation_proxy.provider.base_provider import GroupMatcher, ProviderByGroups
 
 
 class ProviderByGroupsTests(BaseProviderTest):
@@ -86,3 +89,104 @@ class ProviderByGroupsTests(BaseProviderTest):
 
         returned_accounts = provider.get_accounts_and_roles()
         self.assertEqual(returned_accounts, expected_accounts)
+
+    def _get_accounts_and_roles(self, groups):
+        provider = self.testclass('testuser', self.config)
+        provider.get_group_list = Mock(return_value=groups)
+        return provider.get_accounts_and_roles()
+
+    def test_rules_with_templates(self):
+        del self.config['regex']
+        rule_regex = 'prod_(?P<name>.*)_admins'
+        self.config['rules'] = [
+            {'regex': rule_regex, 'account': 'prod-{name}', 'role': 'administrator'}]
+        expected_reason = 'user is in group "%s" which matches regexp "^%s$"' % (
+            "prod_shop_admins", rule_regex)
+
+        returned_accounts = self._get_accounts_and_roles(["prod_shop_admins", "foobar"])
+
+        self.assertEqual(returned_accounts, {
+            'prod-shop': set([('administrator', expected_reason)])})
+
+    def test_rules_are_used_in_addition_to_regex(self):
+        self.config['rules'] = [{'regex': 'dev_(?P<account>[^_]*)_(?P<role>.*)'}]
+
+        returned_accounts = self._get_accounts_and_roles(["account-role", "dev_devaccount_devrole"])
+
+        self.assertEqual(sorted(returned_accounts), ['account', 'devaccount'])
+        self.assertEqual([role for role, _ in returned_accounts['devaccount']], ['devrole'])
+
+    def test_first_matching_rule_wins(self):
+        self.config['rules'] = [{'regex': '(?P<account>.*)_(?P<role>.*)'}]
+
+        returned_accounts = self._get_accounts_and_roles(["first_second-third"])
+
+        self.assertEqual(list(returned_accounts), ['first_second'])
+
+    def test_missing_regex_and_rules_must_be_reported(self):
+        del self.config['regex']
+        self.assertRaisesRegexp(Exception, 'regex.*rules', self.testclass, 'testuser', self.config)
+
+    def test_group_matcher_is_compiled_once(self):
+        first = self.testclass('testuser', self.config)
+        second = self.testclass('otheruser', self.config)
+        self.assertIs(first.group_matcher, second.group_matcher)
+
+    def test_grants_are_shared_between_users(self):
+        first = self.testclass('testuser', self.config)
+        second = self.testclass('otheruser', self.config)
+        first.get_group_list = second.get_group_list = Mock(return_value=["account-role", "foobar"])
+        first.get_accounts_and_roles()
+
+        with patch.object(first.group_matcher, 'match') as mock_match:
+            returned_accounts = second.get_accounts_and_roles()
+
+        self.assertEqual(mock_match.call_count, 0)
+        self.assertEqual(returned_accounts, {
+            'account': set([('role', self.reason_template % "account-role")])})
+
+    def test_grant_memo_is_bounded(self):
+        self.config['group_memo_size'] = 2
+        provider = self.testclass('testuser', self.config)
+        provider.group_matcher._grants.clear()
+        provider.get_group_list = Mock(return_value=["a-1", "b-2", "c-3"])
+
+        provider.get_accounts_and_roles()
+
+        self.assertLessEqual(len(provider.group_matcher._grants), 2)
+
+
+class GroupMatcherTest(TestCase):
+    def assertMatchesLikeSearch(self, regex, groups, preceding_rules=()):
+        """GroupMatcher must find the same groups as re.search() did"""
+        rules = [(rule, 'other', 'other') for rule in preceding_rules]
+        matcher = GroupMatcher(rules + [(regex, '{account}', '{role}')])
+        anchored = GroupMatcher([(regex, '', '')]).rules[0][0]
+        for group in groups:
+            match = re.search(anchored, group)
+            expected = None if match is None else (
+                '{0}'.format(match.group('account')), '{0}'.format(match.group('role')), anchored)
+            self.assertEqual(matcher.match(group), expected, group)
+
+    def test_top_level_alternatives_keep_search_semantics(self):
+        self.assertMatchesLikeSearch(
+            '(?P<account>[a-z]+)-(?P<role>[a-z]+)|x_(?P<ignored>[a-z]+)',
+            ['acc-role', 'acc-role-more', 'team_x_abc', 'x_abc', 'nothing'],
+            preceding_rules=['prod_(?P<name>.*)'])
+
+    def test_numbered_backreferences_keep_their_meaning(self):
+        self.assertMatchesLikeSearch(
+            '(?P<account>[a-z]+)-(?P<role>[a-z])(\\w)\\3',
+            ['acc-rxx', 'acc-rxy', 'acc-accxx'],
+            preceding_rules=['prod_(?P<name>.*)', '(?P<a>dev)_(?P<b>.*)'])
+
+    def test_first_matching_rule_wins_across_separately_searched_rules(self):
+        matcher = GroupMatcher([
+            ('first-(?P<role>.*)', 'first', '{role}'),
+            ('(?P<role>.*)-x|never', 'second', '{role}'),
+            ('(?P<role>.*)-.*', 'third', '{role}')])
+
+        self.assertEqual(matcher.match('first-x')[:2], ('first', 'x'))
+        self.assertEqual(matcher.match('a-x')[:2], ('second', 'a'))
+        self.assertEqual(matcher.match('a-y')[:2], ('third', 'a'))
+        self.assertEqual(matcher.match('nothing'), None)
@@ -0,0 +1,90 @@
+from __future__ import print_function, absolute_import, division
+
+import threading
+
+from mock import Mock
+from unittest2 import TestCase
+
+from aws_federation_proxy.refresher import Refresher
+
+
+class RefresherTest(TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.refresher = Refresher(max_entries=2, concurrency=2, idle_time=600,
+                                   check_interval=3600, clock=lambda: self.now)
+
+    def run_due(self):
+        self.refresher.run_due()
+        self.refresher._queue.join()
+
+    def test_renews_due_entries(self):
+        renew = Mock(return_value=self.now + 3600)
+        self.refresher.track('key', renew, due_at=self.now + 10)
+
+        self.run_due()
+        self.assertEqual(renew.call_count, 0)
+
+        self.now += 10
+        self.run_due()
+        self.assertEqual(renew.call_count, 1)
+        self.assertEqual(self.refresher._entries['key'][1], self.now - 10 + 3600)
+
+        self.run_due()
+        self.assertEqual(renew.call_count, 1)
+
+    def test_drops_idle_entries(self):
+        renew = Mock(return_value=self.now + 3600)
+        self.refresher.track('key', renew, due_at=self.now + 700)
+
+        self.now += 700
+        self.run_due()
+
+        self.assertEqual(renew.call_count, 0)
+        self.assertEqual(len(self.refresher), 0)
+
+    def test_keeps_most_recently_used_entries(self):
+        for key in ('first', 'second', 'first', 'third'):
+            self.refresher.track(key, Mock(), due_at=self.now + 10)
+        self.assertEqual(list(self.refresher._entries), ['first', 'third'])
+
+    def test_drops_entry_if_renew_fails(self):
+        renew = Mock(side_effect=Exception("STS is down"))
+        self.refresher.track('key', renew, due_at=self.now)
+
+        with self.assertLogs(level='ERROR'):
+            self.run_due()
+
+        self.assertEqual(len(self.refresher), 0)
+
+    def test_drops_entry_if_renew_returns_none(self):
+        self.refresher.track('key', Mock(return_value=None), due_at=self.now)
+        self.run_due()
+        self.assertEqual(len(self.refresher), 0)
+
+    def test_applies_changed_concurrency(self):
+        self.refresher.max_entries = 3
+        running = []
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def renew():
+            running.append(True)
+            release.wait(5)
+        self.refresher.track('a', renew, due_at=self.now)
+        self.refresher.concurrency = 3
+        self.refresher.track('b', renew, due_at=self.now)
+        self.refresher.track('c', renew, due_at=self.now)
+        self.refresher.run_due()
+        for _ in range(500):
+            if len(running) == 3:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(len(running), 3)
+        release.set()
+        self.refresher._queue.join()
+
+        self.refresher.concurrency = 1
+        # Returns once two workers took their stop marker.
+        self.refresher._queue.join()
+        self.assertEqual(self.refresher._workers, 1)
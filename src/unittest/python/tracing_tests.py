@@ -0,0 +1,128 @@
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from unittest2 import TestCase
+
+from aws_federation_proxy.tracing import NO_SPAN, Trace, finish_trace, traced
+
+
+class TraceTest(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.trace = Trace(clock=lambda: self.now)
+
+    def record(self, name, seconds):
+        with self.trace.span(name):
+            self.now += seconds
+
+    def test_records_spans(self):
+        self.record('first', 0.25)
+        with self.assertRaises(KeyError):
+            with self.trace.span('second'):
+                self.now += 0.5
+                raise KeyError()
+
+        self.assertEqual(self.trace.spans, [('first', 1000.0, 1000.25, None),
+                                            ('second', 1000.25, 1000.75, 'KeyError')])
+
+    def test_stops_recording_if_neither_sampled_nor_asked_for(self):
+        self.record('first', 0.25)
+        self.trace.decide({'sample_rate': 0.5}, None, random_number=lambda: 0.7)
+
+        self.assertFalse(self.trace.recording)
+        self.assertEqual(self.trace.spans, [])
+        self.assertIs(self.trace.span('second'), NO_SPAN)
+
+    def test_keeps_recording_if_sampled(self):
+        self.record('first', 0.25)
+        self.trace.decide({'sample_rate': 0.5}, None, random_number=lambda: 0.3)
+
+        self.assertTrue(self.trace.sampled)
+        self.assertFalse(self.trace.server_timing)
+        self.assertEqual(len(self.trace.spans), 1)
+
+    def test_keeps_recording_for_server_timing(self):
+        self.trace.decide({}, '1')
+
+        self.assertFalse(self.trace.sampled)
+        self.assertTrue(self.trace.recording)
+
+    def test_server_timing(self):
+        self.record('first', 0.25)
+        self.now += 0.125
+        self.assertEqual(self.trace.get_server_timing(),
+                         'first;dur=250.0, total;dur=375.0')
+
+    def test_to_dict(self):
+        self.now += 0.125
+        self.record('first', 0.25)
+
+        self.assertEqual(self.trace.to_dict(user='someone'), {
+            'user': 'someone',
+            'start': 1000.0,
+            'duration_ms': 375.0,
+            'spans': [{'name': 'first', 'offset_ms': 125.0,
+                       'duration_ms': 250.0, 'error': None}]})
+
+
+class TracedTest(TestCase):
+    class Traced(object):
+        trace = None
+
+        @traced
+        def method(self, value):
+            return value
+
+    def test_records_span_named_like_method(self):
+        instance = self.Traced()
+        instance.trace = Trace()
+
+        self.assertEqual(instance.method(42), 42)
+        self.assertEqual([span[0] for span in instance.trace.spans], ['method'])
+
+    def test_without_trace(self):
+        self.assertEqual(self.Traced().method(42), 42)
+
+
+class FinishTraceTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='afp-traces-')
+        self.filename = os.path.join(self.directory, 'traces.jsonl')
+        self.logger = Mock()
+        self.trace = Trace()
+        with self.trace.span('first'):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_writes_sampled_traces_as_json_lines(self):
+        config = {'sample_rate': 1, 'file': self.filename}
+        for _ in range(2):
+            self.trace.decide(config, None)
+            self.assertIsNone(finish_trace(self.trace, config, self.logger, user='someone'))
+
+        with open(self.filename) as trace_file:
+            lines = [json.loads(line) for line in trace_file]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['user'], 'someone')
+
+    def test_returns_server_timing_if_asked_for(self):
+        config = {'file': self.filename}
+        self.trace.decide(config, '1')
+
+        self.assertIn('first;dur=', finish_trace(self.trace, config, self.logger))
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_logs_write_errors(self):
+        config = {'sample_rate': 1, 'file': os.path.join(self.directory, 'no', 'file')}
+        self.trace.decide(config, None)
+
+        finish_trace(self.trace, config, self.logger)
+
+        self.assertEqual(self.logger.warning.call_count, 1)